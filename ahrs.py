@@ -0,0 +1,330 @@
+# ahrs.py Orientation estimation from MPU9150 samples
+# Madgwick and Mahony filters after the reference implementations by S. Madgwick
+# http://www.x-io.co.uk/open-source-imu-and-ahrs-algorithms/
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Each update() reads the device with read_all(): one transaction for accel and gyro
+# (and the magnetometer in mag_master mode). The corrected vehicle relative values are
+# copied into preallocated arrays and the quaternion is updated in place: on the
+# Pyboard, where floats are not heap objects, an update does not allocate.
+# The magnetometer is used in one update in mag_every, and only if it has a new
+# sample. The other updates use the gyro and accelerometer alone.
+# Axes are those returned by the driver's Vector3d instances: see the Madgwick
+# notes in the README regarding the expected vehicle orientation.
+
+from array import array
+from math import sqrt, atan2, asin, degrees
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:                             # CPython: the simulation or Linux
+    from pybcompat import ticks_us, ticks_diff
+
+_DEG2RAD = 0.017453292519943295
+
+class _AHRS(object):
+    def __init__(self, imu, mag_every):
+        self.imu = imu
+        self.mag_every = mag_every              # 0 disables the magnetometer
+        self.q = array('f', (1, 0, 0, 0))       # Quaternion w, x, y, z
+        self._a = array('f', (0, 0, 0))
+        self._g = array('f', (0, 0, 0))
+        self._m = array('f', (0, 0, 0))
+        self._e = array('f', (0, 0, 0))
+        self._count = 0
+        self._last = None                       # ticks_us of previous update
+        self._mag_time = None                   # Magnetometer sample last used
+        self.update_us = 0                      # Time taken by the most recent filter update
+        self.updates = 0
+        self.mag_updates = 0
+        imu.ahrs = self
+
+    def reset(self):
+        q = self.q
+        q[0], q[1], q[2], q[3] = 1, 0, 0, 0
+        self._last = None
+
+    def update(self, read = True):
+        '''
+        Read the device (unless read is False: the caller has already done so) and
+        update the orientation. Returns the quaternion array.
+        '''
+        imu = self.imu
+        if read and not imu.read_all():         # Recovery failed: wait for good data
+            return self.q
+        now = ticks_us()
+        dt = 0 if self._last is None else ticks_diff(now, self._last) / 1000000
+        self._last = now
+        imu.accel.last_xyz_into(self._a)
+        imu.gyro.last_xyz_into(self._g)
+        usemag = False
+        if self.mag_every:
+            self._count += 1
+            if self._count >= self.mag_every:
+                self._count = 0
+                if not imu.mag_master:          # Nonblocking: retains last value if not ready
+                    imu._mag_callback()
+                if imu._mag_time is not None and imu._mag_time != self._mag_time:
+                    self._mag_time = imu._mag_time
+                    imu.mag_nonblocking.last_xyz_into(self._m)
+                    usemag = True
+        start = ticks_us()
+        if usemag:
+            self._update9(dt)
+            self.mag_updates += 1
+        else:
+            self._update6(dt)
+        self.update_us = ticks_diff(ticks_us(), start)
+        self.updates += 1
+        return self.q
+
+    @property
+    def quaternion(self):
+        q = self.q
+        return q[0], q[1], q[2], q[3]
+
+    def euler_into(self, buf):
+        '''
+        Write (heading, pitch, roll) in degrees into buf without allocation.
+        '''
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        buf[0] = degrees(atan2(2.0 * (q1 * q2 + q0 * q3), q0 * q0 + q1 * q1 - q2 * q2 - q3 * q3))
+        s = 2.0 * (q1 * q3 - q0 * q2)
+        buf[1] = -degrees(asin(1.0 if s > 1.0 else -1.0 if s < -1.0 else s))
+        buf[2] = degrees(atan2(2.0 * (q0 * q1 + q2 * q3), q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3))
+        return buf
+
+    @property
+    def euler(self):                            # (heading, pitch, roll) degrees
+        e = self.euler_into(self._e)
+        return e[0], e[1], e[2]
+
+    def _integrate(self, q0, q1, q2, q3):       # Normalise and store
+        norm = sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        q = self.q
+        q[0] = q0 / norm
+        q[1] = q1 / norm
+        q[2] = q2 / norm
+        q[3] = q3 / norm
+
+class Madgwick(_AHRS):
+    '''
+    Madgwick gradient descent filter. beta is the algorithm gain.
+    '''
+    def __init__(self, imu, beta = 0.1, mag_every = 1):
+        super().__init__(imu, mag_every)
+        self.beta = beta
+
+    def _update6(self, dt):
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        ax, ay, az = self._a[0], self._a[1], self._a[2]
+        gx, gy, gz = self._g[0] * _DEG2RAD, self._g[1] * _DEG2RAD, self._g[2] * _DEG2RAD
+        qd0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qd1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qd2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qd3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm:
+            ax /= norm
+            ay /= norm
+            az /= norm
+            _2q0 = 2 * q0
+            _2q1 = 2 * q1
+            _2q2 = 2 * q2
+            _2q3 = 2 * q3
+            _4q0 = 4 * q0
+            _4q1 = 4 * q1
+            _4q2 = 4 * q2
+            _8q1 = 8 * q1
+            _8q2 = 8 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = _4q1 * q3q3 - _2q3 * ax + 4 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+            s2 = 4 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+            s3 = 4 * q1q1 * q3 - _2q1 * ax + 4 * q2q2 * q3 - _2q2 * ay
+            norm = sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm:
+                beta = self.beta / norm
+                qd0 -= beta * s0
+                qd1 -= beta * s1
+                qd2 -= beta * s2
+                qd3 -= beta * s3
+        self._integrate(q0 + qd0 * dt, q1 + qd1 * dt, q2 + qd2 * dt, q3 + qd3 * dt)
+
+    def _update9(self, dt):
+        mx, my, mz = self._m[0], self._m[1], self._m[2]
+        ax, ay, az = self._a[0], self._a[1], self._a[2]
+        norm_m = sqrt(mx * mx + my * my + mz * mz)
+        norm_a = sqrt(ax * ax + ay * ay + az * az)
+        if not (norm_m and norm_a):
+            self._update6(dt)
+            return
+        mx /= norm_m
+        my /= norm_m
+        mz /= norm_m
+        ax /= norm_a
+        ay /= norm_a
+        az /= norm_a
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        gx, gy, gz = self._g[0] * _DEG2RAD, self._g[1] * _DEG2RAD, self._g[2] * _DEG2RAD
+        qd0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qd1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qd2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qd3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+        _2q0mx = 2 * q0 * mx
+        _2q0my = 2 * q0 * my
+        _2q0mz = 2 * q0 * mz
+        _2q1mx = 2 * q1 * mx
+        _2q0 = 2 * q0
+        _2q1 = 2 * q1
+        _2q2 = 2 * q2
+        _2q3 = 2 * q3
+        _2q0q2 = 2 * q0 * q2
+        _2q2q3 = 2 * q2 * q3
+        q0q0 = q0 * q0
+        q0q1 = q0 * q1
+        q0q2 = q0 * q2
+        q0q3 = q0 * q3
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q3q3 = q3 * q3
+        # Reference direction of Earth's magnetic field
+        hx = mx * q0q0 - _2q0my * q3 + _2q0mz * q2 + mx * q1q1 + _2q1 * my * q2 + _2q1 * mz * q3 - mx * q2q2 - mx * q3q3
+        hy = _2q0mx * q3 + my * q0q0 - _2q0mz * q1 + _2q1mx * q2 - my * q1q1 + my * q2q2 + _2q2 * mz * q3 - my * q3q3
+        _2bx = sqrt(hx * hx + hy * hy)
+        _2bz = -_2q0mx * q2 + _2q0my * q1 + mz * q0q0 + _2q1mx * q3 - mz * q1q1 + _2q2 * my * q3 - mz * q2q2 + mz * q3q3
+        _4bx = 2 * _2bx
+        _4bz = 2 * _2bz
+        # Gradient descent corrective step
+        ea = 2 * q1q3 - _2q0q2 - ax             # Objective function terms
+        eb = 2 * q0q1 + _2q2q3 - ay
+        ec = 1 - 2 * q1q1 - 2 * q2q2 - az
+        ex = _2bx * (0.5 - q2q2 - q3q3) + _2bz * (q1q3 - q0q2) - mx
+        ey = _2bx * (q1q2 - q0q3) + _2bz * (q0q1 + q2q3) - my
+        ez = _2bx * (q0q2 + q1q3) + _2bz * (0.5 - q1q1 - q2q2) - mz
+        s0 = -_2q2 * ea + _2q1 * eb - _2bz * q2 * ex + (-_2bx * q3 + _2bz * q1) * ey + _2bx * q2 * ez
+        s1 = _2q3 * ea + _2q0 * eb - 4 * q1 * ec + _2bz * q3 * ex + (_2bx * q2 + _2bz * q0) * ey + (_2bx * q3 - _4bz * q1) * ez
+        s2 = -_2q0 * ea + _2q3 * eb - 4 * q2 * ec + (-_4bx * q2 - _2bz * q0) * ex + (_2bx * q1 + _2bz * q3) * ey + (_2bx * q0 - _4bz * q2) * ez
+        s3 = _2q1 * ea + _2q2 * eb + (-_4bx * q3 + _2bz * q1) * ex + (-_2bx * q0 + _2bz * q2) * ey + _2bx * q1 * ez
+        norm = sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+        if norm:
+            beta = self.beta / norm
+            qd0 -= beta * s0
+            qd1 -= beta * s1
+            qd2 -= beta * s2
+            qd3 -= beta * s3
+        self._integrate(q0 + qd0 * dt, q1 + qd1 * dt, q2 + qd2 * dt, q3 + qd3 * dt)
+
+class Mahony(_AHRS):
+    '''
+    Mahony complementary filter with proportional gain kp and integral gain ki.
+    '''
+    def __init__(self, imu, kp = 1.0, ki = 0.0, mag_every = 1):
+        super().__init__(imu, mag_every)
+        self.kp = kp
+        self.ki = ki
+        self._i = array('f', (0, 0, 0))         # Integral of error
+
+    def reset(self):
+        super().reset()
+        for n in range(3):
+            self._i[n] = 0
+
+    def _feedback(self, dt, ex, ey, ez):        # Apply error and integrate quaternion
+        gx, gy, gz = self._g[0] * _DEG2RAD, self._g[1] * _DEG2RAD, self._g[2] * _DEG2RAD
+        if self.ki > 0:
+            i = self._i
+            i[0] += self.ki * ex * dt
+            i[1] += self.ki * ey * dt
+            i[2] += self.ki * ez * dt
+            gx += i[0]
+            gy += i[1]
+            gz += i[2]
+        gx = (gx + self.kp * ex) * 0.5 * dt
+        gy = (gy + self.kp * ey) * 0.5 * dt
+        gz = (gz + self.kp * ez) * 0.5 * dt
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        self._integrate(q0 - q1 * gx - q2 * gy - q3 * gz,
+                        q1 + q0 * gx + q2 * gz - q3 * gy,
+                        q2 + q0 * gy - q1 * gz + q3 * gx,
+                        q3 + q0 * gz + q1 * gy - q2 * gx)
+
+    def _update6(self, dt):
+        ax, ay, az = self._a[0], self._a[1], self._a[2]
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if not norm:
+            self._feedback(dt, 0, 0, 0)
+            return
+        ax /= norm
+        ay /= norm
+        az /= norm
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        vx = q1 * q3 - q0 * q2                  # Half the estimated direction of gravity
+        vy = q0 * q1 + q2 * q3
+        vz = q0 * q0 - 0.5 + q3 * q3
+        self._feedback(dt, 2 * (ay * vz - az * vy), 2 * (az * vx - ax * vz), 2 * (ax * vy - ay * vx))
+
+    def _update9(self, dt):
+        mx, my, mz = self._m[0], self._m[1], self._m[2]
+        ax, ay, az = self._a[0], self._a[1], self._a[2]
+        norm_m = sqrt(mx * mx + my * my + mz * mz)
+        norm_a = sqrt(ax * ax + ay * ay + az * az)
+        if not (norm_m and norm_a):
+            self._update6(dt)
+            return
+        mx /= norm_m
+        my /= norm_m
+        mz /= norm_m
+        ax /= norm_a
+        ay /= norm_a
+        az /= norm_a
+        q0, q1, q2, q3 = self.q[0], self.q[1], self.q[2], self.q[3]
+        q0q0 = q0 * q0
+        q0q1 = q0 * q1
+        q0q2 = q0 * q2
+        q0q3 = q0 * q3
+        q1q1 = q1 * q1
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q2q2 = q2 * q2
+        q2q3 = q2 * q3
+        q3q3 = q3 * q3
+        # Reference direction of Earth's magnetic field
+        hx = 2 * (mx * (0.5 - q2q2 - q3q3) + my * (q1q2 - q0q3) + mz * (q1q3 + q0q2))
+        hy = 2 * (mx * (q1q2 + q0q3) + my * (0.5 - q1q1 - q3q3) + mz * (q2q3 - q0q1))
+        bx = sqrt(hx * hx + hy * hy)
+        bz = 2 * (mx * (q1q3 - q0q2) + my * (q2q3 + q0q1) + mz * (0.5 - q1q1 - q2q2))
+        vx = q1q3 - q0q2                        # Half the estimated directions of gravity
+        vy = q0q1 + q2q3                        # and magnetic field
+        vz = q0q0 - 0.5 + q3q3
+        wx = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2)
+        wy = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3)
+        wz = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2)
+        self._feedback(dt, 2 * ((ay * vz - az * vy) + (my * wz - mz * wy)),
+                       2 * ((az * vx - ax * vz) + (mz * wx - mx * wz)),
+                       2 * ((ax * vy - ay * vx) + (mx * wy - my * wx)))
@@ -0,0 +1,130 @@
+# asyncmpu.py uasyncio interface to the MPU9150
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Waits yield to the scheduler instead of blocking: the magnetometer conversion is
+# awaited with sleeps and, when data ready interrupts are running (irq_start()),
+# samples are awaited from the interrupt ring buffer. Where uasyncio provides
+# ThreadSafeFlag the interrupt handler wakes the waiting task, otherwise the ring
+# buffer is polled every millisecond. This is a separate module because the async
+# syntax is not supported by older firmware.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+try:
+    sleep_ms = asyncio.sleep_ms
+except AttributeError:                          # CPython
+    async def sleep_ms(ms):
+        await asyncio.sleep(ms / 1000)
+try:
+    from time import ticks_us, ticks_diff, ticks_add
+except ImportError:                             # CPython: the simulation or Linux
+    from pybcompat import ticks_us, ticks_diff, ticks_add
+
+class _Stream(object):                          # Asynchronous iterator returned by stream()
+    def __init__(self, amp, rate):
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+        self._amp = amp
+        self._period = int(1000000 / rate)      # us
+        self._due = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        amp = self._amp
+        if amp.imu._extint is not None:         # Interrupts running: device sets the rate
+            return await amp._irq_sample()
+        now = ticks_us()
+        if self._due is None:
+            self._due = now
+        else:
+            self._due = ticks_add(self._due, self._period)
+            wait = ticks_diff(self._due, now)
+            if wait > 0:
+                await sleep_ms(wait // 1000)
+            elif wait < -self._period:          # Fallen behind: don't try to catch up
+                self._due = now
+        amp.imu.read_all()
+        return amp._sample()
+
+class AsyncMPU(object):
+    '''
+    Wraps an MPU9150 instance providing coroutines which yield to the scheduler
+    while waiting for data. The instance remains usable for synchronous access.
+    '''
+    def __init__(self, imu):
+        self.imu = imu
+
+    def _sample(self):
+        imu = self.imu
+        return imu.accel.last_xyz, imu.gyro.last_xyz, imu.last_temperature
+
+    async def read_mag(self):
+        '''
+        Return the magnetometer (x, y, z). If a conversion is required the task
+        sleeps until it is complete (up to 9mS).
+        '''
+        imu = self.imu
+        if not imu.mag_master and not imu.mag_ready: # Starts a conversion if necessary
+            await sleep_ms(7)                   # Typical conversion time
+            while not imu.mag_ready:
+                await sleep_ms(1)
+        imu._mag_callback()
+        return imu.mag_nonblocking.last_xyz
+
+    async def read_all(self):
+        '''
+        Read accelerometer, gyro and temperature (and in mag_master mode the
+        magnetometer). Returns ((ax, ay, az), (gx, gy, gz), temperature). If data ready
+        interrupts are running the next interrupt's sample is awaited.
+        '''
+        if self.imu._extint is not None:
+            return await self._irq_sample()
+        self.imu.read_all()
+        return self._sample()
+
+    def stream(self, rate):
+        '''
+        Return an asynchronous iterator yielding samples as returned by read_all() at
+        rate Hz. If data ready interrupts are running every captured sample is yielded
+        and the device's sample rate applies.
+        '''
+        return _Stream(self, rate)
+
+    async def _irq_sample(self):                # Await the next sample from the ISR
+        imu = self.imu
+        frame = imu._irq_dest
+        flag = imu._irq_flag
+        if flag is None and hasattr(asyncio, 'ThreadSafeFlag'):
+            flag = asyncio.ThreadSafeFlag()
+            imu._irq_flag = flag
+        while not imu.irq_get(frame):
+            if flag is None:
+                await sleep_ms(1)
+            else:
+                await flag.wait()
+        imu.load_frame(frame)
+        return self._sample()
@@ -0,0 +1,142 @@
+# decoder.py Batch decoding of raw MPU9150 sample frames
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# A frame has the layout of registers 0x3B-0x48 (accel, temperature, gyro: big endian)
+# optionally followed by the 8 bytes read from the AK8975 by the I2C master (ST1,
+# little endian HX, HY, HZ, ST2). This is the layout of FIFO frames and of read_all().
+# Decoding a buffer of frames uses one struct.unpack_from() call per frame (two with
+# the magnetometer) or, where NumPy is available, a single structured frombuffer().
+
+from array import array
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class FrameDecoder(object):
+    '''
+    Decodes up to maxframes frames into preallocated per-axis arrays: ax, ay, az,
+    temp, gx, gy, gz and, if mag is True, mx, my, mz. Magnetometer values are in the
+    AK8975's axes, as held in the mag Vector3d's ixyz: its transform aligns them with
+    the accelerometer's. A frame whose magnetometer data is not
+    ready or in error retains the previous good value and is counted in mag_stale.
+    '''
+    def __init__(self, maxframes, mag = False, use_numpy = True):
+        self.maxframes = maxframes
+        self.mag = mag
+        self.framelen = 22 if mag else 14
+        self._numpy = numpy is not None and use_numpy
+        names = ('ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz')
+        if mag:
+            names += ('mx', 'my', 'mz')
+        self.names = names
+        for name in names:
+            if self._numpy:
+                setattr(self, name, numpy.zeros(maxframes, dtype = numpy.int16))
+            else:
+                setattr(self, name, array('h', [0]*maxframes))
+        self.mag_stale = 0
+        self._last = [0, 0, 0]                  # Last good mag values
+        if self._numpy:
+            fields = [('a', '>i2', (3,)), ('t', '>i2'), ('g', '>i2', (3,))]
+            if mag:
+                fields += [('st1', 'u1'), ('m', '<i2', (3,)), ('st2', 'u1')]
+            self._dtype = numpy.dtype(fields)
+
+    def decode(self, buf, nframes, index = 0):
+        '''
+        Decode nframes frames from buf (bytes, bytearray or memoryview) into the
+        arrays starting at index. Returns the index following the last frame written.
+        '''
+        if index + nframes > self.maxframes:
+            raise ValueError('Too many frames for decoder')
+        if self._numpy:
+            return self._decode_numpy(buf, nframes, index)
+        unpack_from = struct.unpack_from
+        ax, ay, az, temp = self.ax, self.ay, self.az, self.temp
+        gx, gy, gz = self.gx, self.gy, self.gz
+        mag = self.mag
+        if mag:
+            mx, my, mz = self.mx, self.my, self.mz
+            last = self._last
+        framelen = self.framelen
+        offs = 0
+        for n in range(index, index + nframes):
+            v = unpack_from('>7h', buf, offs)
+            ax[n] = v[0]
+            ay[n] = v[1]
+            az[n] = v[2]
+            temp[n] = v[3]
+            gx[n] = v[4]
+            gy[n] = v[5]
+            gz[n] = v[6]
+            if mag:
+                m = unpack_from('<B3hB', buf, offs + 14)
+                if m[0] & 1 and not m[4] & 0x0C:
+                    last[0] = m[1]
+                    last[1] = m[2]
+                    last[2] = m[3]
+                else:
+                    self.mag_stale += 1
+                mx[n] = last[0]
+                my[n] = last[1]
+                mz[n] = last[2]
+            offs += framelen
+        return index + nframes
+
+    def _decode_numpy(self, buf, nframes, index):
+        rec = numpy.frombuffer(buf, dtype = self._dtype, count = nframes)
+        end = index + nframes
+        self.ax[index:end] = rec['a'][:, 0]
+        self.ay[index:end] = rec['a'][:, 1]
+        self.az[index:end] = rec['a'][:, 2]
+        self.temp[index:end] = rec['t']
+        self.gx[index:end] = rec['g'][:, 0]
+        self.gy[index:end] = rec['g'][:, 1]
+        self.gz[index:end] = rec['g'][:, 2]
+        if self.mag:
+            valid = ((rec['st1'] & 1) != 0) & ((rec['st2'] & 0x0C) == 0)
+            self.mag_stale += nframes - int(valid.sum())
+            m = numpy.empty((nframes + 1, 3), dtype = numpy.int16)
+            m[0] = self._last                   # Forward fill invalid frames from last good
+            m[1:] = rec['m']
+            idx = numpy.where(numpy.concatenate(([True], valid)), numpy.arange(nframes + 1), 0)
+            m = m[numpy.maximum.accumulate(idx)]
+            self.mx[index:end] = m[1:, 0]
+            self.my[index:end] = m[1:, 1]
+            self.mz[index:end] = m[1:, 2]
+            self._last[:] = [int(x) for x in m[-1]]
+        return end
+
+    def frame(self, n, dest):
+        '''
+        Copy decoded frame n into dest in the order (ax, ay, az, temp, gx, gy, gz[,
+        mx, my, mz]) as used by the ring buffers and load_frame().
+        '''
+        for k, name in enumerate(self.names):
+            dest[k] = getattr(self, name)[n]
+        return dest
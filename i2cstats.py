@@ -0,0 +1,107 @@
+# i2cstats.py I2C transaction statistics for the InvenSense drivers
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Counters are held in preallocated arrays so that record() and error() do not
+# allocate: transactions performed by get_accel_irq() etc. in an interrupt handler
+# are counted. Registers of the IMU are counted at index memaddr, those of any other
+# device (the magnetometer in bypass mode) at 128 + memaddr. The latency total is
+# held in two words so that it does not become a long integer.
+
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
+from array import array
+
+_ETIMEDOUT = (110, 116)                         # Linux and MicroPython (older ports use 116)
+_NACK = (5, 6, 19, 121)                         # Device did not acknowledge: EIO, ENXIO, ENODEV, EREMOTEIO
+
+class I2CStats(object):
+    buckets = (100, 200, 500, 1000, 2000, 5000, 10000) # Latency histogram upper limits in us
+    def __init__(self, mpu_addr):
+        self.mpu_addr = mpu_addr
+        self._txn = array('I', [0]*256)         # Transactions per register
+        self._bytes = array('I', [0]*256)
+        self._hist = array('I', [0]*(len(self.buckets) + 1))
+        self._lat = array('I', [0]*4)           # min, max, total low 30 bits, total high bits
+        self._err = array('I', [0]*3)           # Timeouts, NACKs, other errors
+        self.reset()
+
+    def reset(self):
+        for arr in (self._txn, self._bytes, self._hist, self._lat, self._err):
+            for n in range(len(arr)):
+                arr[n] = 0
+        self._lat[0] = 0x3fffffff               # Remains a small integer
+        self.last_errno = None
+        self._start = pyb.micros()
+
+    def record(self, addr, memaddr, nbytes, us):
+        idx = memaddr if addr == self.mpu_addr else memaddr | 0x80
+        self._txn[idx] += 1
+        self._bytes[idx] += nbytes
+        lat = self._lat
+        if us < lat[0]:
+            lat[0] = us
+        if us > lat[1]:
+            lat[1] = us
+        lat[2] += us
+        if lat[2] >= 0x40000000:                # Carry
+            lat[2] -= 0x40000000
+            lat[3] += 1
+        n = 0
+        for limit in self.buckets:
+            if us < limit:
+                break
+            n += 1
+        self._hist[n] += 1
+
+    def error(self, exc):
+        code = exc.args[0] if len(exc.args) else None
+        self.last_errno = code
+        self._err[0 if code in _ETIMEDOUT else 1 if code in _NACK else 2] += 1
+
+    def snapshot(self, framelen = 14):
+        '''
+        Return a dict of the statistics since the last reset. framelen is the FIFO
+        frame length, used to count samples read from the FIFO.
+        '''
+        elapsed = pyb.elapsed_micros(self._start)
+        txn = self._txn
+        nbytes = self._bytes
+        count = sum(txn)
+        lat = self._lat
+        total = lat[3] * 0x40000000 + lat[2]
+        regs = {}
+        for idx in range(256):
+            if txn[idx]:
+                dev = 'mpu' if idx < 0x80 else 'aux'
+                regs[(dev, idx & 0x7F)] = (txn[idx], nbytes[idx])
+        samples = txn[0x3B] + nbytes[0x74] // framelen # Burst or accel reads and FIFO frames
+        return {'elapsed_us' : elapsed, 'transactions' : count, 'bytes' : sum(nbytes),
+                'registers' : regs,
+                'latency_us' : {'min' : lat[0] if count else None, 'max' : lat[1],
+                                'avg' : total / count if count else None, 'total' : total},
+                'histogram' : list(zip(self.buckets + (None,), self._hist)),
+                'timeouts' : self._err[0], 'nacks' : self._err[1], 'other_errors' : self._err[2],
+                'last_errno' : self.last_errno, 'bus_load' : total / elapsed if elapsed else 0,
+                'samples' : samples, 'sample_rate' : samples * 1000000 / elapsed if elapsed else 0}
@@ -37,8 +37,22 @@ THE SOFTWARE.
 # At runtime try to continue returning last good data value. We don't want aircraft
 # crashing. However if the I2C has crashed we're probably stuffed.
 
-import pyb
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
+try:
+    import micropython
+except ImportError:                             # CPython: data ready interrupts need pyb
+    micropython = None
+from transport import get_transport
 from vector3d import Vector3d
+from ringbuf import RingBuffer
+from i2cstats import I2CStats
+try:
+    import json
+except ImportError:
+    import ujson as json
 
 class MPUException(OSError):
     pass
@@ -58,24 +72,69 @@ class InvenSenseMPU(object):
     Module for InvenSense 9DOF IMUs. Base class implements features common to MPU9150 and MPU9250.
     '''
     _I2Cerror = "I2C failure when communicating with IMU"
-    def __init__(self, side_str, device_addr, transposition, scaling):
+    _accel_lsb = (16384, 8192, 4096, 2048)      # LSB per g for each accel_range
+    _gyro_lsb = (131, 65.5, 32.8, 16.4)         # LSB per degree/s for each gyro_range
+    _qbits = 16                                 # Fraction bits of fixed point values
+    def __init__(self, side_str, device_addr, transposition, scaling, profile = None):
+        self._mounted = transposition is not None or scaling is not None # Overrides a profile's mounting
+        if transposition is None:
+            transposition = (0, 1, 2)
+        if scaling is None:
+            scaling = (1, 1, 1)
         self._accel = Vector3d(transposition, scaling, self._accel_callback)
         self._gyro = Vector3d(transposition, scaling, self._gyro_callback)
         self.buf1 = bytearray([0]*1)            # Pre-allocated buffers for reads: allows reads to
         self.buf2 = bytearray([0]*2)            # be done in interrupt handlers
         self.buf3 = bytearray([0]*3)
         self.buf6 = bytearray([0]*6)
+        self.buf14 = bytearray([0]*14)          # Accel, temperature and gyro in one transaction
+        self._allbuf = self.buf14               # Buffer for read_all(): subclass may extend it
+        self._itemp = 0                         # Raw and converted temperature from read_all()
+        self._temp = 0
+        self._shadow = bytearray(0x80)          # Copy of configuration registers
+        self._cached = bytearray(0x80)          # Nonzero where _shadow holds the device value
+        self._extint = None                     # Data ready interrupts: see irq_start()
+        self._irq_flag = None                   # Optional ThreadSafeFlag set by the ISR
+        self.ahrs = None                        # Orientation filter: see ahrs.py
+        self._stats = None                      # I2C statistics: see instrument
+        self._instrumented = False
+        self._io_bound = False                  # _read and _write are shadowed
+        self._budget = None                     # Fault recovery: see recovery_budget
+        self._stale_count = 0
+        self.retries = 0
+        self.bus_resets = 0
+        self.restores = 0
+        self.recovery_failures = 0
+        self._max_age = None                    # Sample epochs: see sample()
+        self._epoch_time = None
+        self.epoch = 0
+        self._fifo_ring = None                  # FIFO streaming: see fifo_start()
+        self._fifo_en = 0xF8                    # FIFO_EN: temp, gyro, accel. Same order as 0x3B-0x48
+        self._fifo_framelen = 14                # Bytes per FIFO frame
+        self._frame_width = 7                   # Integers per decoded frame
+        self.fifo_overflows = 0
         self.timeout = 10                       # I2C tieout mS
 
+        self._mpu_i2c = get_transport(side_str) # Initialise I2C: see transport.py
+        self._side = self._mpu_i2c.name
+
+        self._profile = None                    # Saved profile if a warm start succeeded
+        if profile is not None:
+            prof = self._load_profile(profile, device_addr)
+            if prof is not None:
+                self.mpu_addr = prof['addr']
+                try:
+                    self._warm_start(prof)
+                    self._profile = prof
+                except (OSError, ValueError):   # Not responding: may be powering up. Cold start.
+                    self._cached = bytearray(0x80)
+        if self._profile is not None:
+            return
+
         tim = pyb.millis()                      # Ensure PSU and device have settled
         if tim < 200:
             pyb.delay(200-tim)
 
-        try:                                    # Initialise I2C
-            side = {'X':1, 'Y':2}[side_str.upper()]
-        except KeyError:
-            raise ValueError('I2C side must be X or Y')
-        self._mpu_i2c = pyb.I2C(side, pyb.I2C.MASTER)
         if device_addr is None:
             devices = set(self._mpu_i2c.scan())
             mpus = devices.intersection(set(self._mpu_addr))
@@ -98,6 +157,86 @@ class InvenSenseMPU(object):
         self.accel_range = 0                    # default to highest sensitivity
         self.gyro_range = 0                     # Likewise for gyro
 
+    # Warm start. A profile saved by save_profile() holds the device address, the
+    # configuration registers and calibration data. A constructor passed the profile
+    # skips the settling delay, the bus scan and the per-register setup: after reading
+    # chip_id the registers are restored with one write per contiguous block.
+    _profile_version = 2                        # 2: magnetometer calibration is in AK8975 axes
+
+    @property
+    def warm_start(self):                       # True if the constructor used a saved profile
+        return self._profile is not None
+
+    def _load_profile(self, filename, device_addr):
+        '''
+        Return the profile saved in filename or None if it is absent, invalid or
+        was saved for a different device.
+        '''
+        try:
+            with open(filename) as f:
+                prof = json.load(f)
+            if prof['version'] != self._profile_version or prof['chip_id'] != self._chip_id:
+                return None
+            if prof['side'] != self._side or prof['addr'] not in self._mpu_addr:
+                return None
+            if device_addr is not None and prof['addr'] != self._mpu_addr[device_addr]:
+                return None
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+        return prof
+
+    def _warm_start(self, prof):
+        temp = self.chip_id                     # Throws exception on error
+        for start, data in prof['regs']:        # PWR_MGMT_1 is in the last block: wakes device
+            buf = bytearray(data)
+            if start <= 0x6A < start + len(buf):
+                buf[0x6A - start] |= 0x04       # FIFO is disabled: discard stale contents
+            try:
+                self._write(buf, start, self.mpu_addr)
+            except OSError:
+                raise MPUException(self._I2Cerror)
+            for n in range(len(data)):
+                self._shadow[start + n] = data[n]
+                self._cached[start + n] = 1
+        self._ar = self._shadow[0x1C] // 8
+        self._gr = self._shadow[0x1B] // 8
+        self._accel_fixed()
+        self._gyro_fixed()
+        self._accel.cal = prof['accel_cal']
+        self._gyro.cal = prof['gyro_cal']
+        if not self._mounted:                   # Constructor arguments take precedence
+            self._accel.mounting = prof['accel_mounting']
+            self._gyro.mounting = prof['gyro_mounting']
+
+    def _profile_data(self):
+        '''
+        Return the profile as a dict. FIFO and interrupt operation are excluded: the
+        application restarts these. Subclasses add device specific data.
+        '''
+        self.refresh()                          # Ensure every register is known
+        mask = {0x23 : 0, 0x37 : ~0x30, 0x38 : 0, 0x6A : ~0x47, 0x6B : ~0xC0}
+        regs = []
+        for start, length in self._shadow_blocks:
+            data = list(self._shadow[start : start + length])
+            for n in range(length):             # FIFO, interrupt, reset and sleep bits off
+                if start + n in mask:
+                    data[n] &= mask[start + n]
+            regs.append([start, data])
+        return {'version' : self._profile_version, 'chip_id' : self._chip_id,
+                'side' : self._side, 'addr' : self.mpu_addr, 'regs' : regs,
+                'accel_cal' : list(self._accel.cal), 'gyro_cal' : list(self._gyro.cal),
+                'accel_mounting' : [list(row) for row in self._accel.mounting],
+                'gyro_mounting' : [list(row) for row in self._gyro.mounting]}
+
+    def save_profile(self, filename):
+        '''
+        Save the device address, configuration and calibration to filename (e.g. on
+        the Pyboard's flash) for use in a subsequent warm start.
+        '''
+        prof = self._profile_data()
+        with open(filename, 'w') as f:
+            json.dump(prof, f)
+
     def _read(self, buf, memaddr, addr):        # addr = I2C device address, memaddr = memory location within the I2C device
         '''
         Read bytes to pre-allocated buffer Caller traps OSError.
@@ -111,15 +250,281 @@ class InvenSenseMPU(object):
         '''
         self._mpu_i2c.mem_write(data, addr, memaddr, timeout=self.timeout)
 
-    # wake
-    def wake(self):
+    _read_irq = _read                           # For interrupt handlers: never recover (see _bind_io())
+    _write_irq = _write
+
+    # Instrumentation. When enabled, instance attributes shadow _read() and _write()
+    # with versions which update an I2CStats instance: when disabled the plain methods
+    # are called so there is no overhead.
+    @property
+    def instrument(self):                       # True if I2C statistics are being gathered
+        return self._instrumented
+
+    @instrument.setter
+    def instrument(self, on):
+        if on and self._stats is None:
+            self._stats = I2CStats(self.mpu_addr)
+        self._instrumented = bool(on)
+        self._bind_io()
+
+    def _bind_io(self):                         # Shadow _read() and _write() as features require
+        if self._io_bound:
+            del self._read
+            del self._write
+            del self._read_irq
+            del self._write_irq
+        read, write = self._read, self._write   # The plain methods
+        if self._instrumented:
+            read, write = self._read_counted, self._write_counted
+        self._io_bound = self._instrumented or self._budget is not None
+        if self._io_bound:                      # Recovery allocates and may block: not in an ISR
+            self._read_irq, self._write_irq = read, write
+        if self._budget is not None:            # Recovery calls the instrumented or plain method
+            self._read_once, self._write_once = read, write
+            read, write = self._read_recover, self._write_recover
+        if self._io_bound:
+            self._read, self._write = read, write
+
+    def stats(self, reset = False):
         '''
-        Wakes the device.
+        Return a dict of I2C statistics since instrumentation was enabled or last
+        reset. Returns None if it has never been enabled.
+        '''
+        if self._stats is None:
+            return None
+        res = self._stats.snapshot(self._fifo_framelen)
+        if reset:
+            self._stats.reset()
+        return res
+
+    def _read_counted(self, buf, memaddr, addr):
+        start = pyb.micros()
+        try:
+            self._mpu_i2c.mem_read(buf, addr, memaddr, timeout=self.timeout)
+        except OSError as e:
+            self._stats.error(e)
+            raise
+        self._stats.record(addr, memaddr, len(buf), pyb.elapsed_micros(start))
+
+    def _write_counted(self, data, memaddr, addr):
+        start = pyb.micros()
+        try:
+            self._mpu_i2c.mem_write(data, addr, memaddr, timeout=self.timeout)
+        except OSError as e:
+            self._stats.error(e)
+            raise
+        self._stats.record(addr, memaddr, 1 if type(data) is int else len(data), pyb.elapsed_micros(start))
+
+    # Fault recovery. When a recovery budget is set a failed transaction is retried
+    # with escalating measures until it succeeds or the budget is spent: first a plain
+    # retry, then a bus unlock and re-initialisation of the I2C peripheral, then on
+    # each further failure the cached configuration is rewritten if the device has
+    # lost it. If the budget is spent the OSError propagates: data reads then retain
+    # the last good values and set the stale flag rather than raising MPUException.
+
+    @property
+    def recovery_budget(self):
+        '''
+        Time in us which a transaction may spend on retries and recovery, or None
+        (default) if failures raise MPUException immediately.
+        '''
+        return self._budget
+
+    @recovery_budget.setter
+    def recovery_budget(self, us):
+        if us is not None and us < 0:
+            raise ValueError('recovery_budget must be None or >= 0')
+        self._budget = us
+        self._bind_io()
+
+    @property
+    def stale(self):                            # True if the last data read failed
+        return self._stale_count > 0
+
+    @property
+    def stale_count(self):                      # Consecutive failed data reads
+        return self._stale_count
+
+    def _data_error(self):                      # A data read failed
+        if self._budget is None:
+            raise MPUException(self._I2Cerror)
+        self._stale_count += 1                  # Recovery enabled: retain last good values
+
+    def _read_recover(self, buf, memaddr, addr):
+        start = pyb.micros()
+        level = 0
+        while True:
+            try:
+                self._read_once(buf, memaddr, addr)
+                return
+            except OSError:
+                if pyb.elapsed_micros(start) >= self._budget:
+                    self.recovery_failures += 1
+                    raise
+            level = self._recover(level)
+
+    def _write_recover(self, data, memaddr, addr):
+        start = pyb.micros()
+        level = 0
+        while True:
+            try:
+                self._write_once(data, memaddr, addr)
+                return
+            except OSError:
+                if pyb.elapsed_micros(start) >= self._budget:
+                    self.recovery_failures += 1
+                    raise
+            level = self._recover(level)
+
+    def _recover(self, level):                  # Take the next recovery measure
+        try:
+            if level == 0:
+                self.retries += 1
+            elif level == 1:
+                self.bus_resets += 1
+                self._bus_reset()
+            elif self._restore():
+                self.restores += 1
+        except OSError:
+            pass
+        return min(level + 1, 2)
+
+    def _bus_reset(self):
+        '''
+        Release a bus held by a slave which stopped mid byte and re-initialise the
+        peripheral. What is possible depends on the transport.
+        '''
+        self._mpu_i2c.reset()
+
+    def _restore(self):
+        '''
+        If the device has lost its configuration, e.g. after a brownout reset, write
+        the cached registers. Returns True if this was done.
+        '''
+        self._read_once(self.buf1, 0x6B, self.mpu_addr)
+        if not self._cached[0x6B] or self.buf1[0] == self._shadow[0x6B]:
+            return False
+        for start, length in self._shadow_blocks: # PWR_MGMT_1 is in the last block
+            reg = start
+            while reg < start + length:
+                if not self._cached[reg]:
+                    reg += 1
+                    continue
+                end = reg
+                while end < start + length and self._cached[end]:
+                    end += 1
+                buf = bytearray(self._shadow[reg : end])
+                if reg <= 0x6A < end:
+                    buf[0x6A - reg] |= 0x04     # Discard FIFO contents
+                self._write_once(buf, reg, self.mpu_addr)
+                reg = end
+        self._restored()
+        return True
+
+    def _restored(self):                        # Subclass hook: device state was rewritten
+        pass
+
+    def _was_reset(self):
+        '''
+        A device which has been reset is asleep and returns zeros from every data
+        register. If read_all() sees this, rewrite the configuration.
+        '''
+        buf = self._allbuf
+        for n in range(14):
+            if buf[n]:
+                return False
+        self._recover(2)
+        return True
+
+    # Shadow copy of configuration registers. Getters are served from the copy and
+    # setters only write if the value changes. refresh() and verify() resynchronise
+    # with the device e.g. after a reset or brown-out.
+    _shadow_blocks = ((0x19, 4), (0x23, 18), (0x37, 2), (0x63, 5), (0x6A, 2)) # (start, length)
+
+    def _setreg(self, reg, val):
+        '''
+        Write a configuration register unless the shadow copy shows it already holds val.
         '''
+        if self._cached[reg] and self._shadow[reg] == val:
+            return
         try:
-            self._write(0x01, 0x6B, self.mpu_addr) # Use best clock source
+            self._write(val, reg, self.mpu_addr)
         except OSError:
+            self._cached[reg] = 0               # Device state unknown
             raise MPUException(self._I2Cerror)
+        self._shadow[reg] = val
+        self._cached[reg] = 1
+
+    def _getreg(self, reg):
+        '''
+        Return a configuration register from the shadow copy, reading the device only
+        if its value is not yet known.
+        '''
+        if not self._cached[reg]:
+            try:
+                self._read(self.buf1, reg, self.mpu_addr)
+            except OSError:
+                raise MPUException(self._I2Cerror)
+            self._shadow[reg] = self.buf1[0]
+            self._cached[reg] = 1
+        return self._shadow[reg]
+
+    def _read_blocks(self):
+        '''
+        Read the shadowed register blocks from the device. Returns a list of
+        (buf, addr, start). Batched by transports which support it.
+        '''
+        reqs = [(bytearray(length), self.mpu_addr, start) for start, length in self._shadow_blocks]
+        try:
+            if self._io_bound:                  # Instrumentation and recovery act per transaction
+                for buf, addr, start in reqs:
+                    self._read(buf, start, addr)
+            else:
+                self._mpu_i2c.mem_read_batch(reqs, self.timeout)
+        except OSError:
+            raise MPUException(self._I2Cerror)
+        return reqs
+
+    def refresh(self):
+        '''
+        Reload the shadow copy of the configuration registers from the device.
+        '''
+        for buf, _, start in self._read_blocks():
+            for n in range(len(buf)):
+                self._shadow[start + n] = buf[n]
+                self._cached[start + n] = 1
+        self._ar = self._shadow[0x1C] // 8
+        self._gr = self._shadow[0x1B] // 8
+        self._accel_fixed()
+        self._gyro_fixed()
+
+    def verify(self, restore = True):
+        '''
+        Compare the device configuration registers with the shadow copy. Returns
+        the number which differ. If restore is True these are rewritten from the copy.
+        '''
+        bad = []
+        for buf, _, start in self._read_blocks():
+            for n in range(len(buf)):
+                reg = start + n
+                if self._cached[reg] and buf[n] != self._shadow[reg]:
+                    bad.append(reg)
+        if restore and bad:
+            if 0x6B in bad:                     # Wake the device before configuring it
+                bad.remove(0x6B)
+                bad.insert(0, 0x6B)
+            for reg in bad:
+                self._cached[reg] = 0           # Force the write
+                self._setreg(reg, self._shadow[reg])
+        return len(bad)
+
+    # wake
+    def wake(self):
+        '''
+        Wakes the device.
+        '''
+        self._cached[0x6B] = 0                  # A command: always write
+        self._setreg(0x6B, 0x01)                # Use best clock source
         return 'awake'
 
     # mode
@@ -127,10 +532,8 @@ class InvenSenseMPU(object):
         '''
         Sets the device to sleep mode.
         '''
-        try:
-            self._write(0x40, 0x6B, self.mpu_addr)
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        self._cached[0x6B] = 0                  # A command: always write
+        self._setreg(0x6B, 0x40)
         return 'asleep'
 
     # chip_id
@@ -151,21 +554,14 @@ class InvenSenseMPU(object):
         '''
         Returns passthrough mode True or False
         '''
-        try:
-            self._read(self.buf1, 0x37, self.mpu_addr)
-            return self.buf1[0] & 0x02 > 0
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        return self._getreg(0x37) & 0x02 > 0
 
     @passthrough.setter
     def passthrough(self, mode):
         if type(mode) is bool:
             val = 2 if mode else 0
-            try:
-                self._write(val, 0x37, self.mpu_addr) # I think this is right.
-                self._write(0x00, 0x6A, self.mpu_addr)
-            except OSError:
-                raise MPUException(self._I2Cerror)
+            self._setreg(0x37, (self._getreg(0x37) & ~0x02) | val) # Retain interrupt settings
+            self._setreg(0x6A, self._getreg(0x6A) & ~0x20) # Disable I2C master
         else:
             raise ValueError('pass either True or False')
 
@@ -177,11 +573,7 @@ class InvenSenseMPU(object):
         SAMPLE_RATE= Internal_Sample_Rate / (1 + rate)
         default rate is zero i.e. sample at internal rate.
         '''
-        try:
-            self._read(self.buf1, 0x19, self.mpu_addr)
-            return self.buf1[0]
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        return self._getreg(0x19)
 
     @sample_rate.setter
     def sample_rate(self, rate):
@@ -190,10 +582,7 @@ class InvenSenseMPU(object):
         '''
         if rate < 0 or rate >255:
             raise ValueError("Rate must be in range 0-255")
-        try:
-            self._write(rate, 0x19, self.mpu_addr)
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        self._setreg(0x19, rate)
 
     # accelerometer range
     @property
@@ -203,23 +592,19 @@ class InvenSenseMPU(object):
         Value:              0   1   2   3
         for range +/-:      2   4   8   16  g 
         '''
-        try:
-            self._read(self.buf1, 0x1C, self.mpu_addr)
-            ari = self.buf1[0]//8
-            self._ar = ari # if read succeeded
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        ari = self._getreg(0x1C)//8
+        if ari != self._ar:                     # Register was reread and has changed
+            self._ar = ari
+            self._accel_fixed()
         return ari
 
     @accel_range.setter
     def accel_range(self, accel_range):
         ar = (0x00, 0x08, 0x10, 0x18)
         if accel_range in range(len(ar)):
-            try:
-                self._write(ar[accel_range], 0x1C, self.mpu_addr)
-                self._ar = accel_range # if write succeeded
-            except OSError:
-                raise MPUException(self._I2Cerror)
+            self._setreg(0x1C, ar[accel_range])
+            self._ar = accel_range # if write succeeded
+            self._accel_fixed()
         else:
             raise ValueError('accel_range can only be 0, 1, 2 or 3')
 
@@ -231,26 +616,43 @@ class InvenSenseMPU(object):
         Pass:               0   1   2    3
         for range +/-:      250 500 1000 2000  degrees/second
         '''
-        # set range
-        try:
-            self._read(self.buf1, 0x1B, self.mpu_addr)
-            gri = self.buf1[0]//8
-            self._gr = gri # if read succeeded
-        except OSError:
-            raise MPUException(self._I2Cerror)
+        gri = self._getreg(0x1B)//8
+        if gri != self._gr:                     # Register was reread and has changed
+            self._gr = gri
+            self._gyro_fixed()
         return gri
 
     @gyro_range.setter
     def gyro_range(self, gyro_range):
         gr = (0x00, 0x08, 0x10, 0x18)
         if gyro_range in range(len(gr)):
-            try:
-                self._write(gr[gyro_range], 0x1B, self.mpu_addr) # Sets fchoice = b11 which enables filter
-                self._gr = gyro_range               # if write succeeded
-            except OSError:
-                raise MPUException(self._I2Cerror)
+            self._setreg(0x1B, gr[gyro_range]) # Sets fchoice = b11 which enables filter
+            self._gr = gyro_range               # if write succeeded
+            self._gyro_fixed()
         else:
             raise ValueError('gyro_range can only be 0, 1, 2 or 3')
+
+    @property
+    def sensors(self):
+        return self._accel, self._gyro
+
+    # Fixed point output
+    @property
+    def qbits(self):
+        '''
+        Number of fraction bits of the integers written by Vector3d.qxyz_into()
+        e.g. with 16 a value of 65536 is 1g, 1 degree/s or 1uT.
+        '''
+        return self._qbits
+
+    @qbits.setter
+    def qbits(self, bits):
+        if not 0 <= bits <= 19:                 # Results must remain small integers
+            raise ValueError('qbits must be in range 0-19')
+        self._qbits = bits
+        for vec in self.sensors:
+            vec._fixed(vec._qfactor, bits)
+
     # Accelerometer
     @property
     def accel(self):
@@ -263,21 +665,31 @@ class InvenSenseMPU(object):
         try:
             self._read(self.buf6, 0x3B, self.mpu_addr)
         except OSError:
-            raise MPUException(self._I2Cerror)
+            self._data_error()
+            return
+        self._stale_count = 0
         self._accel._ivector[0] = bytes_toint(self.buf6[0], self.buf6[1])
         self._accel._ivector[1] = bytes_toint(self.buf6[2], self.buf6[3])
         self._accel._ivector[2] = bytes_toint(self.buf6[4], self.buf6[5])
-        scale = (16384, 8192, 4096, 2048)
+        self._accel_scale()
+
+    def _accel_fixed(self):                     # Fixed point transform depends on the range
+        f = 1 / self._accel_lsb[self._ar]
+        self._accel._fixed((f, f, f), self._qbits)
+
+    def _accel_scale(self):                     # Scale integer values to g
+        scale = self._accel_lsb
         self._accel._vector[0] = self._accel._ivector[0]/scale[self._ar]
         self._accel._vector[1] =  self._accel._ivector[1]/scale[self._ar]
         self._accel._vector[2] =  self._accel._ivector[2]/scale[self._ar]
+        self._accel._valid = 0
 
     def get_accel_irq(self):
         '''
         For use in interrupt handlers. Sets self._accel._ivector[] to signed
         unscaled integer accelerometer values
         '''
-        self._read(self.buf6, 0x3B, self.mpu_addr)
+        self._read_irq(self.buf6, 0x3B, self.mpu_addr)
         self._accel._ivector[0] = bytes_toint(self.buf6[0], self.buf6[1])
         self._accel._ivector[1] = bytes_toint(self.buf6[2], self.buf6[3])
         self._accel._ivector[2] = bytes_toint(self.buf6[4], self.buf6[5])
@@ -295,21 +707,318 @@ class InvenSenseMPU(object):
         try:
             self._read(self.buf6, 0x43, self.mpu_addr)
         except OSError:
-            raise MPUException(self._I2Cerror)
+            self._data_error()
+            return
+        self._stale_count = 0
         self._gyro._ivector[0] = bytes_toint(self.buf6[0], self.buf6[1])
         self._gyro._ivector[1] = bytes_toint(self.buf6[2], self.buf6[3])
         self._gyro._ivector[2] = bytes_toint(self.buf6[4], self.buf6[5])
-        scale = (131, 65.5, 32.8, 16.4)
+        self._gyro_scale()
+
+    def _gyro_fixed(self):
+        f = 1 / self._gyro_lsb[self._gr]
+        self._gyro._fixed((f, f, f), self._qbits)
+
+    def _gyro_scale(self):                      # Scale integer values to degrees/s
+        scale = self._gyro_lsb
         self._gyro._vector[0] =  self._gyro._ivector[0]/scale[self._gr]
         self._gyro._vector[1] =  self._gyro._ivector[1]/scale[self._gr]
         self._gyro._vector[2] =  self._gyro._ivector[2]/scale[self._gr]
+        self._gyro._valid = 0
 
     def get_gyro_irq(self):
         '''
         For use in interrupt handlers. Sets self._gyro._ivector[] to signed
         unscaled integer gyro values. Error trapping disallowed.
         '''
-        self._read(self.buf6, 0x43, self.mpu_addr)
+        self._read_irq(self.buf6, 0x43, self.mpu_addr)
         self._gyro._ivector[0] = bytes_toint(self.buf6[0], self.buf6[1])
         self._gyro._ivector[1] = bytes_toint(self.buf6[2], self.buf6[3])
         self._gyro._ivector[2] = bytes_toint(self.buf6[4], self.buf6[5])
+
+    # Accel, temperature and gyro in a single transaction
+    def read_all(self):
+        '''
+        Read the contiguous block of accelerometer, temperature and gyro registers
+        (0x3B-0x48) in one I2C transaction. Updates the accel and gyro Vector3d
+        objects and the temperature so that all values relate to the same sample.
+        Returns False if the read failed with recovery enabled: values are retained.
+        '''
+        try:
+            self._read(self._allbuf, 0x3B, self.mpu_addr)
+        except OSError:
+            self._data_error()
+            return False
+        return self._all_read()
+
+    def _all_read(self):                        # Process _allbuf after the read_all() transaction
+        if self._budget is not None and self._was_reset():
+            self._data_error()
+            return False
+        self._stale_count = 0
+        self._unpack_all()
+        self._accel_scale()
+        self._gyro_scale()
+        self._temp = self._temp_convert(self._itemp)
+        return True
+
+    @property
+    def snapshot(self):
+        '''
+        Perform read_all() and return the time aligned results
+        ((ax, ay, az), (gx, gy, gz), temperature)
+        '''
+        self.read_all()
+        return self._accel.last_xyz, self._gyro.last_xyz, self._temp
+
+    @property
+    def last_temperature(self):                 # From the most recent read_all() or load_frame()
+        return self._temp
+
+    # Sample epochs. By default each accessor reads the device. Once sample() has been
+    # called (or max_age set) accessors return the values latched by the most recent
+    # sample(): the Vector3d update functions are replaced by _epoch_check().
+    def sample(self):
+        '''
+        Start a new sample epoch: read all sensors and latch the values returned by
+        the Vector3d accessors until the next call.
+        '''
+        if self._max_age is None:
+            self.max_age = 0
+        self.read_all()
+        self._epoch_time = pyb.micros()
+        self.epoch += 1
+
+    def _epoch_check(self):                     # Vector3d update function in epoch mode
+        if self._max_age and (self._epoch_time is None or
+                              pyb.elapsed_micros(self._epoch_time) > self._max_age):
+            self.sample()
+
+    def _update_funcs(self):                    # Vector3d update functions outside epoch mode
+        return self._accel_callback, self._gyro_callback
+
+    @property
+    def max_age(self):
+        '''
+        None: each accessor reads the device. 0: accessors return the values of the
+        most recent sample(). Otherwise accessors call sample() if the values are
+        older than max_age us.
+        '''
+        return self._max_age
+
+    @max_age.setter
+    def max_age(self, us):
+        if us is not None and us < 0:
+            raise ValueError('max_age must be None or >= 0')
+        self._max_age = us
+        funcs = self._update_funcs()
+        for n, vec in enumerate(self.sensors):
+            vec.update = funcs[n] if us is None else self._epoch_check
+
+    def get_all_irq(self):
+        '''
+        For use in interrupt handlers. Reads accelerometer, temperature and gyro in
+        a single transaction. Sets the accel and gyro _ivector[] and self._itemp to
+        signed unscaled integer values. Error trapping disallowed.
+        '''
+        self._read_irq(self._allbuf, 0x3B, self.mpu_addr)
+        self._unpack_all()
+
+    def _unpack_all(self):                      # Can be used in an interrupt handler
+        buf = self._allbuf
+        self._accel._ivector[0] = bytes_toint(buf[0], buf[1])
+        self._accel._ivector[1] = bytes_toint(buf[2], buf[3])
+        self._accel._ivector[2] = bytes_toint(buf[4], buf[5])
+        self._itemp = bytes_toint(buf[6], buf[7])
+        self._gyro._ivector[0] = bytes_toint(buf[8], buf[9])
+        self._gyro._ivector[1] = bytes_toint(buf[10], buf[11])
+        self._gyro._ivector[2] = bytes_toint(buf[12], buf[13])
+
+    def load_frame(self, frame):
+        '''
+        Update the accel and gyro Vector3d objects and the temperature from a
+        frame of raw integers (ax, ay, az, temperature, gx, gy, gz) as held in the
+        FIFO ring buffer. Values are then available via last_xyz.
+        '''
+        self._accel._ivector[0] = frame[0]
+        self._accel._ivector[1] = frame[1]
+        self._accel._ivector[2] = frame[2]
+        self._itemp = frame[3]
+        self._gyro._ivector[0] = frame[4]
+        self._gyro._ivector[1] = frame[5]
+        self._gyro._ivector[2] = frame[6]
+        self._accel_scale()
+        self._gyro_scale()
+        self._temp = self._temp_convert(self._itemp)
+
+    # FIFO streaming
+    def fifo_start(self, nframes = 100, chunk = 24):
+        '''
+        Start streaming accelerometer, temperature and gyro samples into the device
+        FIFO at the sample rate. fifo_read() transfers them in bursts of up to chunk
+        frames into a ring buffer holding nframes.
+        '''
+        self._fifo_ring = RingBuffer(nframes, self._frame_width)
+        self._fifo_frame = [0]*self._frame_width
+        self._fifo_buf = bytearray(self._fifo_framelen * chunk)
+        self._fifo_mv = memoryview(self._fifo_buf)
+        self._setreg(0x23, 0)                   # Stop FIFO input
+        self._setreg(0x6A, self._getreg(0x6A) | 0x40)
+        self._fifo_reset()
+        self._setreg(0x23, self._fifo_en)
+
+    def fifo_stop(self):
+        '''
+        Stop FIFO streaming. Frames already in the ring buffer are retained.
+        '''
+        self._setreg(0x23, 0)
+        self._setreg(0x6A, self._getreg(0x6A) & ~0x40)
+
+    def _fifo_reset(self):                      # FIFO_RESET bit is self clearing: not shadowed
+        try:
+            self._write(self._getreg(0x6A) | 0x04, 0x6A, self.mpu_addr)
+        except OSError:
+            raise MPUException(self._I2Cerror)
+
+    @property
+    def fifo(self):
+        '''
+        The RingBuffer of raw integer frames (ax, ay, az, temperature, gx, gy, gz)
+        populated by fifo_read(). Subclasses may append further sensors. Iterate
+        over it or use its read_into() method.
+        '''
+        return self._fifo_ring
+
+    @property
+    def fifo_count(self):                       # Number of bytes in the device FIFO
+        try:
+            self._read(self.buf2, 0x72, self.mpu_addr)
+        except OSError:
+            raise MPUException(self._I2Cerror)
+        return self.buf2[0] << 8 | self.buf2[1]
+
+    def fifo_read(self, decoder = None):
+        '''
+        Drain all whole frames from the device FIFO into the ring buffer using as
+        few transactions as possible. Returns the number of frames transferred.
+        If a FrameDecoder is passed, up to its maxframes frames are instead decoded
+        in batches into its arrays starting at index 0.
+        The 1024 byte FIFO holds 73 14 byte frames: at 1KHz call at least every 70mS.
+        On FIFO overflow frame alignment is lost: the FIFO is reset, its data
+        discarded and fifo_overflows incremented.
+        '''
+        if self._fifo_ring is None:
+            raise MPUException('FIFO has not been started')
+        framelen = self._fifo_framelen
+        count = self.fifo_count
+        if count >= 1024:
+            self.fifo_overflows += 1
+            self._fifo_reset()
+            return 0
+        nframes = count // framelen
+        if decoder is not None:
+            if decoder.framelen != framelen:
+                raise ValueError('Decoder frame format does not match FIFO')
+            nframes = min(nframes, decoder.maxframes)
+        chunk = len(self._fifo_buf) // framelen
+        buf = self._fifo_buf
+        frame = self._fifo_frame
+        ring = self._fifo_ring
+        done = 0
+        while done < nframes:
+            n = min(chunk, nframes - done)
+            try:
+                self._read(self._fifo_mv[: n * framelen], 0x74, self.mpu_addr)
+            except OSError:
+                raise MPUException(self._I2Cerror)
+            if decoder is not None:
+                decoder.decode(buf, n, done)
+            else:
+                for offs in range(0, n * framelen, framelen):
+                    self._decode_frame(buf, offs, frame)
+                    ring.put(frame)
+            done += n
+        return nframes
+
+    def _decode_frame(self, buf, offs, frame):  # Decode FIFO or read_all() frame at buf[offs] to integers
+        for k in range(7):
+            frame[k] = bytes_toint(buf[offs + 2*k], buf[offs + 2*k + 1])
+
+    # Data ready interrupts
+    def irq_start(self, pin, nframes = 50, callback = None):
+        '''
+        Start interrupt driven sampling. pin is the Pyboard pin (e.g. 'X12') wired to
+        the MPU INT output. On each data ready interrupt a sample is read in a single
+        transaction and its raw integers are stored in a ring buffer of nframes.
+        Scaling is deferred: if a callback is supplied irq_process() is scheduled to
+        run it once per sample, otherwise the application calls irq_process().
+        '''
+        if self._extint is not None:
+            raise ValueError('Interrupts already started')
+        self._irq_ring = RingBuffer(nframes, self._frame_width)
+        self._irq_frame = [0]*self._frame_width # Used by the interrupt handler
+        self._irq_dest = [0]*self._frame_width  # Used by irq_process()
+        self._irq_callback = callback
+        self._irq_pending = False
+        self._irq_process_ref = self._irq_scheduled # Bound method allocated here, not in the ISR
+        self.irq_count = 0
+        self._setreg(0x37, self._getreg(0x37) | 0x30) # Latch INT pin until any register is read
+        self._setreg(0x38, 0x01)                # DATA_RDY_EN
+        self._irq_pin = pin
+        self._extint = pyb.ExtInt(pin, pyb.ExtInt.IRQ_RISING, pyb.Pin.PULL_NONE, self._irq_handler)
+
+    def irq_stop(self):
+        '''
+        Stop interrupt driven sampling. Unprocessed samples remain in the ring buffer.
+        '''
+        if self._extint is None:
+            return
+        self._extint.disable()
+        pyb.ExtInt(self._irq_pin, pyb.ExtInt.IRQ_RISING, pyb.Pin.PULL_NONE, None) # Free the line
+        self._extint = None
+        self._setreg(0x38, 0)
+        self._setreg(0x37, self._getreg(0x37) & ~0x30)
+
+    def _irq_handler(self, line):               # Hard interrupt: no allocation or exception handling
+        self._read_irq(self._allbuf, 0x3B, self.mpu_addr) # Also clears the latched interrupt
+        self._decode_frame(self._allbuf, 0, self._irq_frame)
+        self._irq_ring.put(self._irq_frame)
+        self.irq_count += 1
+        if self._irq_flag is not None:          # Wake an asyncio task
+            self._irq_flag.set()
+        if self._irq_callback is not None and not self._irq_pending:
+            self._irq_pending = True
+            micropython.schedule(self._irq_process_ref, 0)
+
+    def _irq_scheduled(self, _):
+        self._irq_pending = False
+        self.irq_process()
+
+    def irq_get(self, frame):
+        '''
+        Remove the oldest raw frame from the interrupt ring buffer into frame, a
+        list or array. Returns False if none is available.
+        '''
+        state = pyb.disable_irq()               # Ring buffer is shared with the ISR
+        res = self._irq_ring.get(frame)
+        pyb.enable_irq(state)
+        return res
+
+    def irq_process(self, callback = None):
+        '''
+        Scale each sample captured since the last call using load_frame(), then call
+        callback(imu) (default: the irq_start() callback). Returns the number processed.
+        '''
+        callback = self._irq_callback if callback is None else callback
+        frame = self._irq_dest
+        n = 0
+        while self.irq_get(frame):
+            self.load_frame(frame)
+            n += 1
+            if callback is not None:
+                callback(self)
+        return n
+
+    @property
+    def irq_overruns(self):                     # Samples lost because the ring buffer was full
+        return self._irq_ring.overruns
@@ -0,0 +1,187 @@
+# imulog.py Binary logging of raw MPU9150 samples
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# File layout. A header of HEADER_BLOCK bytes: MAGIC, the header length as a little
+# endian uint16 then JSON text padded with spaces. The JSON holds the record format
+# and NumPy dtype and the settings needed to scale the data. Fixed size records follow.
+# Records hold the raw integers of the driver's Vector3d _ivector arrays so no floating
+# point is done while logging: the magnetometer's are in AK8975 axes. The header holds
+# each Vector3d's fused transform (matrix and offset) from sensor units to vehicle
+# values. Records are packed into one of two block sized buffers.
+# When a buffer fills, logging continues in the other while the application writes
+# the full one to the file with write(). Records are lost only if both are full.
+
+try:
+    import json
+except ImportError:
+    import ujson as json
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
+try:
+    from time import ticks_us
+except ImportError:                             # CPython: the simulation or Linux
+    from pybcompat import ticks_us
+
+MAGIC = b'MPULOG'
+HEADER_BLOCK = 512
+RECORD = '<I10hHHI'
+RECORD_SIZE = 32
+FIELDS = (('ticks_us', '<u4'), ('ax', '<i2'), ('ay', '<i2'), ('az', '<i2'),
+          ('gx', '<i2'), ('gy', '<i2'), ('gz', '<i2'), ('mx', '<i2'), ('my', '<i2'),
+          ('mz', '<i2'), ('temp', '<i2'), ('flags', '<u2'), ('seq', '<u2'), ('mag_age', '<u4'))
+
+# Status flags
+MAG_NEW = 1                                     # Magnetometer sample is new since the last record
+MAG_STALE = 2                                   # mag_stale_count was nonzero
+READ_ERROR = 4                                  # I2C error: values are those of the previous record
+LOST = 8                                        # Records were lost before this one
+
+class BinaryLogger(object):
+    '''
+    Logs samples from an MPU9150 to filename. block is the size of each buffer and
+    file write: a multiple of RECORD_SIZE. Call sample() (or record() after reading
+    the device) at the logging rate and write() from the main loop.
+    '''
+    def __init__(self, imu, filename, block = 512):
+        if block < RECORD_SIZE or block % RECORD_SIZE:
+            raise ValueError('block must be a multiple of {}'.format(RECORD_SIZE))
+        self.imu = imu
+        self._bufs = (bytearray(block), bytearray(block))
+        self._block = block
+        self._active = 0                        # Buffer being filled
+        self._pending = -1                      # Full buffer awaiting write()
+        self._offs = 0
+        self._flags = 0
+        self._mag_time = None
+        self.records = 0
+        self.overruns = 0
+        self._f = open(filename, 'wb')
+        self._f.write(self._header())
+
+    def _header(self):
+        imu = self.imu
+        acc, gyro, mag = imu.sensors
+        hdr = {'version' : 2, 'record' : RECORD, 'dtype' : [list(f) for f in FIELDS],
+               'accel_range' : imu.accel_range, 'gyro_range' : imu.gyro_range,
+               'accel_lsb' : imu._accel_lsb[imu.accel_range], # LSB per g
+               'gyro_lsb' : imu._gyro_lsb[imu.gyro_range], # LSB per degree/s
+               'mag_ut' : imu._mag_ut, 'mag_correction' : list(imu.mag_correction),
+               'temp_offset' : imu._temp_convert(0), 'temp_scale' : imu._temp_convert(1) - imu._temp_convert(0),
+               'sample_rate' : imu.sample_rate, 'filter_range' : imu.filter_range,
+               'mag_master' : imu.mag_master, 'ticks_period' : 1 << 30}
+        for name, vec in (('accel', acc), ('gyro', gyro), ('mag', mag)):
+            hdr[name + '_cal'] = list(vec.cal)
+            hdr[name + '_mounting'] = [list(row) for row in vec.mounting]
+            mat, offs = vec.matrix
+            hdr[name + '_matrix'] = [list(row) for row in mat]
+            hdr[name + '_offset'] = list(offs)
+        w = mag.softiron
+        hdr['mag_softiron'] = None if w is None else [list(row) for row in w]
+        text = json.dumps(hdr).encode()
+        length = len(MAGIC) + 2 + len(text)
+        size = (length + HEADER_BLOCK - 1) // HEADER_BLOCK * HEADER_BLOCK
+        return MAGIC + struct.pack('<H', size) + text + b' ' * (size - length)
+
+    def sample(self):
+        '''
+        Read the device and log a record. Outside mag_master mode the magnetometer is
+        read without blocking: set mag_continuous to minimise its staleness.
+        '''
+        flags = 0
+        imu = self.imu
+        try:
+            if not imu.read_all():              # Recovery enabled: last values retained
+                flags = READ_ERROR
+            if not imu.mag_master:
+                imu._mag_callback()
+        except OSError:
+            flags = READ_ERROR
+        return self.record(flags)
+
+    def record(self, flags = 0):
+        '''
+        Log the current raw values of the device without accessing it. Does not
+        allocate: may be called from a scheduled callback (e.g. from irq_process()).
+        Returns False if the record was lost because both buffers are full.
+        '''
+        if self._offs >= self._block:           # Both buffers full: writer is behind
+            self.overruns += 1
+            self._flags = LOST
+            return False
+        imu = self.imu
+        a = imu._accel._ivector
+        g = imu._gyro._ivector
+        m = imu._mag._ivector
+        mtime = imu._mag_time
+        if mtime is not None and mtime != self._mag_time:
+            flags |= MAG_NEW
+            self._mag_time = mtime
+        if imu.mag_stale_count:
+            flags |= MAG_STALE
+        age = imu.mag_age
+        age = 0xffffffff if age is None else min(age, 0xffffffff)
+        struct.pack_into(RECORD, self._bufs[self._active], self._offs, ticks_us(),
+                         a[0], a[1], a[2], g[0], g[1], g[2], m[0], m[1], m[2], imu._itemp,
+                         flags | self._flags, (self.records + self.overruns) & 0xffff, age)
+        self._flags = 0
+        self.records += 1
+        self._offs += RECORD_SIZE
+        if self._offs >= self._block and self._pending < 0:
+            self._swap()
+        return True
+
+    def _swap(self):
+        self._pending = self._active
+        self._active ^= 1
+        self._offs = 0
+
+    def write(self):
+        '''
+        Write a full buffer to the file. Returns the number of bytes written.
+        '''
+        if self._pending < 0:
+            return 0
+        self._f.write(self._bufs[self._pending])
+        state = pyb.disable_irq()               # record() may run in a callback
+        self._pending = -1
+        if self._offs >= self._block:           # Other buffer filled during the write
+            self._swap()
+        pyb.enable_irq(state)
+        return self._block
+
+    def close(self):
+        '''
+        Write all buffered records and close the file.
+        '''
+        self.write()
+        self.write()
+        if self._offs:
+            self._f.write(memoryview(self._bufs[self._active])[:self._offs])
+            self._offs = 0
+        self._f.close()
@@ -0,0 +1,99 @@
+# logreader.py Host reader for logs written by imulog.BinaryLogger
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Runs under CPython and requires NumPy. The records are memory mapped as a NumPy
+# structured array whose dtype is read from the log header: no per-record parsing.
+# Scaled values are computed as the driver's Vector3d would compute them.
+
+import json
+import os
+import struct
+import numpy
+
+MAGIC = b'MPULOG'
+
+class LogReader(object):
+    '''
+    Memory maps a log. header is the dict of logging settings, records the
+    structured array with fields as named in the header's dtype.
+    '''
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            fixed = f.read(len(MAGIC) + 2)
+            if fixed[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not an MPU log file')
+            size = struct.unpack('<H', fixed[len(MAGIC):])[0]
+            self.header = json.loads(f.read(size - len(fixed)).decode())
+        self.dtype = numpy.dtype([tuple(field) for field in self.header['dtype']])
+        nrecs = (os.path.getsize(filename) - size) // self.dtype.itemsize # Ignore partial record
+        if nrecs:
+            self.records = numpy.memmap(filename, dtype = self.dtype, mode = 'r',
+                                        offset = size, shape = (nrecs,))
+        else:
+            self.records = numpy.zeros(0, dtype = self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def time_us(self):
+        '''
+        Timestamps in us relative to the first record, with ticks_us wraparound removed.
+        '''
+        t = self.records['ticks_us'].astype(numpy.int64)
+        if not len(t):
+            return t
+        d = numpy.diff(t) % self.header['ticks_period']
+        return numpy.concatenate(([0], numpy.cumsum(d)))
+
+    def _transform(self, name, v):              # Apply calibration, soft iron and mounting
+        h = self.header
+        mat = h.get(name + '_matrix')
+        if mat is not None:                     # Version 2: the Vector3d's fused transform
+            return v @ numpy.array(mat).T - numpy.array(h[name + '_offset'])
+        w = h.get(name + '_softiron')
+        w = numpy.eye(3) if w is None else numpy.array(w)
+        t = h[name + '_transposition']
+        scale = h[name + '_scaling']
+        mat = numpy.array([numpy.array(w[t[n]]) * scale[n] for n in range(3)])
+        return (v - numpy.array(h[name + '_cal'])) @ mat.T
+
+    def _raw(self, names):
+        return numpy.stack([self.records[n].astype(numpy.float64) for n in names], axis = 1)
+
+    def accel(self):                            # (N, 3) array in g
+        return self._transform('accel', self._raw(('ax', 'ay', 'az')) / self.header['accel_lsb'])
+
+    def gyro(self):                             # (N, 3) array in degrees/s
+        return self._transform('gyro', self._raw(('gx', 'gy', 'gz')) / self.header['gyro_lsb'])
+
+    def mag(self):                              # (N, 3) array in uT
+        h = self.header
+        v = self._raw(('mx', 'my', 'mz')) * numpy.array(h['mag_correction']) * h['mag_ut']
+        return self._transform('mag', v)
+
+    def temperature(self):                      # Degrees C
+        h = self.header
+        return self.records['temp'] * h['temp_scale'] + h['temp_offset']
@@ -0,0 +1,220 @@
+# magcal.py Streaming hard and soft iron magnetometer calibration
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Samples are fitted to the quadric
+# A*x*x + B*y*y + C*z*z + 2D*x*y + 2E*x*z + 2F*y*z + 2G*x + 2H*y + 2I*z = 1
+# by recursive least squares. Memory is constant: the 9 parameters and a 9x9
+# covariance matrix. solve() converts the parameters to the ellipsoid's centre (the
+# hard iron offsets) and a symmetric matrix W with unit determinant which maps the
+# ellipsoid onto a sphere (the soft iron correction). Corrected values are
+# W * (v - centre) which preserves the mean field strength.
+
+from array import array
+from math import sqrt
+
+def _jacobi(a):
+    '''
+    Eigen decomposition of a symmetric 3x3 matrix a (list of 9, modified in place).
+    Returns (eigenvalues, v) where column k of v (list of 9) is eigenvector k.
+    '''
+    v = [1.0, 0, 0, 0, 1.0, 0, 0, 0, 1.0]
+    for _ in range(50):
+        off = a[1]*a[1] + a[2]*a[2] + a[5]*a[5]
+        if off < 1e-20:
+            break
+        for p, q in ((0, 1), (0, 2), (1, 2)):
+            apq = a[3*p + q]
+            if abs(apq) < 1e-30:
+                continue
+            theta = (a[3*q + q] - a[3*p + p]) / (2 * apq)
+            t = (1 if theta >= 0 else -1) / (abs(theta) + sqrt(theta*theta + 1))
+            c = 1 / sqrt(t*t + 1)
+            s = t * c
+            for k in range(3):                  # a = a * J
+                akp, akq = a[3*k + p], a[3*k + q]
+                a[3*k + p] = c*akp - s*akq
+                a[3*k + q] = s*akp + c*akq
+            for k in range(3):                  # a = J' * a
+                apk, aqk = a[3*p + k], a[3*q + k]
+                a[3*p + k] = c*apk - s*aqk
+                a[3*q + k] = s*apk + c*aqk
+            for k in range(3):
+                vkp, vkq = v[3*k + p], v[3*k + q]
+                v[3*k + p] = c*vkp - s*vkq
+                v[3*k + q] = s*vkp + c*vkq
+    return (a[0], a[4], a[8]), v
+
+class EllipsoidCalibrator(object):
+    '''
+    Incremental hard and soft iron calibration. Call feed() with each magnetometer
+    sample during normal operation: no extra device access is required. When
+    converged is True apply() loads the results into the magnetometer's Vector3d.
+    forget is the RLS forgetting factor: values < 1 allow tracking slow changes.
+    min_coverage is the least acceptable coverage (see below).
+    '''
+    def __init__(self, forget = 1.0, min_samples = 200, tolerance = 0.05, min_coverage = 0.5):
+        self.forget = forget
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.min_coverage = min_coverage
+        self._theta = array('f', [0]*9)
+        self._p = array('f', [0]*81)
+        self._phi = array('f', [0]*9)
+        self._pphi = array('f', [0]*9)
+        self._lo = array('f', (0, 0, 0))        # Range of 2 * the normalised samples on each axis
+        self._hi = array('f', (0, 0, 0))
+        self.reset()
+
+    def reset(self):
+        for n in range(9):
+            self._theta[n] = 0
+        for n in range(81):
+            self._p[n] = 1000 if n % 10 == 0 else 0
+        self._scale = 0                         # Data are normalised by the first sample's magnitude
+        self._ms = 1.0                          # Exponential mean of squared error
+        for n in range(3):
+            self._lo[n] = 1e30
+            self._hi[n] = -1e30
+        self.samples = 0
+
+    @property
+    def residual(self):
+        '''
+        Convergence metric: RMS algebraic fit error of recent samples, roughly twice
+        the fractional deviation of the field magnitude from a sphere.
+        '''
+        return sqrt(self._ms)
+
+    @property
+    def coverage(self):
+        '''
+        Excitation metric: the smallest range of the samples on a sensor axis divided
+        by the largest. Near 1 after rotation through all orientations, near 0 after
+        rotation about one axis only, when the fit is indeterminate however small the
+        residual.
+        '''
+        if not self.samples:
+            return 0
+        spans = [self._hi[n] - self._lo[n] for n in range(3)]
+        big = max(spans)
+        return min(spans) / big if big > 0 else 0
+
+    @property
+    def converged(self):
+        return (self.samples >= self.min_samples and self.residual < self.tolerance
+                and self.coverage >= self.min_coverage)
+
+    def feed(self, vec):                        # Add the current sample of a Vector3d
+        v = vec._vector
+        self.update(v[0], v[1], v[2])
+
+    def update(self, x, y, z):
+        '''
+        Add a sample in sensor coordinates. Allocation is limited to float objects.
+        '''
+        if not self._scale:
+            self._scale = sqrt(x*x + y*y + z*z)
+            if not self._scale:
+                return
+        x /= self._scale
+        y /= self._scale
+        z /= self._scale
+        phi = self._phi
+        phi[0] = x*x
+        phi[1] = y*y
+        phi[2] = z*z
+        phi[3] = 2*x*y
+        phi[4] = 2*x*z
+        phi[5] = 2*y*z
+        phi[6] = 2*x
+        phi[7] = 2*y
+        phi[8] = 2*z
+        lo = self._lo
+        hi = self._hi
+        for n in range(3):                      # phi[6:9] hold 2*x, 2*y, 2*z
+            v = phi[6 + n]
+            if v < lo[n]:
+                lo[n] = v
+            if v > hi[n]:
+                hi[n] = v
+        p = self._p
+        pphi = self._pphi
+        theta = self._theta
+        denom = self.forget
+        err = 1.0
+        for i in range(9):
+            acc = 0
+            for j in range(9):
+                acc += p[9*i + j] * phi[j]
+            pphi[i] = acc
+            denom += phi[i] * acc
+            err -= phi[i] * theta[i]
+        for i in range(9):
+            theta[i] += pphi[i] * err / denom
+        for i in range(9):                      # P = (P - P*phi*phi'*P / denom) / forget
+            ki = pphi[i] / denom
+            for j in range(9):
+                p[9*i + j] = (p[9*i + j] - ki * pphi[j]) / self.forget
+        self._ms += ((err*err) - self._ms) / min(self.samples + 1, 100)
+        self.samples += 1
+
+    def solve(self):
+        '''
+        Return (offsets, matrix) or None if the samples do not yet define an
+        ellipsoid. offsets is a 3-tuple in sensor units, matrix a 3x3 tuple.
+        '''
+        th = self._theta
+        sign = 1 if th[0] + th[1] + th[2] > 0 else -1 # Negative if the offsets exceed the field
+        m = [sign * th[n] for n in (0, 3, 4, 3, 1, 5, 4, 5, 2)]
+        g = (sign * th[6], sign * th[7], sign * th[8])
+        det = (m[0]*(m[4]*m[8] - m[5]*m[7]) - m[1]*(m[3]*m[8] - m[5]*m[6])
+               + m[2]*(m[3]*m[7] - m[4]*m[6]))
+        if det <= 0:
+            return None
+        inv = ((m[4]*m[8] - m[5]*m[7]) / det, (m[2]*m[7] - m[1]*m[8]) / det, (m[1]*m[5] - m[2]*m[4]) / det,
+               (m[5]*m[6] - m[3]*m[8]) / det, (m[0]*m[8] - m[2]*m[6]) / det, (m[2]*m[3] - m[0]*m[5]) / det,
+               (m[3]*m[7] - m[4]*m[6]) / det, (m[1]*m[6] - m[0]*m[7]) / det, (m[0]*m[4] - m[1]*m[3]) / det)
+        c = [-(inv[3*i]*g[0] + inv[3*i + 1]*g[1] + inv[3*i + 2]*g[2]) for i in range(3)]
+        k = sign + sum(c[i] * (m[3*i]*c[0] + m[3*i + 1]*c[1] + m[3*i + 2]*c[2]) for i in range(3))
+        if k <= 0:
+            return None
+        evals, evecs = _jacobi([x / k for x in m])
+        if min(evals) <= 0:
+            return None
+        norm = (evals[0] * evals[1] * evals[2]) ** (-1/6) # Unit determinant
+        roots = [sqrt(e) * norm for e in evals]
+        w = tuple(tuple(sum(evecs[3*i + n] * roots[n] * evecs[3*j + n] for n in range(3))
+                        for j in range(3)) for i in range(3))
+        offsets = tuple(x * self._scale for x in c)
+        return offsets, w
+
+    def apply(self, vec):
+        '''
+        Load the current solution into a Vector3d's cal and softiron. Returns
+        False if there is no valid solution.
+        '''
+        res = self.solve()
+        if res is None:
+            return False
+        vec.cal, vec.softiron = res
+        return True
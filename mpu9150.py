@@ -23,18 +23,26 @@ THE SOFTWARE.
 # 15th June 2015 Now uses subclass of InvenSenseMPU
 
 from imu import InvenSenseMPU, bytes_toint, MPUException
+from rateplan import plan
 from vector3d import Vector3d
-import pyb
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
 
 def default_mag_wait():
     pyb.delay(1)
 
 # MPU9150 constructor arguments
-# 1.    side_str 'X' or 'Y' depending on the Pyboard I2C interface being used
+# 1.    side_str 'X' or 'Y' depending on the Pyboard I2C interface being used. Alternatively
+#       a Linux bus number or path, a machine.I2C instance or a transport: see transport.py
 # 2.    optional device_addr 0, 1 depending on the voltage applied to pin AD0 (Drotek default is 1)
 #       if None driver will scan for a device (if one device only is on bus)
 # 3, 4. transposition, scaling optional 3-tuples allowing for outputs to be based on vehicle
-#       coordinates rather than those of the sensor itself. See readme.
+#       coordinates rather than those of the sensor itself. See readme. If either is
+#       passed it overrides the mounting held in a profile.
+# 5.    profile optional filename of a profile written by save_profile(). If valid the
+#       device is configured from it without the usual initialisation delays.
 
 
 class MPU9150(InvenSenseMPU):
@@ -52,14 +60,36 @@ class MPU9150(InvenSenseMPU):
                             # second on 105
     _mag_addr = 12
     _chip_id = 104
-    def __init__(self, side_str, device_addr = None, transposition = (0,1,2), scaling = (1,1,1)):
-        super().__init__(side_str, device_addr, transposition, scaling)
-        self._mag = Vector3d(transposition, scaling, self._mag_callback)
-        self.filter_range = 0           # fast filtered response
+    _mag_ut = 0.3               # uT per LSB
+    _mag_align = ((0, 1, 0), (1, 0, 0), (0, 0, -1)) # AK8975 axes to MPU axes: applied by Vector3d
+    def __init__(self, side_str, device_addr = None, transposition = None, scaling = None, profile = None):
+        super().__init__(side_str, device_addr, transposition, scaling, profile)
+        self._mag = Vector3d((0,1,2), (1,1,1), self._mag_callback, self._mag_align)
+        self._mag.mounting = self._accel.mounting
         self._mag_stale_count = 0       # Count of consecutive reads where old data was returned
         self.mag_triggered = False      # Ensure mag is triggered once only until it's read
-        self.mag_correction = self._magsetup()  # Returns correction factors.
+        self._mag_continuous = False    # Retrigger as soon as each result is read
+        self._mag_trig_time = 0         # pyb.micros() when the current conversion started
+        self._mag_time = None           # pyb.micros() when the current sample was measured
+        self._mag_master = False        # True if the mag is read by the MPU's I2C master
+        self.buf8 = bytearray([0]*8)
+        self.buf22 = bytearray([0]*22)  # read_all() buffer in I2C master mode
+        self._mag_raw = bytearray(8)    # ST1, data and ST2 of the last I2C master sample
+        self._mag_ref = 0               # pyb.micros() when _mag_raw last changed
+        self._mag_periods = 1           # Slave read periods from _mag_ref to the next
         self.mag_wait_func = default_mag_wait
+        self.mag_calibrator = None      # Optional EllipsoidCalibrator fed with each new sample
+        prof = self._profile
+        if prof is None:
+            self.filter_range = 0       # fast filtered response
+            self.mag_correction = self._magsetup()  # Returns correction factors.
+        else:                           # Warm start: registers are already configured
+            self.mag_correction = tuple(prof['mag_correction'])
+            self._mag.cal = prof['mag_cal']
+            self._mag.softiron = prof['mag_softiron']
+            if not self._mounted:
+                self._mag.mounting = prof['mag_mounting']
+            self._frame_mode(prof['mag_master'])
 
     @property
     def sensors(self):
@@ -71,11 +101,17 @@ class MPU9150(InvenSenseMPU):
         '''
         Returns the temperature in degree C.
         '''
+        if self._max_age is not None:           # Epoch mode: temperature of the sample
+            self._epoch_check()
+            return self._temp
         try:
             self._read(self.buf2, 0x41, self.mpu_addr)
         except OSError:
             raise MPUException(self._I2Cerror)
-        return bytes_toint(self.buf2[0], self.buf2[1])/340 + 35 # I think
+        return self._temp_convert(bytes_toint(self.buf2[0], self.buf2[1]))
+
+    def _temp_convert(self, itemp):             # Raw integer to degrees C
+        return itemp/340 + 35 # I think
 
     # Low pass filters
     @property
@@ -86,28 +122,23 @@ class MPU9150(InvenSenseMPU):
         Cutoff (Hz):        250 184 92  41  20  10  5
         Sample rate (KHz):  8   1   1   1   1   1   1
         '''
-        try:
-            self._read(self.buf1, 0x1A, self.mpu_addr)
-            res = self.buf1[0] & 7
-        except OSError:
-            raise MPUException(self._I2Cerror)
-        return res
+        return self._getreg(0x1A) & 7
 
     @filter_range.setter
     def filter_range(self, filt):
         # set range
         if filt in range(7):
-            try:
-                self._write(filt, 0x1A, self.mpu_addr)
-            except OSError:
-                raise MPUException(self._I2Cerror)
+            self._setreg(0x1A, filt)
         else:
             raise ValueError('Filter coefficient must be between 0 and 6')
 
     @property                   # Triggers mag, waits for it to be ready, then returns the instance
     def mag(self):              # should be ready in 9mS max
-        while not self.mag_ready:
-            self.mag_wait_func()
+        if self._max_age is not None:           # Epoch mode: sample() reads the mag
+            return self._mag
+        if not self._mag_master and not (self._mag_continuous and self._mag_time is not None):
+            while not self.mag_ready:
+                self.mag_wait_func()
         return self._mag
 
     @property
@@ -115,19 +146,40 @@ class MPU9150(InvenSenseMPU):
         return self._mag        # ready or not
 
     def mag_trigger(self):      # Initiate a mag reading. Can be called repeatedly.
-        if not self.mag_triggered:
+        if not self.mag_triggered and not self._mag_master:
             try:
                 self._write(0x01, 0x0A, self._mag_addr) # single measurement mode
             except OSError:
                 raise MPUException(self._I2Cerror)
+            self._mag_trig_time = pyb.micros()
             self.mag_triggered = True
 
     @property
     def mag_stale_count(self):  # Number of consecutive times old data was returned
         return self._mag_stale_count
 
+    @property
+    def mag_continuous(self):   # True if a new conversion starts as each result is read
+        return self._mag_continuous
+
+    @mag_continuous.setter
+    def mag_continuous(self, mode):
+        if type(mode) is not bool:
+            raise ValueError('pass either True or False')
+        self._mag_continuous = mode
+        if mode:
+            self.mag_trigger()
+
+    @property
+    def mag_age(self):          # us since the current sample was measured or None
+        if self._mag_time is None:
+            return None
+        return pyb.elapsed_micros(self._mag_time)
+
     @property
     def mag_ready(self):       # Initiates a reading if necessary. Returns ready state.
+        if self._mag_master:   # Data is always available
+            return True
         self.mag_trigger()
         try:
             self._read(self.buf1, 0x02, self._mag_addr)
@@ -139,30 +191,83 @@ class MPU9150(InvenSenseMPU):
         '''
         Update magnetometer Vector3d object (if data available)
         '''
+        if self._mag_master:                    # ST1, data and ST2 in one transaction
+            try:
+                self._read(self.buf8, 0x49, self.mpu_addr)
+            except OSError:
+                self._mag_error()
+                return
+            if self._master_decode(self.buf8, 0):
+                self._mag_time = pyb.micros()
+                self._mag_sample()
+            return
+        if self._mag_continuous:                # ST1, data and ST2 in one transaction
+            try:
+                self._read(self.buf8, 0x02, self._mag_addr)
+                if self.buf8[0] & 1:            # New data: start the next conversion
+                    trig_time = self._mag_trig_time
+                    self.mag_triggered = False
+                self.mag_trigger()              # No-op if a conversion is in progress
+            except OSError:
+                self._mag_error()
+                return
+            if self._mag_decode(self.buf8, 0):
+                self._mag_time = trig_time
+                self._mag_sample()
+            return
         try:                                    # If read fails, returns last valid data
             if self.mag_ready:                  # Starts mag if necessary
                 self._read(self.buf6, 0x03, self._mag_addr)
                 self.mag_triggered = False
+                self._mag_time = self._mag_trig_time
             else:
                 self._mag_stale_count += 1      # Data not ready: retain last value
                 return                          # but increment stale count
-            self._read(self.buf6, 0x03, self._mag_addr) # Mag was ready
             self._read(self.buf1, 0x09, self._mag_addr) # Read ST2
         except OSError:
-            self.mag_triggered = False
-            raise MPUException(self._I2Cerror)
+            self._mag_error()
+            return
         if self.buf1[0] & 0x0C > 0:             # An overflow or data error has occurred
             self._mag_stale_count +=1           # transitory condition? User checks stale count.
             return
-        self._mag._ivector[1] = bytes_toint(self.buf6[1], self.buf6[0])  # Note axis twiddling and little endian
-        self._mag._ivector[0] = bytes_toint(self.buf6[3], self.buf6[2])
-        self._mag._ivector[2] = -bytes_toint(self.buf6[5], self.buf6[4])
-        scale = 0.3                             # 0.3uT/LSB
-        self._mag._vector[0] =  self._mag._ivector[0]*self.mag_correction[0]*scale
-        self._mag._vector[1] =  self._mag._ivector[1]*self.mag_correction[1]*scale
-        self._mag._vector[2] =  self._mag._ivector[2]*self.mag_correction[2]*scale
+        self._mag._ivector[0] = bytes_toint(self.buf6[1], self.buf6[0])  # Little endian, AK8975 axes
+        self._mag._ivector[1] = bytes_toint(self.buf6[3], self.buf6[2])
+        self._mag._ivector[2] = bytes_toint(self.buf6[5], self.buf6[4])
+        self._mag_sample()
         self._mag_stale_count = 0
 
+    @property
+    def mag_correction(self):   # Factory sensitivity adjustment from the fuse ROM
+        return self._mag_correction
+
+    @mag_correction.setter
+    def mag_correction(self, corr):
+        self._mag_correction = tuple(corr)
+        scale = self._mag_ut
+        self._mag._fixed([c * scale for c in corr], self._qbits)
+
+    def _mag_error(self):                       # A magnetometer read failed
+        self.mag_triggered = False
+        if self._budget is None:
+            raise MPUException(self._I2Cerror)
+        self._mag_stale_count += 1              # Recovery enabled: retain last good values
+
+    def _restored(self):                        # Configuration rewritten: no conversion pending
+        self.mag_triggered = False
+
+    def _mag_scale(self):
+        scale = self._mag_ut
+        corr = self._mag_correction
+        self._mag._vector[0] =  self._mag._ivector[0]*corr[0]*scale
+        self._mag._vector[1] =  self._mag._ivector[1]*corr[1]*scale
+        self._mag._vector[2] =  self._mag._ivector[2]*corr[2]*scale
+        self._mag._valid = 0
+
+    def _mag_sample(self):                      # A new sample has been read
+        self._mag_scale()
+        if self.mag_calibrator is not None:
+            self.mag_calibrator.feed(self._mag)
+
     def  _magsetup(self):
         '''
         Read magnetometer correction values from ROM. Perform the maths as decribed
@@ -179,14 +284,194 @@ class MPU9150(InvenSenseMPU):
         z = (0.5*(self.buf3[2] -128))/128 + 1
         return (x, y, z)
 
-    def get_mag_irq(self):                      # Uncorrected values because floating point uses heap
+    def get_mag_irq(self):                      # Raw values: corrected by mag.qxyz_into()
+        if self._mag_master:
+            self._read_irq(self.buf8, 0x49, self.mpu_addr)
+            self._master_decode(self.buf8, 0)
+            return
         if not self.mag_triggered:              # Can't do exception handling here
-            self._write(1, 0x0A, self._mag_addr)
+            self._write_irq(1, 0x0A, self._mag_addr)
             self.mag_triggered = True
-        self._read(self.buf1, 0x02, self._mag_addr)
+        self._read_irq(self.buf1, 0x02, self._mag_addr)
         if self.buf1[0] == 1:
-            self._read(self.buf6, 0x03, self._mag_addr) # Note axis twiddling
-            self._mag._ivector[1] = bytes_toint(self.buf6[1], self.buf6[0])
-            self._mag._ivector[0] = bytes_toint(self.buf6[3], self.buf6[2])
-            self._mag._ivector[2] = -bytes_toint(self.buf6[5], self.buf6[4])
+            self._read_irq(self.buf6, 0x03, self._mag_addr)
+            self._mag._ivector[0] = bytes_toint(self.buf6[1], self.buf6[0])
+            self._mag._ivector[1] = bytes_toint(self.buf6[3], self.buf6[2])
+            self._mag._ivector[2] = bytes_toint(self.buf6[5], self.buf6[4])
             self.mag_triggered = False
+
+    # Magnetometer access via the MPU's auxiliary I2C master
+    @property
+    def mag_master(self):
+        '''
+        True if the MPU's internal I2C master samples the magnetometer. Its data
+        then appears in EXT_SENS_DATA and is included in read_all() and the FIFO.
+        '''
+        return self._mag_master
+
+    @mag_master.setter
+    def mag_master(self, mode):
+        if type(mode) is not bool:
+            raise ValueError('pass either True or False')
+        if mode == self._mag_master:
+            return
+        if mode:
+            internal = 8000 if self.filter_range == 0 else 1000
+            rate = internal / (1 + self.sample_rate)
+            dly = int((rate + 99) // 100) - 1   # Decimate to <= 100Hz: conversion takes 9mS
+            if dly > 31:
+                raise ValueError('Sample rate too high for magnetometer: set filter_range > 0')
+            self.passthrough = False
+            self._setreg(0x24, 0x40 | 13)       # Data ready waits for mag. 400KHz.
+            self._setreg(0x25, 0x80 | self._mag_addr) # SLV0 reads ST1, data, ST2
+            self._setreg(0x26, 0x02)
+            self._setreg(0x27, 0x88)
+            self._setreg(0x28, self._mag_addr)  # SLV1 triggers next measurement
+            self._setreg(0x29, 0x0A)
+            self._setreg(0x64, 0x01)
+            self._setreg(0x2A, 0x81)
+            self._setreg(0x34, dly)             # Slaves 0 and 1 sample every 1 + dly samples
+            self._setreg(0x67, 0x03)
+            self._setreg(0x6A, self._getreg(0x6A) | 0x20)
+            self.mag_triggered = False
+        else:
+            self._setreg(0x27, 0)               # Disable slaves
+            self._setreg(0x2A, 0)
+            self.passthrough = True             # Disables I2C master
+        self._frame_mode(mode)
+
+    def configure(self, output_hz, bandwidth_hz = None, mag_hz = None, read_hz = None):
+        '''
+        Set sample_rate, filter_range and the magnetometer mode and decimation for the
+        required output rate. If read_hz is below the output rate the FIFO is started
+        to be drained by fifo_read() at read_hz. Returns the plan: see rateplan.py.
+        '''
+        p = plan(output_hz, bandwidth_hz, mag_hz, read_hz)
+        if self._fifo_ring is not None:
+            self.fifo_stop()
+        self.filter_range = p['filter_range']
+        self.sample_rate = p['sample_rate']
+        self.mag_master = p['mag_master']
+        if p['mag_master']:
+            self._setreg(0x34, p['mag_dly'])    # Replace the default decimation
+        if p['fifo_frames'] is not None:
+            self.fifo_start(4 * p['fifo_frames'], p['fifo_chunk'])
+        return p
+
+    def _frame_mode(self, mode):                # Driver state for frames with or without the mag
+        if mode:
+            self._mag_raw[0] = 0                # Next sample is new
+            self._allbuf = self.buf22
+            self._fifo_en = 0xF9                # Include SLV0 data
+            self._fifo_framelen = 22
+            self._frame_width = 10
+        else:
+            self._allbuf = self.buf14
+            self._fifo_en = 0xF8
+            self._fifo_framelen = 14
+            self._frame_width = 7
+        self._mag_master = mode
+
+    def _profile_data(self):
+        prof = super()._profile_data()
+        prof['mag_correction'] = list(self.mag_correction)
+        prof['mag_cal'] = list(self._mag.cal)
+        sm = self._mag.softiron
+        prof['mag_softiron'] = None if sm is None else [list(row) for row in sm]
+        prof['mag_mounting'] = [list(row) for row in self._mag.mounting]
+        prof['mag_master'] = self._mag_master
+        return prof
+
+    def _mag_decode(self, buf, offs):           # Can be used in an interrupt handler
+        '''
+        Decode ST1, data and ST2 from buf[offs]. Returns True and updates
+        _mag._ivector if new valid data is present.
+        '''
+        if not buf[offs] & 1 or buf[offs + 7] & 0x0C: # Not ready, overflow or data error
+            self._mag_stale_count += 1
+            return False
+        self._mag._ivector[0] = bytes_toint(buf[offs + 2], buf[offs + 1])
+        self._mag._ivector[1] = bytes_toint(buf[offs + 4], buf[offs + 3])
+        self._mag._ivector[2] = bytes_toint(buf[offs + 6], buf[offs + 5])
+        self._mag_stale_count = 0
+        return True
+
+    def _master_decode(self, buf, offs):        # As _mag_decode() for data read by the I2C master
+        if not buf[offs] & 1 or buf[offs + 7] & 0x0C:
+            self._mag_stale_count += 1
+            return False
+        raw = self._mag_raw                     # EXT_SENS_DATA holds the last slave read until the
+        new = False                             # next, which occurs every 1 + I2C_MST_DLY samples
+        for n in range(8):
+            if raw[n] != buf[offs + n]:
+                raw[n] = buf[offs + n]
+                new = True
+        if new:                                 # Slave reads follow at intervals from here
+            self._mag_ref = pyb.micros()
+            self._mag_periods = 1
+        elif not self._mag_due():               # Same bytes: new only if a slave read is due
+            self._mag_stale_count += 1
+            return False
+        return self._mag_decode(buf, offs)
+
+    def _mag_due(self):                         # Same bytes as the last read: True if a slave read is due
+        dlpf = self._getreg(0x1A) & 7
+        period = (1 + self._getreg(0x19)) * (1 + (self._getreg(0x34) & 0x1F)) # In samples
+        period *= 125 if dlpf in (0, 7) else 1000 # us
+        elapsed = pyb.elapsed_micros(self._mag_ref)
+        if elapsed < self._mag_periods * period:
+            return False
+        self._mag_periods += 1
+        if elapsed >= self._mag_periods * period: # Reads have lapsed: resynchronise
+            self._mag_ref = pyb.micros()
+            self._mag_periods = 1
+        return True
+
+    def sample(self):
+        '''
+        Start a new sample epoch. Outside mag_master mode the magnetometer is read
+        without blocking, except to obtain its first sample: set mag_continuous to
+        keep it current.
+        '''
+        super().sample()
+        if not self._mag_master:
+            if self._mag_time is None:
+                while not self.mag_ready:
+                    self.mag_wait_func()
+            self._mag_callback()
+
+    def _update_funcs(self):
+        return self._accel_callback, self._gyro_callback, self._mag_callback
+
+    def _unpack_all(self):
+        super()._unpack_all()
+        if self._mag_master:
+            self._master_decode(self._allbuf, 14)
+
+    def _all_read(self):                        # In mag_master mode read_all() includes the magnetometer
+        if not super()._all_read():
+            return False
+        if self._mag_master and not self._mag_stale_count:
+            self._mag_time = pyb.micros()
+            self._mag_sample()
+        return True
+
+    def _decode_frame(self, buf, offs, frame):
+        super()._decode_frame(buf, offs, frame)
+        if self._mag_master:                    # Invalid mag data: frame retains last good value
+            if self._master_decode(buf, offs + 14):
+                frame[7] = self._mag._ivector[0]
+                frame[8] = self._mag._ivector[1]
+                frame[9] = self._mag._ivector[2]
+
+    def load_frame(self, frame):
+        '''
+        Update the Vector3d objects and temperature from a raw frame. In mag_master
+        mode frames also hold the magnetometer (mx, my, mz).
+        '''
+        super().load_frame(frame)
+        if len(frame) >= 10:
+            self._mag._ivector[0] = frame[7]
+            self._mag._ivector[1] = frame[8]
+            self._mag._ivector[2] = frame[9]
+            self._mag_scale()
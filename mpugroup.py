@@ -0,0 +1,173 @@
+# mpugroup.py Time aligned sampling of multiple MPU9150 devices
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Up to two devices may be connected to each of the Pyboard's two I2C interfaces.
+# A sample set is acquired with one read_all() burst per device, issued back to back
+# so that the readings are as close in time as possible. MicroPython's I2C transfers
+# block so transfers on the two interfaces cannot overlap: reads alternate between
+# interfaces so that each bus is idle while the other is in use. The time of each
+# device's read relative to the set's timestamp is recorded as its skew.
+# Where the transport supports batches (Linux i2c-dev) the devices on a bus are read in
+# one batch: one system call. Devices in a batch share a skew value.
+# Where two devices share an interface their magnetometers have the same address: use
+# mag_master mode, which also includes the magnetometer in the burst read.
+
+from array import array
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:                             # CPython: the simulation or Linux
+    from pybcompat import ticks_us, ticks_diff
+
+class MPUGroup(object):
+    '''
+    Owns up to four MPU9150 instances and acquires sample sets from them. After
+    read() each set has a single ticks_us timestamp, per-device skew in us and a
+    per-device valid flag. mean(), median() and spread() combine the devices.
+    '''
+    _sensors = {'accel' : 0, 'gyro' : 1, 'mag' : 2}
+    def __init__(self, imus):
+        n = len(imus)
+        if not 0 < n <= 4:
+            raise ValueError('From 1 to 4 devices are supported')
+        if len(set((imu._side, imu.mpu_addr) for imu in imus)) != n:
+            raise ValueError('A device may only be added once')
+        self.imus = tuple(imus)
+        buses = []                              # Device indices on each interface
+        for k, imu in enumerate(imus):
+            for bus in buses:
+                if imus[bus[0]]._side == imu._side:
+                    bus.append(k)
+                    break
+            else:
+                buses.append([k])
+        steps = []                              # Each step is a batch or a single device
+        for bus in buses:
+            i2c = imus[bus[0]]._mpu_i2c
+            if i2c.batched and len(bus) > 1 and all(imus[k]._mpu_i2c is i2c for k in bus):
+                steps.append([tuple(bus)])
+            else:
+                steps.append([(k,) for k in bus])
+        order = []                              # Alternate between interfaces
+        for k in range(max(len(s) for s in steps)):
+            for bus in steps:
+                if k < len(bus):
+                    order.append(bus[k])
+        self._order = tuple(order)
+        self._vals = [array('f', (0, 0, 0)) for _ in range(n)]
+        self.skew = array('i', [0]*n)           # us from timestamp to start of each device's read
+        self.valid = bytearray(n)               # 1 if a device's most recent read succeeded
+        self.timestamp = 0                      # ticks_us at start of most recent set
+        self.latency = 0                        # us to acquire the most recent set
+        self.sets = 0
+        self.errors = 0
+
+    def read(self):
+        '''
+        Acquire a sample set. A device which fails is flagged invalid and the rest
+        are read. Returns the number of devices read successfully.
+        '''
+        skew = self.skew
+        valid = self.valid
+        imus = self.imus
+        good = 0
+        start = ticks_us()
+        for step in self._order:
+            t = ticks_diff(ticks_us(), start)
+            done = len(step) > 1 and self._batch(step)
+            for n in step:
+                skew[n] = t if done else ticks_diff(ticks_us(), start)
+                try:                            # False if recovery failed: values retained
+                    ok = imus[n]._all_read() if done else imus[n].read_all()
+                except OSError:                 # MPUException: retain last values
+                    ok = False
+                if ok:
+                    valid[n] = 1
+                    good += 1
+                else:
+                    valid[n] = 0
+                    self.errors += 1
+        self.latency = ticks_diff(ticks_us(), start)
+        self.timestamp = start
+        self.sets += 1
+        return good
+
+    def _batch(self, step):                     # Read the devices' read_all() registers in one batch
+        imus = self.imus
+        if any(imus[n]._io_bound for n in step): # Instrumentation and recovery act per transaction
+            return False
+        try:
+            imus[step[0]]._mpu_i2c.mem_read_batch([(imus[n]._allbuf, imus[n].mpu_addr, 0x3B) for n in step],
+                                                  imus[step[0]].timeout)
+        except OSError:                         # Read the devices in turn to find the failure
+            return False
+        return True
+
+    def _fill(self, sensor):                    # Load corrected values of valid devices
+        try:
+            idx = self._sensors[sensor]
+        except KeyError:
+            raise ValueError('Sensor must be accel, gyro or mag')
+        vals = self._vals
+        count = 0
+        for n, imu in enumerate(self.imus):
+            if self.valid[n]:
+                imu.sensors[idx].last_xyz_into(vals[count])
+                count += 1
+        if not count:
+            raise ValueError('No valid data')
+        return count
+
+    def mean(self, sensor = 'accel'):
+        '''
+        Return the (x, y, z) mean of a sensor's values over the valid devices.
+        '''
+        count = self._fill(sensor)
+        vals = self._vals
+        return tuple(sum(vals[n][axis] for n in range(count)) / count for axis in range(3))
+
+    def median(self, sensor = 'accel'):
+        '''
+        Return the (x, y, z) median of a sensor's values over the valid devices.
+        With three or more devices a single faulty device is outvoted.
+        '''
+        count = self._fill(sensor)
+        vals = self._vals
+        res = []
+        for axis in range(3):
+            v = sorted(vals[n][axis] for n in range(count))
+            mid = count // 2
+            res.append(v[mid] if count & 1 else (v[mid - 1] + v[mid]) / 2)
+        return tuple(res)
+
+    def spread(self, sensor = 'accel'):
+        '''
+        Return the (x, y, z) difference between the largest and smallest values of
+        the valid devices: a measure of their disagreement.
+        '''
+        count = self._fill(sensor)
+        vals = self._vals
+        res = []
+        for axis in range(3):
+            v = [vals[n][axis] for n in range(count)]
+            res.append(max(v) - min(v))
+        return tuple(res)
@@ -0,0 +1,79 @@
+# pybcompat.py Subset of the pyb module used by the drivers, for ports without it
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# The drivers import pyb for timing and interrupt masking. Where it is absent (ports
+# with the machine module and CPython on Linux) they import this module in its place.
+# Data ready interrupts (irq_start()) and the 'X' and 'Y' transports still need pyb.
+# Modules needing ticks_us() etc. import them from here under CPython. As in MicroPython
+# ticks wrap at 2**30 and ticks_diff() allows for this. In the simulation they follow
+# its virtual clock.
+
+try:
+    from time import ticks_us, ticks_ms, ticks_diff, ticks_add, sleep_ms, sleep_us
+except ImportError:                             # CPython
+    from time import monotonic, sleep
+    try:
+        from pyb import micros as _clock        # The simulation
+    except ImportError:                         # Linux
+        def _clock():
+            return int(monotonic() * 1000000)
+    _PERIOD = 1 << 30
+    _MASK = _PERIOD - 1
+    _HALF = _PERIOD >> 1
+    def ticks_us():
+        return _clock() & _MASK
+    def ticks_ms():
+        return (_clock() // 1000) & _MASK
+    def ticks_diff(a, b):
+        return ((a - b + _HALF) & _MASK) - _HALF
+    def ticks_add(a, b):
+        return (a + b) & _MASK
+    def sleep_ms(ms):
+        sleep(ms / 1000)
+    def sleep_us(us):
+        sleep(us / 1000000)
+try:
+    from machine import disable_irq, enable_irq
+except ImportError:                             # CPython: nothing to mask
+    def disable_irq():
+        return None
+    def enable_irq(state = None):
+        pass
+
+def micros():
+    return ticks_us()
+
+def millis():
+    return ticks_ms()
+
+def elapsed_micros(start):
+    return ticks_diff(ticks_us(), start)
+
+def elapsed_millis(start):
+    return ticks_diff(ticks_ms(), start)
+
+def delay(ms):
+    sleep_ms(ms)
+
+def udelay(us):
+    sleep_us(us)
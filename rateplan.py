@@ -0,0 +1,94 @@
+# rateplan.py Choice of MPU9150 rate settings for a required output rate
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# plan() does no I/O: MPU9150.configure() applies its result. The internal sample rate
+# is 1KHz unless filter_range 0 is required, as that raises it to 8KHz. The filter
+# defaults to the widest bandwidth which does not exceed half the output rate. The
+# magnetometer is read by the MPU's I2C master so that it arrives in the same burst
+# as the other sensors at no extra transactions. If read_hz is below the output rate
+# samples are buffered in the FIFO and read in one burst per wakeup.
+
+CUTOFF = (250, 184, 92, 41, 20, 10, 5)          # Gyro bandwidth in Hz for each filter_range
+FIFO_SIZE = 1024
+MAG_MAX_HZ = 100                                # Magnetometer conversion takes up to 9mS
+
+def _ceil_div(a, b):
+    return int(-(-a // b))
+
+def plan(output_hz, bandwidth_hz = None, mag_hz = None, read_hz = None):
+    '''
+    Return a dict of the settings meeting the requirements with the fewest bus
+    transactions and wakeups, together with the resulting rates and bus load.
+    '''
+    if output_hz <= 0:
+        raise ValueError('output_hz must be > 0')
+    if bandwidth_hz is not None:
+        if not 0 < bandwidth_hz <= CUTOFF[0]:
+            raise ValueError('bandwidth_hz must be in range 1-{}'.format(CUTOFF[0]))
+        filt = 0                                # Narrowest filter passing bandwidth_hz
+        for n in range(1, len(CUTOFF)):
+            if CUTOFF[n] >= bandwidth_hz:
+                filt = n
+    else:                                       # Widest filter within Nyquist limit
+        filt = len(CUTOFF) - 1
+        for n in range(len(CUTOFF) - 1, 0, -1):
+            if CUTOFF[n] <= output_hz / 2:
+                filt = n
+    if output_hz > 1000:                        # Needs the 8KHz internal rate
+        filt = 0
+    internal = 8000 if filt == 0 else 1000
+    div = max(0, min(255, int(internal / output_hz + 0.5) - 1))
+    rate = internal / (1 + div)
+    framelen = 14
+    mag_dly = None
+    mag_rate = None
+    if mag_hz is not None:
+        if mag_hz <= 0:
+            raise ValueError('mag_hz must be > 0')
+        mag_dly = _ceil_div(rate, min(mag_hz, MAG_MAX_HZ)) - 1
+        if mag_dly > 31:
+            raise ValueError('Output rate too high for magnetometer: at most {}Hz'.format(32 * MAG_MAX_HZ))
+        mag_rate = rate / (1 + mag_dly)
+        framelen = 22                           # ST1, data and ST2 follow the sensors
+    fifo_frames = None
+    fifo_chunk = None
+    if read_hz is not None and read_hz < rate:
+        if read_hz <= 0:
+            raise ValueError('read_hz must be > 0')
+        fifo_frames = _ceil_div(rate, read_hz)
+        limit = (FIFO_SIZE // framelen) * 3 // 4 # Allow for late reads
+        if fifo_frames > limit:
+            raise ValueError('read_hz too low: FIFO holds {} frames'.format(FIFO_SIZE // framelen))
+        fifo_chunk = min(2 * fifo_frames, limit) # Burst buffer: a late read still takes one burst
+        wakeups = rate / fifo_frames
+        transactions = 2 * wakeups              # FIFO count and one burst
+        nbytes = 2 * wakeups + rate * framelen
+    else:
+        wakeups = rate
+        transactions = rate                     # One read_all() per sample
+        nbytes = rate * framelen
+    return {'filter_range' : filt, 'sample_rate' : div, 'output_hz' : rate,
+            'bandwidth_hz' : CUTOFF[filt], 'mag_master' : mag_hz is not None,
+            'mag_dly' : mag_dly, 'mag_hz' : mag_rate, 'fifo_frames' : fifo_frames,
+            'fifo_chunk' : fifo_chunk, 'framelen' : framelen, 'wakeups_per_s' : wakeups,
+            'transactions_per_s' : transactions, 'bytes_per_s' : nbytes}
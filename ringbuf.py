@@ -0,0 +1,120 @@
+# ringbuf.py Circular buffer of integer sample frames for inertial measurement unit drivers
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Storage is a single preallocated array of signed 16 bit integers so that frames
+# can be written in interrupt handlers. When the buffer is full the oldest frame is
+# overwritten and the overruns count is incremented.
+
+from array import array
+
+class RingBuffer(object):
+    '''
+    Fixed size circular buffer holding nframes frames, each of width signed 16 bit
+    integers.
+    '''
+    def __init__(self, nframes, width):
+        if nframes < 1 or width < 1:
+            raise ValueError('nframes and width must be > 0')
+        self._buf = array('h', [0]*(nframes*width))
+        self._frame = array('h', [0]*width)    # Returned by the iterator
+        self._nframes = nframes
+        self.width = width
+        self._wi = 0                            # Index of next frame to write
+        self._ri = 0                            # Index of oldest unread frame
+        self._count = 0
+        self.overruns = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        return self._nframes
+
+    def clear(self):
+        self._wi = 0
+        self._ri = 0
+        self._count = 0
+
+    def put(self, src):
+        '''
+        Append a frame of width integers from any indexable sequence.
+        Can be used in an interrupt handler.
+        '''
+        buf = self._buf
+        width = self.width
+        base = self._wi * width
+        for n in range(width):
+            buf[base + n] = src[n]
+        self._wi = (self._wi + 1) % self._nframes
+        if self._count == self._nframes:        # Full: oldest frame has been lost
+            self._ri = self._wi
+            self.overruns += 1
+        else:
+            self._count += 1
+
+    def get(self, dest):
+        '''
+        Copy the oldest frame into dest (a list or array of width elements) and
+        remove it. Returns False if the buffer is empty. Can be used in an interrupt handler.
+        '''
+        if not self._count:
+            return False
+        buf = self._buf
+        width = self.width
+        base = self._ri * width
+        for n in range(width):
+            dest[n] = buf[base + n]
+        self._ri = (self._ri + 1) % self._nframes
+        self._count -= 1
+        return True
+
+    def read_into(self, dest, maxframes = None):
+        '''
+        Batch read: copy up to maxframes of the oldest frames consecutively into
+        dest (an array('h') of at least maxframes*width elements). Returns the
+        number of frames copied.
+        '''
+        if maxframes is None:
+            maxframes = len(dest) // self.width
+        nframes = min(maxframes, self._count)
+        buf = self._buf
+        width = self.width
+        di = 0
+        for _ in range(nframes):
+            base = self._ri * width
+            for n in range(width):
+                dest[di] = buf[base + n]
+                di += 1
+            self._ri = (self._ri + 1) % self._nframes
+        self._count -= nframes
+        return nframes
+
+    def __iter__(self):
+        '''
+        Iterate over the unread frames removing each one. For efficiency the same
+        array is yielded each time: copy it if it must be retained.
+        '''
+        frame = self._frame
+        while self.get(frame):
+            yield frame
@@ -0,0 +1,215 @@
+# samplehub.py Shared sampling of an MPU9150 for multiple consumers
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# The hub performs all device access: acquire() reads each sensor once (with sample())
+# and publish() stores the raw integers in a ring of fixed size frames. Every sample
+# has a sequence number: the count of samples published before it. Each subscriber
+# holds the sequence number of the next sample it will read, so the number of
+# consumers does not affect bus traffic. A subscriber which falls more than the ring's
+# length behind skips to the oldest retained sample and counts the samples it lost.
+# Readers take no lock: a read is repeated if publish() overwrote the slot meanwhile,
+# so publish() may run in a scheduled callback (e.g. from a Timer or irq_process()).
+
+from array import array
+from imulog import MAG_NEW, MAG_STALE, READ_ERROR # Frame flags
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
+try:
+    import micropython
+except ImportError:                             # CPython: start() needs pyb
+    micropython = None
+
+class Subscriber(object):
+    '''
+    A consumer's cursor into a SampleHub. Returned by SampleHub.subscribe().
+    '''
+    def __init__(self, hub, seq):
+        self._hub = hub
+        self.seq = seq                          # Sequence number of the next sample to read
+        self.overruns = 0                       # Samples lost because they were overwritten
+        self.timestamp = 0                      # pyb.micros() and flags of the last sample read
+        self.flags = 0
+        self._frame = [0]*hub.width             # Used by load()
+
+    def __len__(self):                          # Samples waiting to be read
+        hub = self._hub
+        return min(hub.seq - self.seq, hub.nframes)
+
+    def get(self, frame):
+        '''
+        Copy the next raw frame into frame, a list or array of hub.width elements.
+        Returns False if there is none. Does not allocate.
+        '''
+        hub = self._hub
+        nframes = hub.nframes
+        while True:
+            seq = self.seq
+            behind = hub.seq - seq
+            if behind <= 0:
+                return False
+            if behind > nframes:                # Overwritten: skip to the oldest retained
+                lost = behind - nframes
+                self.overruns += lost
+                self.seq = seq = seq + lost
+            hub._copy(seq, frame, self)
+            if hub.seq - seq <= nframes:        # Not overwritten during the copy
+                self.seq = seq + 1
+                return True
+
+    def latest(self, frame):
+        '''
+        Skip to the most recent sample and copy it into frame, as required by e.g. a
+        telemetry task. Skipped samples are not counted as overruns. Returns False if
+        there is no unread sample.
+        '''
+        hub = self._hub
+        if hub.seq - self.seq > 1:
+            self.seq = hub.seq - 1
+        return self.get(frame)
+
+    def load(self, latest = False):
+        '''
+        Load the next (or the latest) sample into the device's Vector3d objects with
+        load_frame(): values are then read with last_xyz, xyz_into() etc. These are
+        shared: read them before the next acquire() or load(). Returns False if there
+        is none.
+        '''
+        frame = self._frame
+        if not (self.latest(frame) if latest else self.get(frame)):
+            return False
+        self._hub.imu.load_frame(frame)
+        return True
+
+class SampleHub(object):
+    '''
+    Owns the sampling of an MPU9150 and publishes each sample to any number of
+    subscribers through a ring of nframes raw frames (ax, ay, az, temperature, gx,
+    gy, gz[, mx, my, mz]). The device is put into epoch mode (max_age = 0) so its
+    accessors return the latest sample without bus access.
+    '''
+    def __init__(self, imu, nframes = 32):
+        if nframes < 1:
+            raise ValueError('nframes must be > 0')
+        self.imu = imu
+        self.width = 10 if len(imu.sensors) > 2 else 7
+        self.nframes = nframes
+        self._ring = array('h', [0]*(nframes*self.width))
+        self._flags = bytearray(nframes)
+        self._times = [0]*nframes
+        self.seq = 0                            # Sequence number of the next sample published
+        self.errors = 0
+        self._mag_time = None
+        self._timer = None
+        self._acquire_ref = self._scheduled     # Bound method allocated here, not in the callback
+        imu.max_age = 0
+
+    def subscribe(self, latest = True):
+        '''
+        Return a Subscriber. By default it starts with the next sample published,
+        otherwise with the oldest retained.
+        '''
+        return Subscriber(self, self.seq if latest else max(0, self.seq - self.nframes))
+
+    def acquire(self):
+        '''
+        Read a sample from the device and publish it. Outside mag_master mode the
+        magnetometer is read without blocking: set mag_continuous to keep it current.
+        Returns False if the read failed: the frame then holds the previous values.
+        '''
+        flags = 0
+        imu = self.imu
+        try:
+            imu.sample()
+            if imu.stale:                       # Recovery enabled: last values retained
+                flags = READ_ERROR
+        except OSError:
+            flags = READ_ERROR
+        if flags:
+            self.errors += 1
+        self.publish(flags)
+        return not flags
+
+    def publish(self, flags = 0):
+        '''
+        Publish the device's current raw values without accessing it, e.g. from an
+        irq_start() callback. Does not allocate.
+        '''
+        imu = self.imu
+        ring = self._ring
+        width = self.width
+        slot = self.seq % self.nframes
+        base = slot * width
+        sensors = imu.sensors
+        v = sensors[0]._ivector
+        ring[base] = v[0]
+        ring[base + 1] = v[1]
+        ring[base + 2] = v[2]
+        ring[base + 3] = imu._itemp
+        v = sensors[1]._ivector
+        ring[base + 4] = v[0]
+        ring[base + 5] = v[1]
+        ring[base + 6] = v[2]
+        if width > 7:
+            v = sensors[2]._ivector
+            ring[base + 7] = v[0]
+            ring[base + 8] = v[1]
+            ring[base + 9] = v[2]
+            mtime = imu._mag_time
+            if mtime is not None and mtime != self._mag_time:
+                flags |= MAG_NEW
+                self._mag_time = mtime
+            if imu.mag_stale_count:
+                flags |= MAG_STALE
+        self._flags[slot] = flags
+        self._times[slot] = pyb.micros()
+        self.seq += 1                           # Publish: readers may now use the slot
+
+    def _copy(self, seq, frame, sub):           # Copy sample seq into frame
+        slot = seq % self.nframes
+        ring = self._ring
+        base = slot * self.width
+        for n in range(self.width):
+            frame[n] = ring[base + n]
+        sub.timestamp = self._times[slot]
+        sub.flags = self._flags[slot]
+
+    def start(self, timer):
+        '''
+        Acquire a sample on each callback of timer, a pyb.Timer set to the sample
+        rate. acquire() is run by micropython.schedule() outside the interrupt.
+        '''
+        self._timer = timer
+        timer.callback(self._tick)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.callback(None)
+            self._timer = None
+
+    def _tick(self, timer):                     # Timer interrupt: no allocation
+        micropython.schedule(self._acquire_ref, 0)
+
+    def _scheduled(self, _):
+        self.acquire()
@@ -0,0 +1,20 @@
+# micropython.py Simulated subset of the MicroPython micropython module
+# Authors Peter Hinch, Sebastian Plamauer
+
+from mpusim import clock
+
+def const(x):
+    return x
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def schedule(func, arg):                        # Runs when interrupts are next unmasked
+    clock.interrupt(lambda: func(arg))
+    return True
+
+def native(func):
+    return func
+
+def viper(func):
+    return func
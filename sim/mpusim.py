@@ -0,0 +1,459 @@
+# mpusim.py Simulated I2C bus and register models of the MPU9150 and AK8975
+# Enables the drivers to run unmodified under CPython for testing and benchmarking
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# Time is virtual: it advances when the driver calls pyb.delay() and by the modelled
+# duration of each bus transaction. Set clock.realtime = True to also sleep for real.
+# Sensor data is produced at the rate configured in the device registers, so data
+# ready, FIFO and the auxiliary I2C master behave as they would on hardware.
+
+import errno
+import random
+import time
+
+class Clock(object):
+    '''
+    Virtual microsecond clock shared by the simulated pyb module and device models.
+    '''
+    def __init__(self):
+        self.realtime = False
+        self._us = 0
+        self._listeners = []
+        self._pending = []
+        self.masked = 0                         # Nonzero during bus transactions and disable_irq()
+
+    def us(self):
+        return self._us
+
+    def advance(self, us):
+        '''
+        Move time forward, stopping at each event requested by a listener so that
+        device state changes occur at the correct instant.
+        '''
+        if us <= 0:
+            return
+        if self.realtime:
+            time.sleep(us/1000000)
+        target = self._us + int(us)
+        while True:
+            due = target
+            for func in self._listeners:
+                t = func(self._us)
+                if t is not None and self._us < t < due:
+                    due = t
+            if self._us >= target:
+                break
+            self._us = due
+
+    def add_listener(self, func):               # func(now_us) returns time of its next event or None
+        self._listeners.append(func)
+
+    def interrupt(self, func):                  # Run an interrupt handler now, or when unmasked
+        if self.masked:
+            if func not in self._pending:
+                self._pending.append(func)
+        else:
+            func()
+
+    def unmask(self):
+        self.masked -= 1
+        while not self.masked and self._pending:
+            self._pending.pop(0)()
+
+clock = Clock()
+
+def stationary(t_us):
+    '''
+    Default motion source. Returns accel (g), gyro (deg/s), mag (uT in MPU axes)
+    and temperature (C) for time t_us. A level, stationary sensor.
+    '''
+    return (0.0, 0.0, 1.0), (0.5, -0.25, 0.125), (20.0, 5.0, -40.0), 25.0
+
+def _clip16(v):
+    v = int(round(v))
+    return max(-32768, min(32767, v))
+
+def _put16(regs, addr, val, little = False):
+    val &= 0xffff
+    if little:
+        regs[addr], regs[addr + 1] = val & 0xff, val >> 8
+    else:
+        regs[addr], regs[addr + 1] = val >> 8, val & 0xff
+
+class FaultModel(object):
+    '''
+    Fault injection. Each transaction fails with the given probabilities.
+    fail_next(n, kind) forces the next n transactions to fail. kind is 'nack' or 'timeout'.
+    '''
+    def __init__(self, nack_rate = 0.0, timeout_rate = 0.0, seed = 1):
+        self.nack_rate = nack_rate
+        self.timeout_rate = timeout_rate
+        self._rand = random.Random(seed)
+        self._forced = 0
+        self._forced_kind = 'nack'
+        self.injected = 0
+
+    def fail_next(self, n = 1, kind = 'nack'):
+        self._forced = n
+        self._forced_kind = kind
+
+    def check(self):                            # Return None or an errno to raise
+        kind = None
+        if self._forced > 0:
+            self._forced -= 1
+            kind = self._forced_kind
+        else:
+            r = self._rand.random()
+            if r < self.nack_rate:
+                kind = 'nack'
+            elif r < self.nack_rate + self.timeout_rate:
+                kind = 'timeout'
+        if kind is None:
+            return None
+        self.injected += 1
+        return errno.ETIMEDOUT if kind == 'timeout' else errno.EIO
+
+class SimBus(object):
+    '''
+    A simulated I2C bus. Devices are attached at an address. Each transaction costs
+    base_us + per_byte_us * nbytes of (virtual) time: defaults approximate 400KHz.
+    stick(clocks) models a slave holding SDA low: transactions time out and leave the
+    I2C peripheral busy. The slave releases SDA after the given number of SCL clocks
+    and the peripheral recovers when re-initialised.
+    '''
+    def __init__(self, base_us = 50, per_byte_us = 22.5, faults = None):
+        self.base_us = base_us
+        self.per_byte_us = per_byte_us
+        self.faults = faults if faults is not None else FaultModel()
+        self._devices = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.stuck_clocks = 0                   # SCL clocks until SDA is released
+        self.busy = False                       # Peripheral needs re-initialisation
+        self._scl = 1
+
+    def stick(self, clocks = 9):
+        self.stuck_clocks = clocks
+
+    def sda(self):                              # Level of the SDA line
+        return 0 if self.stuck_clocks else 1
+
+    def scl(self, level):                       # Drive SCL as a GPIO
+        if level and not self._scl and self.stuck_clocks:
+            self.stuck_clocks -= 1
+        self._scl = level
+
+    def _check(self, timeout_ms):               # Raise if the bus or peripheral is locked
+        if self.busy:
+            clock.advance(self.base_us)
+            raise OSError(errno.EBUSY)
+        if self.stuck_clocks:
+            self.busy = True
+            clock.advance(timeout_ms * 1000)
+            raise OSError(errno.ETIMEDOUT)
+
+    def attach(self, addr, device):             # Several devices may share an address
+        self._devices.setdefault(addr, []).append(device)
+
+    def device(self, addr, n = 0):              # The nth device attached at addr
+        return self._devices[addr][n]
+
+    def devices(self):
+        for devs in self._devices.values():
+            for dev in devs:
+                yield dev
+
+    def _visible(self, addr):
+        return [dev for dev in self._devices.get(addr, ()) if dev.visible()]
+
+    def _device(self, addr):
+        devs = self._visible(addr)
+        if len(devs) != 1:                      # Absent or an address conflict
+            raise OSError(errno.EIO)
+        return devs[0]
+
+    def _transact(self, nbytes):                # Account for a transaction: raise any injected fault
+        self.transactions += 1
+        self.bytes += nbytes
+        err = self.faults.check()
+        if err is not None:
+            self._elapse(nbytes)
+            raise OSError(err)
+
+    def _elapse(self, nbytes):                  # Time passes after the device has been accessed
+        clock.advance(self.base_us + self.per_byte_us * (nbytes + 2))
+
+    def scan(self):
+        return [a for a in sorted(self._devices) if self._visible(a)]
+
+    def mem_read(self, addr, memaddr, nbytes, timeout_ms = 5):
+        clock.masked += 1                       # Interrupts are serviced after the transaction
+        try:
+            self._check(timeout_ms)
+            self._transact(nbytes)
+            data = self._device(addr).read(memaddr, nbytes)
+            self._elapse(nbytes)
+            return data
+        finally:
+            clock.unmask()
+
+    def mem_write(self, addr, memaddr, data, timeout_ms = 5):
+        clock.masked += 1
+        try:
+            self._check(timeout_ms)
+            self._transact(len(data))
+            self._device(addr).write(memaddr, data)
+            self._elapse(len(data))
+        finally:
+            clock.unmask()
+
+class AK8975Model(object):
+    '''
+    Register model of the AK8975 magnetometer. A single measurement completes
+    conv_us after CNTL is set to 1. ST2 reports an overflow (HOFL) if the overflow
+    attribute is True or if |x| + |y| + |z| of the field is 2400uT or more.
+    '''
+    WIA = 0x48
+    def __init__(self, asa = (0x80, 0x88, 0x78), conv_us = 7300):
+        self.regs = bytearray(0x13)
+        self.regs[0] = self.WIA
+        self.asa = asa
+        self.conv_us = conv_us
+        self.field = (0.0, 0.0, 0.0)            # uT in AK8975 axes
+        self.overflow = False
+        self._due = None
+        self.host = None                        # Set by the MPU when it owns this device
+        self.measurements = 0
+
+    def visible(self):
+        return self.host is None or self.host.bypass()
+
+    def tick(self, now):
+        if self._due is not None and now >= self._due:
+            self._due = None
+            self.measurements += 1
+            for n, val in enumerate(self.field):
+                sens = (self.asa[n] - 128) * 0.5 / 128 + 1
+                _put16(self.regs, 3 + 2*n, _clip16(val / (0.3 * sens)), little = True)
+            self.regs[0x02] = 1                 # DRDY
+            overflow = self.overflow or sum(abs(v) for v in self.field) >= 2400 # HOFL per datasheet
+            self.regs[0x09] = 0x08 if overflow else 0
+            self.regs[0x0A] = 0                 # Back to power down
+
+    def read(self, memaddr, nbytes):
+        self.tick(clock.us())
+        res = bytearray(nbytes)
+        for n in range(nbytes):
+            a = memaddr + n
+            if self.regs[0x0A] == 0x0F and 0x10 <= a <= 0x12:
+                res[n] = self.asa[a - 0x10]
+            elif a < len(self.regs):
+                res[n] = self.regs[a]
+            if a == 0x09:                       # Reading ST2 ends the data read
+                self.regs[0x02] = 0
+        return bytes(res)
+
+    def write(self, memaddr, data):
+        for n, val in enumerate(data):
+            a = memaddr + n
+            if a == 0x0A:
+                self.regs[a] = val
+                if val == 1:
+                    self.regs[0x02] = 0
+                    self._due = clock.us() + self.conv_us
+            elif a < len(self.regs) and a >= 0x0A:
+                self.regs[a] = val
+
+def default_buses():
+    '''
+    Bus 1 ('X') carries an MPU9150 at address 104 and bus 2 ('Y') one at 105. Each
+    AK8975 is attached at address 12, visible only when its MPU is in bypass mode.
+    '''
+    buses = {}
+    for bus, addr in ((1, 104), (2, 105)):
+        mpu = MPU9150Model()
+        buses[bus] = SimBus()
+        buses[bus].attach(addr, mpu)
+        buses[bus].attach(12, mpu.mag)
+    return buses
+
+class MPU9150Model(object):
+    '''
+    Register model of the MPU9150 accel/gyro. Samples are generated at the rate set by
+    SMPLRT_DIV and CONFIG. Supports data ready interrupts, the FIFO and the auxiliary
+    I2C master with slaves 0-4. The AK8975 sits on the auxiliary bus.
+    '''
+    WHO_AM_I = 0x68
+    FIFO_SIZE = 1024
+    def __init__(self, mag = None, source = stationary):
+        self.mag = mag if mag is not None else AK8975Model()
+        self.mag.host = self
+        self.source = source
+        self.int_callbacks = []                 # Called on rising edge of INT pin
+        self.regs = bytearray(128)
+        self.fifo = bytearray()
+        self.samples = 0
+        self.reset()
+        clock.add_listener(self.tick)
+
+    def reset(self):
+        self.regs[:] = bytearray(128)
+        self.regs[0x6B] = 0x40                  # Asleep
+        self.regs[0x75] = self.WHO_AM_I
+        self.fifo = bytearray()
+        self._next = None
+
+    def visible(self):
+        return True
+
+    def bypass(self):
+        return bool(self.regs[0x37] & 0x02) and not self.regs[0x6A] & 0x20
+
+    def sample_period(self):
+        dlpf = self.regs[0x1A] & 7
+        internal = 8000 if dlpf in (0, 7) else 1000
+        return 1000000 * (1 + self.regs[0x19]) / internal
+
+    def tick(self, now):
+        self.mag.tick(now)
+        due = self.mag._due
+        if self.regs[0x6B] & 0x40:
+            self._next = None
+            return due
+        if self._next is None:
+            self._next = now + self.sample_period()
+        while now >= self._next:
+            self._sample(now)
+            self._next += self.sample_period()
+        nxt = int(self._next) + (self._next > int(self._next))
+        return nxt if due is None else min(nxt, due)
+
+    def _sample(self, t):
+        self.samples += 1
+        accel, gyro, field, temp = self.source(t)
+        self.mag.field = (field[1], field[0], -field[2])  # AK8975 axes differ from the MPU's
+        ascale = (16384, 8192, 4096, 2048)[(self.regs[0x1C] >> 3) & 3]
+        gscale = (131, 65.5, 32.8, 16.4)[(self.regs[0x1B] >> 3) & 3]
+        for n in range(3):
+            _put16(self.regs, 0x3B + 2*n, _clip16(accel[n] * ascale))
+            _put16(self.regs, 0x43 + 2*n, _clip16(gyro[n] * gscale))
+        _put16(self.regs, 0x41, _clip16((temp - 35) * 340))
+        if self.regs[0x6A] & 0x20:
+            self._i2c_master()
+        if self.regs[0x6A] & 0x40:
+            self._fifo_push()
+        self.regs[0x3A] |= 1                    # DATA_RDY_INT
+        if self.regs[0x38] & 1:
+            for func in self.int_callbacks:
+                clock.interrupt(func)
+
+    def _i2c_master(self):
+        mag = self.mag
+        self.mag.tick(clock.us())
+        dly = self.regs[0x34] & 0x1f
+        decimate = (self.samples % (1 + dly)) != 0
+        ext = 0x49
+        for slv in range(4):
+            base = 0x25 + 3*slv
+            addr, reg, ctrl = self.regs[base], self.regs[base + 1], self.regs[base + 2]
+            length = ctrl & 0x0F
+            if not ctrl & 0x80:
+                continue
+            if decimate and self.regs[0x67] & (1 << slv):
+                if addr & 0x80:
+                    ext += length
+                continue
+            if (addr & 0x7F) != 0x0C:
+                continue
+            if addr & 0x80:
+                data = mag.read(reg, length)
+                self.regs[ext:ext + length] = data
+                ext += length
+            else:
+                mag.write(reg, bytes((self.regs[0x63 + slv],)))
+        if self.regs[0x34] & 0x80:              # Slave 4 single transfer
+            addr, reg = self.regs[0x31], self.regs[0x32]
+            if addr & 0x80:
+                self.regs[0x35] = mag.read(reg, 1)[0]
+            else:
+                mag.write(reg, bytes((self.regs[0x33],)))
+            self.regs[0x34] &= 0x7F
+            self.regs[0x36] |= 0x40             # SLV4_DONE
+
+    def _fifo_push(self):
+        en = self.regs[0x23]
+        frame = bytearray()
+        if en & 0x08:
+            frame += self.regs[0x3B:0x41]
+        if en & 0x80:
+            frame += self.regs[0x41:0x43]
+        for bit, a in ((0x40, 0x43), (0x20, 0x45), (0x10, 0x47)):
+            if en & bit:
+                frame += self.regs[a:a + 2]
+        ext = 0x49
+        for slv in range(3):
+            length = self.regs[0x27 + 3*slv] & 0x0F if self.regs[0x27 + 3*slv] & 0x80 else 0
+            if en & (1 << slv):
+                frame += self.regs[ext:ext + length]
+            ext += length
+        self.fifo += frame
+        if len(self.fifo) > self.FIFO_SIZE:     # Oldest bytes are lost: frame alignment too
+            self.regs[0x3A] |= 0x10             # FIFO_OFLOW_INT
+            self.fifo = self.fifo[-self.FIFO_SIZE:]
+
+    def read(self, memaddr, nbytes):
+        if memaddr == 0x74:                     # FIFO_R_W does not auto increment
+            res = self.fifo[:nbytes]
+            del self.fifo[:nbytes]
+            return bytes(res) + bytes(nbytes - len(res))
+        res = bytearray(nbytes)
+        for n in range(nbytes):
+            a = memaddr + n
+            if a == 0x72:
+                res[n] = len(self.fifo) >> 8
+            elif a == 0x73:
+                res[n] = len(self.fifo) & 0xff
+            elif a < 128:
+                res[n] = self.regs[a]
+            if a == 0x3A:
+                self.regs[0x3A] = 0             # Cleared on read
+            elif a == 0x36:
+                self.regs[0x36] = 0
+        return bytes(res)
+
+    def write(self, memaddr, data):
+        for n, val in enumerate(data):
+            a = memaddr + n
+            if a == 0x6B and val & 0x80:
+                self.reset()
+                continue
+            if a == 0x6A:
+                if val & 0x04:
+                    self.fifo = bytearray()     # FIFO_RESET is self clearing
+                val &= ~0x07
+            if a == 0x74:
+                continue
+            if a not in (0x75, 0x3A, 0x72, 0x73) and a < 128:
+                self.regs[a] = val
+
+buses = default_buses()                         # Used by the simulated pyb.I2C
@@ -0,0 +1,165 @@
+# pyb.py Simulated subset of the Pyboard pyb module
+# Place the sim directory ahead of the drivers on sys.path to run them under CPython.
+# Authors Peter Hinch, Sebastian Plamauer
+
+# The devices on each bus are defined by mpusim.buses. Tests may replace or extend
+# these before instantiating the driver.
+
+import mpusim
+from mpusim import clock
+
+def millis():
+    return clock.us() // 1000
+
+def micros():
+    return clock.us()
+
+def elapsed_millis(start):
+    return millis() - start
+
+def elapsed_micros(start):
+    return micros() - start
+
+def delay(ms):
+    clock.advance(ms * 1000)
+
+def udelay(us):
+    clock.advance(us)
+
+def disable_irq():
+    clock.masked += 1
+    return True
+
+def enable_irq(state = True):
+    clock.unmask()
+
+class I2C(object):
+    MASTER = 0
+    SLAVE = 1
+    def __init__(self, bus, mode = MASTER, baudrate = 400000):
+        self.bus = mpusim.buses[bus]
+
+    def init(self, mode = MASTER, baudrate = 400000):
+        self.bus.busy = False
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        return self.bus.scan()
+
+    def is_ready(self, addr):
+        return addr in self.bus.scan()
+
+    def mem_read(self, data, addr, memaddr, timeout = 5000, addr_size = 8):
+        if isinstance(data, int):
+            return self.bus.mem_read(addr, memaddr, data, timeout)
+        data[:] = self.bus.mem_read(addr, memaddr, len(data), timeout)
+        return data
+
+    def mem_write(self, data, addr, memaddr, timeout = 5000, addr_size = 8):
+        if isinstance(data, int):
+            data = bytes((data & 0xff,))
+        self.bus.mem_write(addr, memaddr, bytes(data), timeout)
+
+class Pin(object):
+    '''
+    The I2C pins X9, X10 (bus 1) and Y9, Y10 (bus 2) drive and sense the simulated
+    bus lines, so that a stuck bus can be released by clocking SCL.
+    '''
+    IN = 0
+    OUT_PP = 1
+    OUT_OD = 2
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    _i2c = {'X9' : (1, 'scl'), 'X10' : (1, 'sda'), 'Y9' : (2, 'scl'), 'Y10' : (2, 'sda')}
+    def __init__(self, name, mode = IN, pull = PULL_NONE):
+        self.name = name
+        self._val = 1
+        self._line = self._i2c.get(name)
+
+    def init(self, mode = IN, pull = PULL_NONE):
+        pass
+
+    def value(self, val = None):
+        if val is None:
+            if self._line is not None and self._line[1] == 'sda':
+                return self._val & mpusim.buses[self._line[0]].sda() # Open drain: wired AND
+            return self._val
+        self._val = val
+        if self._line is not None and self._line[1] == 'scl':
+            mpusim.buses[self._line[0]].scl(val)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+class ExtInt(object):
+    '''
+    The simulated INT line of every MPU on every bus is wired to any ExtInt created:
+    tests normally use a single device. As on the Pyboard a line must be freed by
+    passing a callback of None before it can be reassigned.
+    '''
+    IRQ_RISING = 0
+    IRQ_FALLING = 1
+    IRQ_RISING_FALLING = 2
+    _lines = {}
+    def __init__(self, pin, mode, pull, callback):
+        self._callback = callback
+        self._enabled = True
+        self._line = 0
+        old = ExtInt._lines.pop(pin, None)
+        if old is not None:
+            if callback is not None and old._callback is not None:
+                ExtInt._lines[pin] = old
+                raise ValueError('ExtInt vector is already in use')
+            old._callback = None
+        if callback is None:
+            return
+        ExtInt._lines[pin] = self
+        for bus in mpusim.buses.values():
+            for dev in bus.devices():
+                if hasattr(dev, 'int_callbacks'):
+                    dev.int_callbacks.append(self._fire)
+
+    def _fire(self):
+        if self._enabled and self._callback is not None:
+            self._callback(self._line)
+
+    def enable(self):
+        self._enabled = True
+
+    def disable(self):
+        self._enabled = False
+
+    def line(self):
+        return self._line
+
+class Timer(object):
+    def __init__(self, num, freq = 1):
+        self._period = 1000000 / freq
+        self._next = clock.us() + self._period
+        self._callback = None
+        clock.add_listener(self._tick)
+
+    def _tick(self, now):
+        if self._callback is None:
+            return None
+        while now >= self._next:
+            self._next += self._period
+            clock.interrupt(self._run)
+        return int(self._next) + 1
+
+    def _run(self):
+        if self._callback is not None:
+            self._callback(self)
+
+    def callback(self, func):
+        self._callback = func
+        self._next = clock.us() + self._period
+
+    def deinit(self):
+        self._callback = None
@@ -0,0 +1,105 @@
+# replay.py Replay of recorded sessions through the simulated MPU9150
+# Authors Peter Hinch, Sebastian Plamauer
+
+# A Replay is a motion source for mpusim.MPU9150Model built from a log written by
+# imulog.BinaryLogger. At any instant the device model presents the most recent
+# recorded sample, so data ready, FIFO, interrupts and the magnetometer's conversion
+# timing, stale data and overflow follow the device registers as configured by the
+# driver under test. Raw values are converted to physical units using the log header.
+# The model then converts them back using its own range settings, so a driver
+# configured as it was when recording reads back the recorded integers.
+# Time is the simulation's virtual time: by default a session replays as fast as the
+# host can run it. Pass realtime=True to replay at the recorded speed.
+
+import json
+import struct
+import mpusim
+from mpusim import clock
+
+class Replay(object):
+    '''
+    Replays the log in filename. install() attaches it to a device model. If loop is
+    True the session repeats, otherwise the last sample is held and done becomes True.
+    '''
+    def __init__(self, filename, loop = False, realtime = False):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data[:6] != b'MPULOG':
+            raise ValueError('Not an MPU log file')
+        size = struct.unpack_from('<H', data, 6)[0]
+        h = json.loads(data[8:size].decode())
+        self.header = h
+        fmt = h['record']
+        reclen = struct.calcsize(fmt)
+        names = [field[0] for field in h['dtype']]
+        ti, flags = names.index('ticks_us'), names.index('flags')
+        ax, gx, mx, tmp = names.index('ax'), names.index('gx'), names.index('mx'), names.index('temp')
+        alsb, glsb = h['accel_lsb'], h['gyro_lsb']
+        c = h['mag_correction']                 # In AK8975 axis order
+        if h['version'] < 2:                    # Magnetometer recorded in MPU axes: x and y swapped
+            mscale = [c[1] * h['mag_ut'], c[0] * h['mag_ut'], c[2] * h['mag_ut']]
+            msign = (1, 1, 1)
+            maxes = (0, 1, 2)
+        else:                                   # Recorded in AK8975 axes
+            mscale = [c[n] * h['mag_ut'] for n in range(3)]
+            msign = (1, 1, -1)
+            maxes = (1, 0, 2)
+        self._times = []
+        self._samples = []
+        t = 0
+        last = None
+        for offs in range(size, len(data) - reclen + 1, reclen):
+            r = struct.unpack_from(fmt, data, offs)
+            if last is not None:
+                t += (r[ti] - last) % h['ticks_period']
+            last = r[ti]
+            if r[flags] & 4:                    # READ_ERROR: values not read
+                continue
+            self._times.append(t)
+            self._samples.append((tuple(r[ax + n] / alsb for n in range(3)),
+                                  tuple(r[gx + n] / glsb for n in range(3)),
+                                  tuple(r[mx + k] * mscale[k] * msign[n] for n, k in enumerate(maxes)),
+                                  r[tmp] * h['temp_scale'] + h['temp_offset']))
+        if not self._samples:
+            raise ValueError('Log holds no samples')
+        self.duration = self._times[-1]
+        self.loop = loop
+        self.realtime = realtime
+        self.done = False
+        self._start = 0
+        self._index = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def install(self, bus = 1, addr = 104):
+        '''
+        Make this the motion source of the device model at addr on bus and restart
+        the session. The magnetometer's fuse ROM is set to match the recording.
+        '''
+        model = mpusim.buses[bus].device(addr)
+        model.source = self
+        model.mag.asa = tuple(int(round((c - 1) * 256 + 128)) for c in self.header['mag_correction'])
+        clock.realtime = self.realtime
+        self.rewind()
+        return model
+
+    def rewind(self):
+        self._start = clock.us()
+        self._index = 0
+        self.done = False
+
+    def __call__(self, t_us):                   # Motion source interface
+        t = t_us - self._start
+        times = self._times
+        if self.loop and t > self.duration:
+            t %= self.duration + 1
+            if t < times[self._index]:
+                self._index = 0
+        n = self._index
+        while n + 1 < len(times) and times[n + 1] <= t:
+            n += 1
+        self._index = n
+        if n + 1 == len(times) and not self.loop:
+            self.done = True
+        return self._samples[n]
@@ -0,0 +1,27 @@
+# uasyncio.py Simulated subset of MicroPython's uasyncio running in virtual time
+# Authors Peter Hinch, Sebastian Plamauer
+
+# The CPython asyncio event loop is used, but sleeps are measured by the simulation's
+# virtual clock. A sleeping task first lets other ready tasks run: time is then
+# advanced only by the task whose wakeup time is the earliest.
+
+import asyncio
+from asyncio import *
+from mpusim import clock
+
+_sleepers = []                                  # Wakeup times of sleeping tasks
+
+async def sleep_ms(ms):
+    target = clock.us() + int(ms * 1000)
+    _sleepers.append(target)
+    try:
+        while clock.us() < target:
+            await asyncio.sleep(0)
+            now = clock.us()
+            if now < target and target == min(_sleepers):
+                clock.advance(target - now)
+    finally:
+        _sleepers.remove(target)
+
+async def sleep(secs):
+    await sleep_ms(secs * 1000)
@@ -0,0 +1,28 @@
+# Demo of the uasyncio interface. Expects an MPU9150 on X side.
+# A second task runs while the magnetometer conversion is awaited.
+
+import uasyncio as asyncio
+from mpu9150 import MPU9150
+from asyncmpu import AsyncMPU
+
+async def counter(count):
+    while True:
+        count[0] += 1
+        await asyncio.sleep_ms(1)
+
+async def main():
+    imu = AsyncMPU(MPU9150('X'))
+    count = [0]
+    asyncio.create_task(counter(count))
+    for _ in range(5):
+        start = count[0]
+        x, y, z = await imu.read_mag()
+        print('mag x {:5.1f} y {:5.1f} z {:5.1f} counter ran {} times'.format(x, y, z, count[0] - start))
+    n = 0
+    async for accel, gyro, temp in imu.stream(10):
+        print('accel x {:5.2f} y {:5.2f} z {:5.2f} temp {:4.1f}'.format(accel[0], accel[1], accel[2], temp))
+        n += 1
+        if n >= 20:
+            break
+
+asyncio.run(main())
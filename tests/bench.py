@@ -0,0 +1,136 @@
+# Benchmark of MPU9150 driver hot paths
+# Runs on the Pyboard or, from the repository root, on a host under CPython using the
+# simulation in the sim directory: python3 tests/bench.py [outfile]
+# For each operation reports mean time per call, I2C transactions and bytes per call
+# and heap bytes allocated per call. 'us' is CPU wall time; 'pyb_us' is measured by
+# pyb.micros() which on a host is the simulated time including modelled bus transfers.
+# Results are printed (and optionally written to outfile) as JSON so they can be
+# compared across releases.
+import sys
+import gc
+try:
+    import pyb
+except ImportError:                     # Running on a host: use the simulation
+    sys.path[:0] = ['sim', '.']
+    import pyb
+try:
+    import json
+except ImportError:
+    import ujson as json
+import imu
+from mpu9150 import MPU9150
+from ahrs import Madgwick, Mahony
+from transport import Transport
+
+try:                                    # Wall time source
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+    def ticks_diff(a, b):
+        return a - b
+
+try:                                    # Heap allocation measurement
+    gc.mem_alloc
+    def alloc_start():
+        gc.collect()
+        gc.disable()
+        return gc.mem_alloc()
+    def alloc_end(start):
+        res = gc.mem_alloc() - start
+        gc.enable()
+        return res
+except AttributeError:
+    import tracemalloc
+    def alloc_start():
+        tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0]
+    def alloc_end(start):
+        res = tracemalloc.get_traced_memory()[1] - start # Peak: approximates bytes allocated
+        tracemalloc.stop()
+        return res
+
+class CountingI2C(Transport):
+    '''
+    Wraps a transport counting transactions and bytes.
+    '''
+    def __init__(self, i2c):
+        self._i2c = i2c
+        self.name = i2c.name
+        self.transactions = 0
+        self.bytes = 0
+
+    def mem_read(self, data, addr, memaddr, timeout = 5000):
+        self.transactions += 1
+        self.bytes += data if isinstance(data, int) else len(data)
+        return self._i2c.mem_read(data, addr, memaddr, timeout = timeout)
+
+    def mem_write(self, data, addr, memaddr, timeout = 5000):
+        self.transactions += 1
+        self.bytes += 1 if isinstance(data, int) else len(data)
+        return self._i2c.mem_write(data, addr, memaddr, timeout = timeout)
+
+    def scan(self):
+        return self._i2c.scan()
+
+def measure(name, func, n, i2c):
+    func()                              # Warm up: e.g. trigger magnetometer
+    t0, b0 = i2c.transactions, i2c.bytes
+    pstart = pyb.micros()
+    start = ticks_us()
+    for _ in range(n):
+        func()
+    dt = ticks_diff(ticks_us(), start)
+    pdt = pyb.elapsed_micros(pstart)
+    res = {'op': name, 'n': n, 'us': dt / n, 'pyb_us': pdt / n,
+           'transactions': (i2c.transactions - t0) / n, 'bytes': (i2c.bytes - b0) / n}
+    a = alloc_start()                   # Measured separately: tracemalloc is slow
+    for _ in range(n):
+        func()
+    res['alloc'] = alloc_end(a) / n
+    return res
+
+def run(n = 100):
+    mpu = MPU9150('X')
+    i2c = CountingI2C(mpu._mpu_i2c)
+    mpu._mpu_i2c = i2c
+    count = [0]
+    def stop():                         # Stop calibration after n iterations
+        count[0] += 1
+        return count[0] > n
+    def calibrate():
+        count[0] = 0
+        mpu.mag_nonblocking.calibrate(stop, lambda : None)
+    madgwick = Madgwick(mpu)
+    mahony = Mahony(mpu)
+    tests = (
+        ('bytes_toint', lambda : imu.bytes_toint(0xfe, 0x12), n),
+        ('_accel_callback', mpu._accel_callback, n),
+        ('_gyro_callback', mpu._gyro_callback, n),
+        ('_mag_callback', mpu._mag_callback, n),
+        ('read_all', mpu.read_all, n),
+        ('accel.xyz', lambda : mpu.accel.xyz, n),
+        ('mag.xyz blocking', lambda : mpu.mag.xyz, n // 10),
+        ('mag.calibrate', calibrate, 1),
+        ('Madgwick.update', madgwick.update, n),
+        ('Mahony.update', mahony.update, n),
+        )
+    results = []
+    for name, func, reps in tests:
+        results.append(measure(name, func, reps, i2c))
+    return {'platform': sys.platform, 'implementation': sys.implementation.name,
+            'results': results}
+
+def main():
+    res = run()
+    for r in res['results']:
+        print('{:18s} {:10.1f}us {:10.1f}us {:6.2f} transactions {:7.1f} bytes {:8.1f} alloc'.format(
+            r['op'], r['us'], r['pyb_us'], r['transactions'], r['bytes'], r['alloc']))
+    s = json.dumps(res)
+    print(s)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as f:
+            f.write(s)
+
+main()
@@ -0,0 +1,53 @@
+# Host test of decoder.py. Run under CPython from the repository root:
+# python3 tests/decodertest.py
+# The struct and NumPy decode paths must produce identical arrays and mag_stale
+# counts for the same frames, including frames with invalid magnetometer data and
+# buffers decoded in several batches.
+import sys, os, random, struct
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [root]
+
+from testutil import check
+import decoder
+from decoder import FrameDecoder
+
+if decoder.numpy is None:
+    print('NumPy is not installed: nothing to compare')
+    sys.exit(0)
+
+random.seed(2)
+NFRAMES = 200
+
+def frames(mag):                                # Random frames, some with invalid mag data
+    buf = bytearray()
+    for n in range(NFRAMES):
+        buf += struct.pack('>7h', *[random.randint(-32768, 32767) for _ in range(7)])
+        if mag:
+            st1 = 0 if n % 7 == 3 else 1        # Not ready
+            st2 = 0x08 if n % 11 == 5 else random.choice((0, 0x10)) # Overflow or BITM only
+            if n == 0:
+                st1 = 0                         # Invalid before any good value
+            buf += struct.pack('<B3hB', st1, *[random.randint(-4096, 4095) for _ in range(3)], st2)
+    return buf
+
+def decode(buf, mag, use_numpy, batches):
+    dec = FrameDecoder(NFRAMES, mag, use_numpy)
+    mv = memoryview(buf)
+    index = 0
+    for size in batches:
+        index = dec.decode(mv[index * dec.framelen:], size, index)
+    return dec
+
+for mag in (False, True):
+    buf = frames(mag)
+    for batches in ((NFRAMES,), (1, 36, 63, 100), (50, 50, 50, 50)):
+        a = decode(buf, mag, False, batches)
+        b = decode(buf, mag, True, batches)
+        same = all(list(getattr(a, name)) == [int(x) for x in getattr(b, name)] for name in a.names)
+        check('Parity mag={} batches {}'.format(mag, batches), same and a.mag_stale == b.mag_stale)
+    if mag:
+        a = decode(buf, mag, False, (NFRAMES,))
+        stale = sum(1 for n in range(NFRAMES) if not buf[22*n + 14] & 1 or buf[22*n + 21] & 0x0C)
+        check('mag_stale counts invalid frames', a.mag_stale == stale and a.mx[0] == 0)
+        n = 3                                   # Not ready: holds frame 2's value
+        check('Invalid frame holds last good value', a.mx[n] == a.mx[n - 1] and a.mz[n] == a.mz[n - 1])
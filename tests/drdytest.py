@@ -0,0 +1,24 @@
+# Test program for data ready interrupt driven sampling of the MPU9150
+# Wire the MPU9150 INT pin to X12. Samples are captured in the interrupt handler
+# at the sensor's own rate and scaled later in a scheduled callback.
+import pyb
+from mpu9150 import MPU9150
+import micropython
+micropython.alloc_emergency_exception_buf(100)
+
+imu = MPU9150('X')
+imu.filter_range = 1                    # 1KHz internal rate
+imu.sample_rate = 9                     # 100Hz
+imu.mag_master = True                   # Magnetometer is included in each interrupt's read
+
+count = 0
+def cb(mpu):                            # Runs once per sample outside of the ISR
+    global count
+    count += 1
+    if count % 50 == 0:
+        print(mpu.accel.last_xyz, mpu.gyro.last_xyz, mpu.mag.last_xyz)
+
+imu.irq_start('X12', callback = cb)
+pyb.delay(5000)
+imu.irq_stop()
+print("Interrupts:", imu.irq_count, "Processed:", count, "Overruns:", imu.irq_overruns)
@@ -0,0 +1,233 @@
+# Host test of driver behaviour against the simulated bus in the sim directory.
+# Run under CPython from the repository root: python3 tests/drivertest.py
+import sys, os, math
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+from testutil import check
+import pyb
+import mpusim
+from mpu9150 import MPU9150
+
+def rotating(t):                                # Field rotating about z once per second
+    a = 2 * math.pi * t / 1000000
+    return (0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (30 * math.cos(a) + 10.0, 30 * math.sin(a) - 5.0, -40.0), 25.0
+
+model = mpusim.buses[1].device(104)
+imu = MPU9150('X')
+
+# Calibration in epoch mode reads the device on each iteration
+model.source = rotating
+imu.mag_continuous = True
+imu.sample()
+stop = pyb.millis() + 1500
+imu.mag.calibrate(lambda : pyb.millis() > stop)
+cx, cy, cz = imu.mag.cal                        # Sensor (AK8975) axes
+check('calibrate() in epoch mode', abs(cx + 5) < 2 and abs(cy - 10) < 2)
+imu.sample()
+check('Epoch accessors after calibrate()', imu.mag.magnitude > 10)
+imu.max_age = None
+imu.mag_continuous = False
+
+# mag_master: EXT_SENS_DATA repeats the last slave read between conversions
+class Counter(object):
+    def __init__(self):
+        self.count = 0
+    def feed(self, vec):
+        self.count += 1
+
+imu.filter_range = 1                            # 1KHz: the mag is read every 10 samples
+imu.mag_master = True
+for source in (rotating, mpusim.stationary):
+    model.source = source
+    imu.mag_calibrator = counter = Counter()
+    times = set()
+    start = model.mag.measurements
+    for _ in range(200):
+        pyb.delay(1)
+        imu.read_all()
+        times.add(imu._mag_time)
+    check('mag_master new samples at 100Hz ({})'.format(source.__name__),
+          abs(len(times) - (model.mag.measurements - start)) <= 1 and
+          abs(counter.count - len(times)) <= 1 and imu.mag_age < 11000)
+imu.mag_calibrator = None
+imu.mag_master = False
+
+# Mounting: transposition and scaling build the mounting matrix
+field = (20.0, -10.0, -40.0)                    # uT in MPU axes
+model.source = lambda t : ((0.1, 0.2, 0.9), (1.0, 2.0, 3.0), field, 25.0)
+pyb.delay(20)
+imu.mag.cal = (0, 0, 0)
+mx, my, mz = imu.mag.xyz
+check('mag in MPU axes', abs(mx - field[0]) < 0.5 and abs(my - field[1]) < 0.5 and abs(mz - field[2]) < 0.5)
+ix, iy, iz = imu.mag.ixyz                       # Raw values are in AK8975 axes
+check('Raw mag in AK8975 axes', abs(ix * 0.3 - field[1]) < 1.5 and abs(iy * 0.3 - field[0]) < 1.5
+      and abs(iz * 0.3 + field[2]) < 1.5)
+
+ymodel = mpusim.buses[2].device(105)
+ymodel.source = model.source
+imu2 = MPU9150('Y', transposition = (1, 0, 2), scaling = (1, 1, -1))
+acc, mag = imu2.accel, imu2.mag
+check('mounting from transposition and scaling', acc.mounting == ((0, 1, 0), (1, 0, 0), (0, 0, -1)))
+check('transpose and scale', acc.transpose == (1, 0, 2) and acc.scale == (1, 1, -1))
+pyb.delay(20)
+ax, ay, az = acc.xyz
+mx, my, mz = mag.xyz
+check('Transposed and scaled values', abs(ax - 0.2) < 0.01 and abs(ay - 0.1) < 0.01 and abs(az + 0.9) < 0.01
+      and abs(mx - field[1]) < 0.5 and abs(my - field[0]) < 0.5 and abs(mz + field[2]) < 0.5)
+acc.mounting = ((1, 1, 0), (0, 1, 0), (0, 0, 1))
+check('Non-orthogonal mounting', acc.transpose is None and acc.scale is None
+      and abs(acc.x - 0.3) < 0.01)
+
+# Warm start: constructor mounting takes precedence over the profile's
+import tempfile
+fn = os.path.join(tempfile.mkdtemp(), 'profile.json')
+rot = ((0, -1, 0), (1, 0, 0), (0, 0, 1))
+for vec in imu2.sensors:
+    vec.mounting = rot
+imu2.save_profile(fn)
+imu2 = MPU9150('Y', profile = fn)
+check('Warm start restores mounting', imu2.warm_start and all(v.mounting == rot for v in imu2.sensors))
+imu2 = MPU9150('Y', transposition = (1, 0, 2), scaling = (1, 1, -1), profile = fn)
+check('Constructor mounting overrides profile', imu2.warm_start and
+      all(v.mounting == ((0, 1, 0), (1, 0, 0), (0, 0, -1)) for v in imu2.sensors))
+
+# CPython ticks wrap at 2**30 as in MicroPython
+import pybcompat
+from imulog import BinaryLogger
+clock = pybcompat._clock
+pybcompat._clock = lambda : 72 * 60 * 1000000   # 72 minutes of uptime
+check('ticks_us wraps', 0 <= pybcompat.ticks_us() < 1 << 30)
+check('ticks_diff across the wrap', pybcompat.ticks_diff(5, (1 << 30) - 5) == 10 and
+      pybcompat.ticks_diff((1 << 30) - 5, 5) == -10 and pybcompat.ticks_add((1 << 30) - 5, 10) == 5)
+log = BinaryLogger(imu, os.path.join(tempfile.mkdtemp(), 'test.log'))
+check('BinaryLogger after 72 minutes', log.sample())
+log.close()
+pybcompat._clock = clock
+
+# Polled range getters are served from the register cache without recomputation
+import time
+qmat = (list(imu.accel._qmat), imu.accel._qshift)
+t = time.perf_counter()
+for _ in range(1000):
+    imu.accel_range, imu.gyro_range
+t = (time.perf_counter() - t) / 2000
+check('Range getters are cheap', t < 20e-6 and (list(imu.accel._qmat), imu.accel._qshift) == qmat)
+imu.accel_range = 2
+check('Setter recomputes the fixed point transform', (list(imu.accel._qmat), imu.accel._qshift) != qmat)
+
+# Direct continuous mode: DRDY marks each new sample, whatever the I2C master registers
+model.source = mpusim.stationary
+imu.sample_rate = 99
+imu.mag_continuous = True
+times = set()
+for _ in range(50):
+    pyb.delay(10)
+    imu._mag_callback()
+    times.add(imu._mag_time)
+check('mag_continuous new samples (stationary)', len(times) == 50 and imu.mag_stale_count == 0)
+imu.mag_continuous = False
+imu.sample_rate = 0
+
+# mag_calibrator is fed new samples only, not held copies in frames
+imu.mag_master = True
+pyb.delay(100)                                  # Let the 10Hz sample rate's last period expire
+imu.mag_calibrator = counter = Counter()
+imu.fifo_start()
+pyb.delay(31)
+imu.fifo_read()
+frames = 0
+for frame in imu.fifo:
+    imu.load_frame(frame)
+    frames += 1
+imu.fifo_stop()
+check('load_frame() does not feed mag_calibrator', frames >= 30 and counter.count == 0)
+start = model.mag.measurements
+for _ in range(30):
+    pyb.delay(1)
+    imu.read_all()
+check('read_all() feeds each new sample', abs(counter.count - (model.mag.measurements - start)) <= 1)
+imu.mag_calibrator = None
+imu.mag_master = False
+
+# Interrupt capture never runs fault recovery: it allocates and may block
+bus = mpusim.buses[1]
+imu.recovery_budget = 5000
+imu.instrument = True
+resets, retries = imu.bus_resets, imu.retries
+bus.faults.fail_next(1)
+try:
+    imu.get_all_irq()
+    failed = False
+except OSError:
+    failed = True
+check('get_all_irq() does not recover', failed and imu.bus_resets == resets and imu.retries == retries)
+bus.faults.fail_next(1)
+check('read_all() recovers', imu.read_all() and imu.retries > retries)
+imu.get_all_irq()
+check('get_all_irq() is instrumented', imu.stats()['transactions'] > 0)
+imu.instrument = False
+imu.recovery_budget = None
+
+# wake() and sleep() are commands: they write even if the cache shows no change
+ymodel.reset()                                  # Brownout: the device is asleep
+start = mpusim.buses[2].transactions
+imu2.wake()
+check('wake() after brownout', mpusim.buses[2].transactions - start == 1 and ymodel.regs[0x6B] == 0x01)
+imu2.sleep()
+imu2.sleep()
+check('sleep() always writes', mpusim.buses[2].transactions - start == 3 and ymodel.regs[0x6B] == 0x40)
+imu2.wake()
+
+# A range getter which rereads a changed register updates the fixed point transform
+model.source = lambda t : ((0.0, 0.0, 1.0), (0.0, 0.0, 0.0), (20.0, 5.0, -40.0), 25.0)
+imu.accel_range = 0
+imu._cached[0x1C] = 0                           # Cache miss, e.g. after a failed write
+model.regs[0x1C] = 0x08                         # Device holds range 1
+check('Getter rereads the range', imu.accel_range == 1)
+pyb.delay(5)
+imu.read_all()
+q = [0, 0, 0]
+imu.accel.qxyz_into(q)
+check('Fixed point agrees with float after reread', abs(q[2] / 65536 - imu.accel.last_xyz[2]) < 0.01
+      and abs(q[2] / 65536 - 1) < 0.01)
+imu.accel_range = 0
+
+# configure(): registers and measured bus traffic match the plan
+def traffic(func, period_ms, n):               # Transactions and bytes per second
+    t0, b0, start = bus.transactions, bus.bytes, pyb.micros()
+    for _ in range(n):
+        pyb.delay(period_ms)
+        func()
+    secs = pyb.elapsed_micros(start) / 1000000
+    return (bus.transactions - t0) / secs, (bus.bytes - b0) / secs
+
+def near(a, b):
+    return abs(a - b) <= 0.1 * b
+
+def drain():
+    imu.fifo_read()
+    for frame in imu.fifo:
+        pass
+
+p = imu.configure(100, mag_hz = 50)
+regs = [model.regs[r] for r in (0x19, 0x1A, 0x34)]
+check('configure() mag registers', p['mag_master'] and imu.mag_master and
+      regs == [p['sample_rate'], p['filter_range'], p['mag_dly']] == [9, 3, 1])
+pyb.delay(100)
+tps, bps = traffic(imu.read_all, 10, 100)
+check('configure() mag traffic', near(tps, p['transactions_per_s']) and near(bps, p['bytes_per_s']))
+p = imu.configure(200, read_hz = 20)
+regs = [model.regs[r] for r in (0x19, 0x1A)]
+check('configure() FIFO registers', p['fifo_frames'] == 10 and regs == [p['sample_rate'], p['filter_range']] == [4, 2])
+drain()
+tps, bps = traffic(drain, 50, 20)
+check('configure() FIFO traffic', near(tps, p['transactions_per_s']) and near(bps, p['bytes_per_s']))
+imu.fifo_stop()
+for args, kwargs in (((4000,), {'mag_hz' : 100}), ((1000,), {'read_hz' : 5})):
+    try:
+        imu.configure(*args, **kwargs)
+        failed = False
+    except ValueError:
+        failed = True
+    check('configure({}, {}) raises ValueError'.format(args[0], kwargs), failed)
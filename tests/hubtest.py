@@ -0,0 +1,80 @@
+# Host test of samplehub.py. Run under CPython from the repository root:
+# python3 tests/hubtest.py
+# An MPU9150 on a FakeI2C bus carrying a simulated device is shared by three
+# subscribers: bus traffic per sample must not depend on their number.
+import sys, os
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+from testutil import check
+import mpusim
+from transport import FakeI2C
+from mpu9150 import MPU9150
+from samplehub import SampleHub, READ_ERROR
+
+model = mpusim.MPU9150Model()
+fake = FakeI2C({104 : model, 12 : model.mag})
+imu = MPU9150(fake)
+imu.filter_range = 1
+imu.mag_master = True
+hub = SampleHub(imu, 8)
+model.source = lambda t : ((0.0, 0.0, 1.0), (10.0, 0.0, 0.0), (20.0, 0.0, -40.0), 25.0)
+
+def run(nsamples):                              # Bus calls per sample
+    start = fake.calls
+    for _ in range(nsamples):
+        mpusim.clock.advance(10000)
+        hub.acquire()
+    return (fake.calls - start) / nsamples
+
+fusion = hub.subscribe()
+single = run(4)
+logger = hub.subscribe(latest = False)
+telemetry = hub.subscribe()
+check('Bus traffic independent of subscribers', run(4) == single == 1)
+start = fake.calls
+imu.accel.xyz, imu.gyro.xyz, imu.mag.xyz
+check('Accessors do not access the bus', fake.calls == start)
+
+frame = [0]*hub.width
+n = 0
+while fusion.get(frame):
+    n += 1
+check('Subscriber reads every sample', n == 8 and fusion.overruns == 0 and len(fusion) == 0)
+check('Subscriber from oldest retained', len(logger) == 8)
+run(20)
+n = 0
+while logger.get(frame):
+    n += 1
+check('Overrun detected', n == 8 and logger.overruns == 20 and logger.seq == hub.seq)
+check('latest() skips without overrun', telemetry.latest(frame) and telemetry.overruns == 0
+      and telemetry.seq == hub.seq and not telemetry.get(frame))
+check('Frame holds raw values', frame[2] == imu.accel._ivector[2] and frame[7:] == list(imu.mag._ivector))
+run(1)
+check('load() gives corrected values', fusion.load(True) and abs(imu.accel.last_xyz[2] - 1) < 0.01
+      and abs(imu.gyro.last_xyz[0] - 10) < 0.1)
+
+# Slot overwritten while a subscriber copies it: the read is repeated
+sub = hub.subscribe(latest = False)
+copy = hub._copy
+def racing_copy(seq, frame, s):
+    hub._copy = copy
+    copy(seq, frame, s)
+    run(1)                                      # Publication during the copy
+hub._copy = racing_copy
+check('Overwrite during copy repeats the read', sub.get(frame) and sub.overruns == 1)
+
+fake.devices = {}
+ok = hub.acquire()
+check('Read error flagged', not ok and hub.errors == 1)
+fusion.latest(frame)
+check('Frame flags READ_ERROR', fusion.flags & READ_ERROR)
+
+# Acquisition driven by a Timer
+fake.devices = {104 : model, 12 : model.mag}
+import pyb
+hub.start(pyb.Timer(4, freq = 100))
+start = hub.seq
+pyb.delay(100)
+hub.stop()
+check('Timer acquisition', 9 <= hub.seq - start <= 11 and fusion.latest(frame) and not fusion.flags & READ_ERROR)
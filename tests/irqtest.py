@@ -4,6 +4,7 @@
 import pyb
 from mpu9150 import MPU9150
 import micropython
+from array import array
 micropython.alloc_emergency_exception_buf(100)
 
 # Note: with a magnetometer read in the callback, a frequency of 1KHz hogged the CPU
@@ -11,19 +12,25 @@ tim = pyb.Timer(4, freq=20)            # freq in Hz
 
 imu = MPU9150('X')
 
+qaccel = array('i', (0, 0, 0))          # Fixed point results: units of 2**-imu.qbits
+qgyro = array('i', (0, 0, 0))
+qmag = array('i', (0, 0, 0))
+
 def cb(timer):                          # Callback: populate array members
     imu.get_gyro_irq()
     imu.get_accel_irq()
     imu.get_mag_irq()
+    imu.accel.qxyz_into(qaccel)         # Corrected values using integer arithmetic
+    imu.gyro.qxyz_into(qgyro)
+    imu.mag.qxyz_into(qmag)
 
 tim.callback(cb)
 print("You should see slightly different values on each pair of readings.")
 print("            Accelerometer                               Gyro                                Magnetometer")
 for count in range(10):
     pyb.delay(400)
-    scale = 3.33198                     # Correction factors involve floating point
-    mag = list(map(lambda x, y : x*y/scale, imu.mag.ixyz, imu.mag_correction))
-    print("Interrupt:", [x/16384 for x in imu.accel.ixyz], [x/131 for x in imu.gyro.ixyz], mag)
+    one = 1 << imu.qbits
+    print("Interrupt:", [x/one for x in qaccel], [x/one for x in qgyro], [x/one for x in qmag])
     pyb.delay(100)
     print("Normal:   ", imu.accel.xyz, imu.gyro.xyz, imu.mag.xyz)
     print()
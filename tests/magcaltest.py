@@ -0,0 +1,52 @@
+# Host test of magcal.py. Run under CPython from the repository root:
+# python3 tests/magcaltest.py
+# Samples of a field of 40uT are distorted by hard and soft iron. Rotation through
+# all orientations must converge on the distortion; rotation about one axis only
+# must not converge however small its residual.
+import sys, os, math, random
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+from testutil import check
+from magcal import EllipsoidCalibrator
+
+OFFSETS = (10.0, -5.0, -40.0)                   # Hard iron may exceed the field
+SOFT = ((1.1, 0.05, 0.0), (0.05, 0.95, 0.02), (0.0, 0.02, 1.0))
+
+def distort(v, offsets = OFFSETS):
+    return tuple(sum(SOFT[i][j] * v[j] for j in range(3)) + offsets[i] for i in range(3))
+
+def sphere(cal, offsets = OFFSETS):             # Uniformly distributed directions
+    for _ in range(2000):
+        z = random.uniform(-1, 1)
+        a = random.uniform(0, 2 * math.pi)
+        r = math.sqrt(1 - z * z)
+        cal.update(*distort((40 * r * math.cos(a), 40 * r * math.sin(a), 40 * z), offsets))
+
+random.seed(1)
+cal = EllipsoidCalibrator()
+sphere(cal, (3.0, 2.0, -1.0))
+res = cal.solve()
+check('Small offsets', cal.converged and res is not None and
+      all(abs(res[0][n] - (3.0, 2.0, -1.0)[n]) < 0.5 for n in range(3)))
+
+cal = EllipsoidCalibrator()
+sphere(cal)
+check('Full sphere converges', cal.converged and cal.coverage > 0.8)
+offsets, w = cal.solve()
+check('Full sphere offsets', all(abs(offsets[n] - OFFSETS[n]) < 0.5 for n in range(3)))
+# W * SOFT should be a rotation scaled to unit determinant: W * SOFT * (W * SOFT)' = k * I
+ws = [[sum(w[i][k] * SOFT[k][j] for k in range(3)) for j in range(3)] for i in range(3)]
+g = [[sum(ws[i][k] * ws[j][k] for k in range(3)) for j in range(3)] for i in range(3)]
+check('Full sphere soft iron', all(abs(g[i][j] - (g[0][0] if i == j else 0)) < 0.02 * g[0][0]
+                                   for i in range(3) for j in range(3)))
+
+cal = EllipsoidCalibrator()
+for n in range(2000):                           # Yaw only: a ground vehicle
+    a = 2 * math.pi * n / 200
+    cal.update(*distort((40 * math.cos(a), 40 * math.sin(a), 0.0)))
+check('Planar data: small residual', cal.residual < cal.tolerance)
+check('Planar data does not converge', not cal.converged and cal.coverage < 0.1)
+
+cal.reset()
+check('reset() clears coverage', cal.coverage == 0 and cal.samples == 0)
@@ -0,0 +1,60 @@
+# Host replay of a recorded session through the MPU9150 driver.
+# Run under CPython from the repository root: python3 tests/replaytest.py [logfile]
+# logfile is a log written by imulog.BinaryLogger. If omitted a short session is first
+# recorded from the simulation. The session is replayed as fast as possible through
+# read_all(), the magnetometer and the Vector3d accessors and the throughput reported.
+import sys, os, math, time, tempfile
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+import pyb
+import mpusim
+from mpu9150 import MPU9150
+from imulog import BinaryLogger
+from replay import Replay
+
+def motion(t_us):                               # Slow rotation about z
+    s = t_us / 1000000
+    c, d = math.cos(s), math.sin(s)
+    return (0.0, 0.0, 1.0), (0.0, 0.0, 57.3), (20*c, -20*d, -40.0), 25.0
+
+def record(filename, nsamples = 1000):
+    mpusim.buses[1].device(104).source = motion
+    imu = MPU9150('X')
+    imu.filter_range = 1                        # 100Hz sample rate
+    imu.sample_rate = 9
+    imu.mag_continuous = True
+    log = BinaryLogger(imu, filename)
+    for _ in range(nsamples):
+        log.sample()
+        log.write()
+        pyb.delay(10)
+    log.close()
+
+if len(sys.argv) > 1:
+    logfile = sys.argv[1]
+else:
+    logfile = os.path.join(tempfile.gettempdir(), 'replay.log')
+    record(logfile)
+
+replay = Replay(logfile)
+replay.install()
+imu = MPU9150('X')
+imu.filter_range = 1
+imu.sample_rate = 9
+imu.mag_continuous = True
+replay.rewind()
+period = replay.duration / max(len(replay) - 1, 1)
+samples = 0
+start = time.perf_counter()
+while not replay.done:
+    imu.read_all()
+    imu.accel.last_xyz
+    imu.gyro.last_xyz
+    imu.mag.xyz
+    samples += 1
+    pyb.udelay(int(period))
+dt = time.perf_counter() - start
+print('Replayed {} records ({:.1f}s recorded) as {} samples in {:.2f}s: {:.0f} samples/s'.format(
+      len(replay), replay.duration / 1000000, samples, dt, samples / dt))
+print('Magnetometer stale reads:', imu.mag_stale_count, 'Bus transactions:', mpusim.buses[1].transactions)
@@ -0,0 +1,65 @@
+# Host test of the MPU9150 driver against the simulated bus in the sim directory.
+# Run under CPython from the repository root: python3 tests/simtest.py
+# Reports I2C transactions per sample for each access method.
+import sys, os
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+import pyb
+import mpusim
+from mpu9150 import MPU9150
+
+bus = mpusim.buses[1]
+
+def cost(name, func, n = 100):
+    start = bus.transactions
+    startbytes = bus.bytes
+    for _ in range(n):
+        func()
+        pyb.delay(10)
+    print('{:24s} {:6.2f} transactions {:7.1f} bytes per sample'.format(name,
+          (bus.transactions - start)/n, (bus.bytes - startbytes)/n))
+
+imu = MPU9150('X')
+print('Constructor:', bus.transactions, 'transactions')
+cost('accel.xyz', lambda : imu.accel.xyz)
+cost('accel, gyro, temperature', lambda : (imu.accel.xyz, imu.gyro.xyz, imu.temperature))
+cost('read_all()', imu.read_all)
+cost('mag.xyz', lambda : imu.mag.xyz)
+imu.mag_continuous = True
+cost('mag.xyz mag_continuous', lambda : imu.mag.xyz)
+imu.mag_continuous = False
+imu.filter_range = 1
+imu.mag_master = True
+cost('read_all() mag_master', imu.read_all)
+imu.fifo_start()
+cost('fifo_read() 10mS', imu.fifo_read)
+imu.fifo_stop()
+bus.faults.fail_next(1)
+try:
+    imu.read_all()
+except OSError as e:
+    print('Injected fault raised', type(e).__name__)
+
+import tempfile
+profile = os.path.join(tempfile.gettempdir(), 'mpu9150.json')
+imu.save_profile(profile)
+start = bus.transactions
+t = pyb.micros()
+imu = MPU9150('X', profile = profile)
+print('Warm start:', imu.warm_start, bus.transactions - start, 'transactions',
+      pyb.elapsed_micros(t), 'us')
+
+imu.timeout = 1
+imu.recovery_budget = 5000
+bus.stick()
+t = pyb.micros()
+ok = imu.read_all()
+print('Stuck bus: read_all() returned', ok, 'stale', imu.stale, pyb.elapsed_micros(t), 'us')
+ok = imu.read_all()
+print('Next sample:', ok, 'bus resets', imu.bus_resets)
+bus.device(104).reset()                 # Brownout: configuration lost
+imu.read_all()
+stale = imu.stale
+pyb.delay(10)
+print('Device reset: stale', stale, 'restores', imu.restores, 'next sample', imu.read_all())
@@ -0,0 +1,8 @@
+# Shared helper for the host tests. Run the tests under CPython from the repository
+# root, e.g. python3 tests/simtest.py: the tests directory is then on sys.path.
+import sys
+
+def check(name, cond):
+    print('{:48s} {}'.format(name, 'OK' if cond else 'FAIL'))
+    if not cond:
+        sys.exit(1)
@@ -0,0 +1,113 @@
+# Host test of the transports in transport.py. Run under CPython from the repository
+# root: python3 tests/transporttest.py
+# The Linux i2c-dev transport is run against a loopback which executes the I2C_RDWR
+# messages on FakeI2C devices, so no hardware or kernel module is needed. The driver
+# and MPUGroup are then run on a FakeI2C bus carrying simulated devices.
+import sys, os, ctypes
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, 'sim'), root]
+
+from testutil import check
+import mpusim
+import transport
+from transport import FakeI2C, LinuxI2C, Registers
+from mpu9150 import MPU9150
+from mpugroup import MPUGroup
+
+class LoopbackLinuxI2C(LinuxI2C):
+    '''
+    LinuxI2C whose ioctl() decodes the kernel structures and performs the messages
+    on the devices of a FakeI2C.
+    '''
+    def __init__(self, fake):
+        self.fake = fake
+        self.ioctls = 0
+        super().__init__(1)
+
+    def _open(self, path):
+        return -1
+
+    def _ioctl(self, request, arg):
+        if request != transport._I2C_RDWR:
+            return
+        self.ioctls += 1
+        self.fake.calls += 1
+        msgs = arg.msgs
+        n = 0
+        while n < arg.nmsgs:
+            msg = msgs[n]
+            data = ctypes.string_at(msg.buf, msg.len)
+            dev = self.fake._device(msg.addr)
+            if msg.flags & transport._I2C_M_RD: # Read without a register address
+                ctypes.memmove(msg.buf, bytes(dev.read(0, msg.len)), msg.len)
+                n += 1
+            elif n + 1 < arg.nmsgs and msgs[n + 1].flags & transport._I2C_M_RD and msgs[n + 1].addr == msg.addr:
+                rd = msgs[n + 1]                # Register read with repeated start
+                ctypes.memmove(rd.buf, bytes(dev.read(data[0], rd.len)), rd.len)
+                n += 2
+            else:
+                dev.write(data[0], data[1:])
+                n += 1
+
+# Loopback of a register file
+fake = FakeI2C({0x50 : Registers()})
+fake.mem_write(b'\x01\x02\x03', 0x50, 0x10)
+fake.mem_write(0x55, 0x50, 0x20)
+bufs = [bytearray(3), bytearray(1)]
+fake.mem_read_batch(((bufs[0], 0x50, 0x10), (bufs[1], 0x50, 0x20)))
+check('FakeI2C loopback', bufs == [b'\x01\x02\x03', b'\x55'] and fake.calls == 3)
+try:
+    fake.mem_read(bytearray(1), 0x51, 0)
+    check('FakeI2C absent device raises', False)
+except OSError:
+    check('FakeI2C absent device raises', True)
+
+# Linux i2c-dev message packing
+fake = FakeI2C({0x50 : Registers(), 0x51 : Registers()})
+lin = LoopbackLinuxI2C(fake)
+lin.mem_write(bytearray(range(8)), 0x50, 0)
+lin.mem_write(0xAA, 0x51, 4)
+reqs = [(bytearray(4), 0x50, 2), (bytearray(1), 0x51, 4), (bytearray(2), 0x50, 6)]
+start = lin.ioctls
+lin.mem_read_batch(reqs)
+check('I2C_RDWR batch of 3 reads in one ioctl', lin.ioctls - start == 1 and
+      [r[0] for r in reqs] == [b'\x02\x03\x04\x05', b'\xaa', b'\x06\x07'])
+reqs = [(bytearray(1), 0x50, n % 8) for n in range(30)]
+start = lin.ioctls
+lin.mem_read_batch(reqs)
+check('I2C_RDWR batch of 30 reads in two ioctls', lin.ioctls - start == 2 and
+      all(r[0][0] == n % 8 for n, r in enumerate(reqs)))
+check('Linux scan', lin.scan() == [0x50, 0x51])
+
+# Driver on a FakeI2C bus
+model = mpusim.MPU9150Model()
+fake = FakeI2C({104 : model, 12 : model.mag})
+imu = MPU9150(fake)
+check('Driver on FakeI2C: chip_id', imu.chip_id == 104)
+start = fake.calls
+imu.refresh()
+check('refresh() in one bus call', fake.calls - start == 1)
+model.source = lambda t : ((0.0, 0.0, 1.0), (10.0, 0.0, 0.0), (20.0, 0.0, -40.0), 25.0)
+mpusim.clock.advance(10000)
+imu.read_all()
+ax, ay, az = imu.accel.last_xyz
+check('read_all() on FakeI2C', abs(az - 1) < 0.01 and abs(imu.gyro.last_xyz[0] - 10) < 0.1)
+
+# MPUGroup: two devices on one batched bus
+models = (mpusim.MPU9150Model(), mpusim.MPU9150Model())
+fake = FakeI2C({104 : models[0], 105 : models[1], 12 : models[0].mag})
+imus = []
+for addr in (0, 1):
+    imu = MPU9150(fake, addr)
+    imu.filter_range = 1
+    imu.mag_master = True
+    imus.append(imu)
+group = MPUGroup(imus)
+mpusim.clock.advance(10000)
+start = fake.calls
+group.read()
+check('MPUGroup set in one bus call', fake.calls - start == 1 and all(group.valid))
+imus[1].instrument = True
+start = fake.calls
+group.read()
+check('MPUGroup unbatched when instrumented', fake.calls - start == 2 and all(group.valid))
@@ -0,0 +1,326 @@
+# transport.py I2C transports for the InvenSense drivers
+# Authors Peter Hinch, Sebastian Plamauer
+
+'''
+The MIT License (MIT)
+Copyright (c) 2014 Sebastian Plamauer, oeplse@gmail.com, Peter Hinch
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+'''
+
+# A transport performs register reads and writes on one I2C bus. Its interface is that
+# of pyb.I2C: mem_read(buf, addr, memaddr, timeout) and mem_write(data, addr, memaddr,
+# timeout) where data is an int or a buffer and timeout is in ms. Additionally
+# mem_read_batch() performs a sequence of reads, reset() releases a stuck bus and
+# name identifies the bus in profiles. Transports with batched True perform a batch in
+# one bus operation: other transports perform the reads in turn.
+# PybI2C uses the pyb.I2C methods directly so that reads cost no more than before and
+# may be done in interrupt handlers. LinuxI2C needs CPython (ctypes and fcntl).
+
+try:
+    import pyb
+except ImportError:
+    pyb = None
+try:
+    import machine
+    from time import sleep_us
+except ImportError:
+    machine = None
+try:
+    import os
+    import ctypes
+    import fcntl
+except ImportError:                             # MicroPython
+    ctypes = None
+
+_ENODEV = 19                                    # MicroPython's error when a device does not acknowledge
+
+def _unlock(scl, sda, out_od, udelay):
+    '''
+    Release a bus held by a slave which stopped mid byte with SDA low: clock SCL
+    until SDA is released and generate a STOP. scl is an open drain output, sda an input.
+    '''
+    scl.value(1)
+    for _ in range(9):
+        if sda.value():
+            break
+        scl.value(0)
+        udelay(5)
+        scl.value(1)
+        udelay(5)
+    sda.init(out_od)                            # STOP: SDA rises while SCL is high
+    scl.value(0)
+    sda.value(0)
+    udelay(5)
+    scl.value(1)
+    udelay(5)
+    sda.value(1)
+
+class Transport(object):
+    '''
+    Base class of the transports. Subclasses implement mem_read(), mem_write() and
+    scan(), and may override mem_read_batch() and reset().
+    '''
+    batched = False
+    name = None
+
+    def mem_read_batch(self, reqs, timeout = 10):
+        '''
+        reqs is a sequence of (buf, addr, memaddr). Fill each buffer from the
+        registers at memaddr of the device at addr.
+        '''
+        for buf, addr, memaddr in reqs:
+            self.mem_read(buf, addr, memaddr, timeout = timeout)
+
+    def reset(self):                            # Release a stuck bus and re-initialise
+        pass
+
+class PybI2C(Transport):
+    '''
+    The Pyboard's I2C interfaces: side is 'X' or 'Y'.
+    '''
+    _pins = {'X' : ('X9', 'X10'), 'Y' : ('Y9', 'Y10')} # SCL, SDA
+    def __init__(self, side):
+        try:
+            self.name = side.upper()
+            bus = {'X':1, 'Y':2}[self.name]
+        except (KeyError, AttributeError):
+            raise ValueError('I2C side must be X or Y')
+        self._i2c = pyb.I2C(bus, pyb.I2C.MASTER)
+        self.mem_read = self._i2c.mem_read
+        self.mem_write = self._i2c.mem_write
+        self.scan = self._i2c.scan
+
+    def reset(self):
+        self._i2c.deinit()
+        scl_name, sda_name = self._pins[self.name]
+        _unlock(pyb.Pin(scl_name, pyb.Pin.OUT_OD), pyb.Pin(sda_name, pyb.Pin.IN),
+                pyb.Pin.OUT_OD, pyb.udelay)
+        self._i2c.init(pyb.I2C.MASTER)
+
+class MachineI2C(Transport):
+    '''
+    A machine.I2C or machine.SoftI2C instance. The timeout is that set when i2c was
+    created. To release a stuck bus pass the scl and sda pin ids: i2c is then
+    re-initialised with these and freq.
+    '''
+    def __init__(self, i2c, scl = None, sda = None, freq = 400000, name = 'machine'):
+        self._i2c = i2c
+        self._scl = scl
+        self._sda = sda
+        self._freq = freq
+        self.name = name
+        self._buf1 = bytearray(1)               # mem_write() of an int does not allocate
+
+    def mem_read(self, buf, addr, memaddr, timeout = 10):
+        self._i2c.readfrom_mem_into(addr, memaddr, buf)
+
+    def mem_write(self, data, addr, memaddr, timeout = 10):
+        if type(data) is int:
+            self._buf1[0] = data
+            data = self._buf1
+        self._i2c.writeto_mem(addr, memaddr, data)
+
+    def scan(self):
+        return self._i2c.scan()
+
+    def reset(self):
+        if self._scl is None or self._sda is None:
+            return
+        scl = machine.Pin(self._scl, machine.Pin.OPEN_DRAIN, value = 1)
+        sda = machine.Pin(self._sda, machine.Pin.IN)
+        _unlock(scl, sda, machine.Pin.OPEN_DRAIN, sleep_us)
+        self._i2c.init(scl = machine.Pin(self._scl), sda = machine.Pin(self._sda), freq = self._freq)
+
+# Linux i2c-dev. Each register read is a write message holding the register address
+# followed by a read message, with a repeated start between them. The I2C_RDWR ioctl
+# takes up to 42 messages: a batch of up to 21 reads is performed in one system call.
+_I2C_TIMEOUT = 0x0702                           # ioctl requests from linux/i2c-dev.h
+_I2C_RDWR = 0x0707
+_I2C_M_RD = 0x0001
+_MAX_MSGS = 42                                  # I2C_RDWR_IOCTL_MAX_MSGS
+
+if ctypes is not None:
+    class _I2CMsg(ctypes.Structure):            # struct i2c_msg
+        _fields_ = [('addr', ctypes.c_uint16), ('flags', ctypes.c_uint16),
+                    ('len', ctypes.c_uint16), ('buf', ctypes.c_void_p)]
+
+    class _RdwrData(ctypes.Structure):          # struct i2c_rdwr_ioctl_data
+        _fields_ = [('msgs', ctypes.POINTER(_I2CMsg)), ('nmsgs', ctypes.c_uint32)]
+
+class LinuxI2C(Transport):
+    '''
+    An i2c-dev bus: bus is the bus number or the device path e.g. '/dev/i2c-1'.
+    '''
+    batched = True
+    def __init__(self, bus):
+        if ctypes is None:
+            raise ValueError('Linux I2C requires CPython')
+        self.name = '/dev/i2c-{}'.format(bus) if isinstance(bus, int) else bus
+        self._msgs = (_I2CMsg * _MAX_MSGS)()
+        self._data = _RdwrData(self._msgs, 0)
+        self._regs = (ctypes.c_uint8 * (_MAX_MSGS // 2))() # Register address of each read
+        self._timeout = None
+        self._fd = self._open(self.name)
+
+    def _open(self, path):
+        return os.open(path, os.O_RDWR)
+
+    def _ioctl(self, request, arg):
+        fcntl.ioctl(self._fd, request, arg)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _set_timeout(self, timeout):            # Kernel units are 10ms
+        if timeout != self._timeout:
+            self._ioctl(_I2C_TIMEOUT, max(1, (timeout + 9) // 10))
+            self._timeout = timeout
+
+    def _msg(self, n, addr, flags, buf):        # Fill message n: buf must remain referenced until the ioctl
+        msg = self._msgs[n]
+        msg.addr = addr
+        msg.flags = flags
+        msg.len = len(buf)
+        msg.buf = ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf))
+
+    def _transfer(self, nmsgs):
+        self._data.nmsgs = nmsgs
+        self._ioctl(_I2C_RDWR, self._data)
+
+    def mem_read(self, buf, addr, memaddr, timeout = 10):
+        self.mem_read_batch(((buf, addr, memaddr),), timeout)
+
+    def mem_read_batch(self, reqs, timeout = 10):
+        self._set_timeout(timeout)
+        regs = self._regs
+        n = 0
+        for buf, addr, memaddr in reqs:
+            if n == _MAX_MSGS:
+                self._transfer(n)
+                n = 0
+            k = n // 2
+            regs[k] = memaddr
+            msg = self._msgs[n]
+            msg.addr = addr
+            msg.flags = 0
+            msg.len = 1
+            msg.buf = ctypes.addressof(regs) + k
+            self._msg(n + 1, addr, _I2C_M_RD, buf)
+            n += 2
+        if n:
+            self._transfer(n)
+
+    def mem_write(self, data, addr, memaddr, timeout = 10):
+        self._set_timeout(timeout)
+        if type(data) is int:
+            data = (data,)
+        buf = bytearray(1 + len(data))
+        buf[0] = memaddr
+        buf[1:] = bytes(data)
+        self._msg(0, addr, 0, buf)
+        self._transfer(1)
+
+    def scan(self):                             # Devices acknowledging a one byte read
+        buf = bytearray(1)
+        found = []
+        for addr in range(0x08, 0x78):
+            self._msg(0, addr, _I2C_M_RD, buf)
+            try:
+                self._transfer(1)
+            except OSError:
+                continue
+            found.append(addr)
+        return found
+
+class Registers(object):
+    '''
+    A device for FakeI2C: a register file with address auto increment. Values
+    written are read back.
+    '''
+    def __init__(self, size = 256):
+        self.regs = bytearray(size)
+
+    def read(self, memaddr, nbytes):
+        return self.regs[memaddr : memaddr + nbytes]
+
+    def write(self, memaddr, data):
+        self.regs[memaddr : memaddr + len(data)] = data
+
+class FakeI2C(Transport):
+    '''
+    Loopback transport for testing without hardware. devices maps each address to
+    an object with read(memaddr, nbytes) and write(memaddr, data) methods, e.g. a
+    Registers instance. calls counts operations on the bus: a batch counts once.
+    '''
+    batched = True
+    def __init__(self, devices = None, name = 'fake'):
+        self.devices = {} if devices is None else devices
+        self.name = name
+        self.calls = 0
+        self.transactions = 0
+        self.bytes = 0
+
+    def _device(self, addr):
+        try:
+            return self.devices[addr]
+        except KeyError:
+            raise OSError(_ENODEV)
+
+    def _read(self, buf, addr, memaddr):
+        self.transactions += 1
+        self.bytes += len(buf)
+        buf[:] = self._device(addr).read(memaddr, len(buf))
+
+    def mem_read(self, buf, addr, memaddr, timeout = 10):
+        self.calls += 1
+        self._read(buf, addr, memaddr)
+
+    def mem_read_batch(self, reqs, timeout = 10):
+        self.calls += 1
+        for buf, addr, memaddr in reqs:
+            self._read(buf, addr, memaddr)
+
+    def mem_write(self, data, addr, memaddr, timeout = 10):
+        if type(data) is int:
+            data = bytes((data,))
+        self.calls += 1
+        self.transactions += 1
+        self.bytes += len(data)
+        self._device(addr).write(memaddr, bytes(data))
+
+    def scan(self):
+        return sorted(self.devices)
+
+def get_transport(bus):
+    '''
+    Return the transport for bus: 'X' or 'Y' (Pyboard), a Linux bus number or
+    device path, a machine.I2C or SoftI2C instance, or a Transport which is returned
+    unchanged.
+    '''
+    if isinstance(bus, Transport):
+        return bus
+    if isinstance(bus, str) and bus.startswith('/dev/') or isinstance(bus, int):
+        return LinuxI2C(bus)
+    if isinstance(bus, str):
+        if pyb is None:
+            raise ValueError('I2C side {} requires the pyb module'.format(bus))
+        return PybI2C(bus)
+    if hasattr(bus, 'readfrom_mem_into'):
+        return MachineI2C(bus)
+    raise ValueError('Unsupported I2C bus {}'.format(bus))
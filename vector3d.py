@@ -1,7 +1,9 @@
 # vector3d.py 3D vector class for use in inertial measurement unit drivers
 # Authors Peter Hinch, Sebastian Plamauer
 
-# V0.5 17th June 2015
+# V0.6 Allocation free accessors using a precomputed transform
+# V0.7 Corrected values and derived quantities are computed once per sample
+# V0.8 Mounting matrix replaces transposition and scaling in the fused transform
 
 '''
 The MIT License (MIT)
@@ -23,84 +25,287 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
 
-import pyb
+try:
+    import pyb
+except ImportError:                             # Linux or a machine port
+    import pybcompat as pyb
+from array import array
 from math import sqrt, degrees, acos, atan2
 
 def default_wait():
     pyb.delay(50)
 
+def _matmul(a, b):                              # Product of 3x3 matrices as tuples of rows
+    return tuple(tuple(sum(a[n][j] * b[j][k] for j in range(3)) for k in range(3)) for n in range(3))
+
+_IDENTITY = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
 class Vector3d(object):
     '''
     Represents a vector in a 3D space using Cartesian coordinates.
     Internally uses sensor relative coordinates.
     Returns vehicle-relative x, y and z values.
+    The vehicle relative vector is M * A * W * (_vector - cal) where W is the
+    optional soft iron matrix, A the alignment of the sensor's axes with those of
+    the IMU (identity except for the magnetometer) and M the mounting matrix
+    (default: formed from transposition and scaling). These are combined whenever
+    one changes into a matrix _mat and offset _offs: vehicle axis n is
+    _mat[3n] * _vector[0] + _mat[3n + 1] * _vector[1] + _mat[3n + 2] * _vector[2] - _offs[n]
+    If each row of _mat has one nonzero element, as with an orthogonal mounting and
+    no soft iron correction, axis n is _vector[_index[n]] * _coef[n] - _offs[n].
+    Corrected values and derived quantities are cached until the driver stores a
+    new sample in _vector and clears _valid.
     '''
-    def __init__(self, transposition, scaling, update_function):
-        self._vector = [0,0,0]
+    __slots__ = ('_vector', '_ivector', '_cal', '_align', '_mount', '_index', '_coef', '_offs',
+                 '_out', '_softiron', '_mat', '_qfactor', '_qbits', '_qmat', '_qoffs',
+                 '_qshift', '_valid', '_derived', 'update', 'read')
+
+    def __init__(self, transposition, scaling, update_function, align = None):
+        self._vector = array('f', (0, 0, 0))
         self._ivector = [0,0,0]
-        self.cal = (0,0,0)
         self.argcheck(transposition, "Transposition")
         self.argcheck(scaling, "Scaling")
         if (len(transposition) != len(set(transposition))) or min(transposition) < 0 or max(transposition) > 2:
             raise ValueError('Transpose indices must be unique and in range 0-2')
-        self._scale = scaling
-        self._transpose = transposition
+        self._mount = tuple(tuple(scaling[n] if k == transposition[n] else 0 for k in range(3)) for n in range(3))
+        self._align = _IDENTITY if align is None else tuple(tuple(row) for row in align)
+        self._index = None                      # Fused transform
+        self._coef = array('f', (0, 0, 0))
+        self._offs = array('f', (0, 0, 0))
+        self._mat = array('f', [0]*9)
+        self._out = array('f', (0, 0, 0))       # Corrected values of the current sample
+        self._derived = array('f', (0, 0, 0))   # Magnitude, inclination, azimuth
+        self._valid = 0                         # Bits: _out, then each of _derived
+        self._softiron = None
+        self._qfactor = None                    # Sensor units per LSB for each sensor axis
+        self._qbits = 16                        # Fraction bits of qxyz_into() values
+        self._qmat = array('i', [0]*9)          # Integer transform of raw values
+        self._qoffs = array('i', (0, 0, 0))
+        self._qshift = 0
+        self.cal = (0,0,0)
         self.update = update_function
+        self.read = update_function             # Always reads the device: update may return a latched sample
 
     def argcheck(self, arg, name):
         if len(arg) != 3 or not (type(arg) is list or type(arg) is tuple):
             raise ValueError(name + ' must be a 3 element list or tuple')
 
+    def _matcheck(self, matrix, name):
+        self.argcheck(matrix, name)
+        for row in matrix:
+            self.argcheck(row, name + " row")
+        return tuple(tuple(row) for row in matrix)
+
+    @property
+    def cal(self):                              # Calibration offsets in sensor coordinates
+        return self._cal
+
+    @cal.setter
+    def cal(self, offsets):
+        self.argcheck(offsets, "Calibration")
+        self._cal = tuple(offsets)
+        self._compute()
+
+    @property
+    def softiron(self):                         # Soft iron correction matrix or None
+        return self._softiron
+
+    @softiron.setter
+    def softiron(self, matrix):
+        self._softiron = None if matrix is None else self._matcheck(matrix, "Soft iron matrix")
+        self._compute()
+
+    @property
+    def mounting(self):                         # Matrix mapping IMU axes to vehicle axes
+        return self._mount
+
+    @mounting.setter
+    def mounting(self, matrix):
+        self._mount = self._matcheck(matrix, "Mounting matrix")
+        self._compute()
+
+    @property
+    def matrix(self):                           # Fused transform (matrix, offsets) applied to sensor units
+        mat = self._mat
+        return tuple(tuple(mat[3*n + k] for k in range(3)) for n in range(3)), tuple(self._offs)
+
+    def _compute(self):                         # Precompute the fused transform
+        m = _matmul(self._mount, self._align)
+        if self._softiron is not None:          # Soft iron correction is in sensor coordinates
+            m = _matmul(m, self._softiron)
+        offsets = self._cal
+        index = []                              # Column of the sole nonzero element of each row
+        for n in range(3):
+            offs = 0
+            col = None
+            for k in range(3):
+                v = m[n][k]
+                self._mat[3*n + k] = v
+                offs += v * offsets[k]
+                if v:
+                    col = k if col is None else -1
+            self._offs[n] = offs
+            if col is not None and col >= 0:
+                self._coef[n] = m[n][col]
+                index.append(col)
+        self._index = tuple(index) if len(index) == 3 else None
+        self._valid = 0
+        self._qcompute()
+
+    def _fixed(self, factors, qbits):           # Set sensor units per LSB and qxyz_into() format
+        self._qfactor = tuple(factors)
+        self._qbits = qbits
+        self._qcompute()
+
+    def _qcompute(self):
+        '''
+        Precompute the integer form of the fused transform for qxyz_into(). Raw values
+        are multiplied by _qmat and shifted right by _qshift (left if negative). The
+        shift is the largest for which no intermediate result exceeds 30 bits: larger
+        values would not be small integers on 32 bit platforms and would use the heap.
+        '''
+        factor = self._qfactor
+        if factor is None:
+            return
+        mat = [self._mat[n] * factor[n % 3] for n in range(9)] # Vehicle units per LSB
+        shift = 24
+        while shift > -24:
+            mult = (1 << self._qbits) * 2.0 ** shift
+            fits = True
+            for n in range(3):
+                total = abs(self._offs[n]) * mult + 1
+                for k in range(3):
+                    total += abs(round(mat[3*n + k] * mult)) * 32768
+                fits = fits and total < (1 << 30)
+            if fits:
+                break
+            shift -= 1
+        half = 1 << (shift - 1) if shift > 0 else 0 # Rounding
+        for n in range(3):
+            for k in range(3):
+                self._qmat[3*n + k] = round(mat[3*n + k] * mult)
+            self._qoffs[n] = round(-self._offs[n] * mult) + half
+        self._qshift = shift
+
     def calibrate(self, stopfunc, waitfunc = default_wait):
-        self.update()
-        maxvec = self._vector[:]                # Initialise max and min lists with current values
-        minvec =self._vector[:]
+        self.read()
+        maxvec = self._vector[:]                # Initialise max and min arrays with current values
+        minvec = self._vector[:]
+        vec = self._vector
         while not stopfunc():
             waitfunc()
-            self.update()
-            maxvec = list(map(max, maxvec, self._vector))
-            minvec = list(map(min, minvec, self._vector))
-        self.cal = tuple(map(lambda a, b: (a +b)/2, maxvec, minvec))
+            self.read()
+            for n in range(3):
+                if vec[n] > maxvec[n]:
+                    maxvec[n] = vec[n]
+                elif vec[n] < minvec[n]:
+                    minvec[n] = vec[n]
+        self.cal = ((maxvec[0] + minvec[0])/2, (maxvec[1] + minvec[1])/2, (maxvec[2] + minvec[2])/2)
 
-    @property
-    def _calvector(self):                       # Vector adjusted for calibration offsets
-        return list(map(lambda val, offset : val - offset, self._vector, self.cal))
+    def _fill(self, buf):                       # Apply transform to current values
+        vec = self._vector
+        offs = self._offs
+        t = self._index
+        if t is None:
+            mat = self._mat
+            buf[0] = mat[0]*vec[0] + mat[1]*vec[1] + mat[2]*vec[2] - offs[0]
+            buf[1] = mat[3]*vec[0] + mat[4]*vec[1] + mat[5]*vec[2] - offs[1]
+            buf[2] = mat[6]*vec[0] + mat[7]*vec[1] + mat[8]*vec[2] - offs[2]
+            return
+        coef = self._coef
+        buf[0] = vec[t[0]] * coef[0] - offs[0]
+        buf[1] = vec[t[1]] * coef[1] - offs[1]
+        buf[2] = vec[t[2]] * coef[2] - offs[2]
+
+    def _xyz(self):                             # Corrected values, computed once per sample
+        if not self._valid & 1:
+            self._fill(self._out)
+            self._valid |= 1
+        return self._out
 
     @property
     def x(self):                                # Corrected, vehicle relative floating point values
         self.update()
-        return self._calvector[self._transpose[0]] * self._scale[0]
+        return self._xyz()[0]
 
     @property
     def y(self):
         self.update()
-        return self._calvector[self._transpose[1]] * self._scale[1]
+        return self._xyz()[1]
 
     @property
     def z(self):
         self.update()
-        return self._calvector[self._transpose[2]] * self._scale[2]
+        return self._xyz()[2]
 
     @property
     def xyz(self):
         self.update()
-        return (self._calvector[self._transpose[0]] * self._scale[0],
-                self._calvector[self._transpose[1]] * self._scale[1],
-                self._calvector[self._transpose[2]] * self._scale[2])
+        return self.last_xyz
 
     @property
-    def magnitude(self):
-        x, y, z = self.xyz # All measurements must correspond to the same instant
-        return sqrt(x**2 + y**2 + z**2)
+    def last_xyz(self):                         # Values from the most recent update: no device access
+        out = self._xyz()
+        return (out[0], out[1], out[2])
+
+    def xyz_into(self, buf):
+        '''
+        Update and write the corrected x, y and z values into buf, typically an
+        array('f') of 3 elements, without allocation.
+        '''
+        self.update()
+        self._fill(buf)
+        return buf
+
+    def last_xyz_into(self, buf):               # As xyz_into() without device access
+        self._fill(buf)
+        return buf
+
+    def qxyz_into(self, buf):
+        '''
+        Write the corrected vehicle relative values of the most recent raw reading
+        into buf as integers in units of 2**-qbits of g, degrees/s or uT. Uses integer
+        arithmetic only and does not access the device: may be called in an interrupt
+        handler after get_accel_irq() etc.
+        '''
+        v = self._ivector
+        m = self._qmat
+        o = self._qoffs
+        s = self._qshift
+        if s >= 0:
+            buf[0] = (m[0]*v[0] + m[1]*v[1] + m[2]*v[2] + o[0]) >> s
+            buf[1] = (m[3]*v[0] + m[4]*v[1] + m[5]*v[2] + o[1]) >> s
+            buf[2] = (m[6]*v[0] + m[7]*v[1] + m[8]*v[2] + o[2]) >> s
+        else:
+            s = -s
+            buf[0] = (m[0]*v[0] + m[1]*v[1] + m[2]*v[2] + o[0]) << s
+            buf[1] = (m[3]*v[0] + m[4]*v[1] + m[5]*v[2] + o[1]) << s
+            buf[2] = (m[6]*v[0] + m[7]*v[1] + m[8]*v[2] + o[2]) << s
+        return buf
 
     @property
-    def elevation(self):
-        return 90 - self.inclination
+    def qtransform(self):                       # (multipliers, offsets, shift) for use in viper code
+        return self._qmat, self._qoffs, self._qshift
+
+    def _magnitude(self):
+        if not self._valid & 2:
+            out = self._xyz()
+            self._derived[0] = sqrt(out[0]*out[0] + out[1]*out[1] + out[2]*out[2])
+            self._valid |= 2
+        return self._derived[0]
+
+    @property
+    def magnitude(self):
+        self.update()                           # All measurements must correspond to the same instant
+        return self._magnitude()
 
     @property
     def inclination(self):
-        x, y, z = self.xyz
-        return degrees(acos(z / sqrt(x**2 + y**2 + z**2)))
+        self.update()
+        if not self._valid & 4:
+            self._derived[1] = degrees(acos(self._xyz()[2] / self._magnitude()))
+            self._valid |= 4
+        return self._derived[1]
 
     @property
     def elevation(self):
@@ -108,8 +313,12 @@ class Vector3d(object):
 
     @property
     def azimuth(self):
-        x, y, z = self.xyz
-        return degrees(atan2(y, x))
+        self.update()
+        if not self._valid & 8:
+            out = self._xyz()
+            self._derived[2] = degrees(atan2(out[1], out[0]))
+            self._valid |= 8
+        return self._derived[2]
 
     # Raw uncorrected integer values from sensor
     @property
@@ -128,9 +337,17 @@ class Vector3d(object):
     def ixyz(self):
         return self._ivector
     @property
-    def transpose(self):
-        return tuple(self._transpose)
+    def transpose(self):                        # Transposition of the mounting matrix or None if not orthogonal
+        res = []
+        for row in self._mount:
+            nz = [k for k in range(3) if row[k]]
+            if len(nz) != 1:
+                return None
+            res.append(nz[0])
+        return tuple(res) if len(set(res)) == 3 else None
     @property
-    def scale(self):
-        return tuple(self._scale)
-
+    def scale(self):                            # Scaling of the mounting matrix or None if not orthogonal
+        t = self.transpose
+        if t is None:
+            return None
+        return tuple(self._mount[n][t[n]] for n in range(3))